@@ -0,0 +1,182 @@
+import argparse
+import random
+import time
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# <ai_context>
+# Vectorized evaluation for the "Batch Calculator" tool (tools.py).
+# A batch is a list of {"op", "a", "b"} operations. An operand is a number, or "$n" for the result of operation n
+# (0-based, earlier in the batch), which lets an agent chain steps (e.g. total -> per-person share -> with tip) in one call.
+# `evaluate_batch` parses the batch once into NumPy arrays, assigns each operation a depth (1 + the deepest operation it
+# references) and evaluates each depth in one vectorized pass, so a batch of N independent operations is a single pass.
+# Failures are per element: division by zero, non-finite results, bad references and operations that depend on a failed
+# one get an error entry in their slot; every other result is still returned.
+# `python batch_calculator.py` benchmarks it against calling `tools.calculator` once per operation.
+# </ai_context>
+
+# Operation codes, in the order their results are listed in `_apply_operations`
+OPERATIONS = ("add", "subtract", "multiply", "divide")
+_OPERATION_CODES = {op: code for code, op in enumerate(OPERATIONS)}
+REFERENCE_PREFIX = "$"
+
+Operand = Union[float, int, str]
+
+
+def _parse_operand(operand: Operand, operation_index: int) -> Tuple[float, int]:
+    """
+    Returns (literal value, referenced operation index); the index is -1 for literals.
+
+    Raises:
+        ValueError: If the operand is neither a number nor a reference to an earlier operation.
+    """
+    if operand.__class__ is float:
+        return operand, -1
+    if isinstance(operand, str) and operand.startswith(REFERENCE_PREFIX):
+        reference_index = int(operand[len(REFERENCE_PREFIX) :])
+        # Only earlier results can be referenced, so a batch can never contain a cycle
+        if not 0 <= reference_index < operation_index:
+            raise ValueError(f"Operand '{operand}' must reference an earlier operation")
+        return np.nan, reference_index
+    return float(operand), -1
+
+
+def _apply_operations(op_codes: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Evaluates every element's operation; division by zero yields inf/nan here and is reported by the caller."""
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        return np.select(
+            [op_codes == code for code in range(len(OPERATIONS))],
+            [a + b, a - b, a * b, np.divide(a, b)],
+            default=np.nan,
+        )
+
+
+def evaluate_batch(operations: Sequence[Mapping[str, Any]]) -> List[Union[float, Dict[str, str]]]:
+    """
+    Evaluates a batch of calculator operations.
+
+    Args:
+        operations: {"op": "add" | "subtract" | "multiply" | "divide", "a": operand, "b": operand} dicts.
+
+    Returns:
+        One entry per operation, in order: the result, or {"error": ...} for an operation that could not be evaluated.
+    """
+    operation_count = len(operations)
+    if not operation_count:
+        return []
+    # Parse into plain lists first (element-wise writes into NumPy arrays are slow), then convert once
+    op_codes_list = [-1] * operation_count
+    literals_list = [[np.nan] * operation_count, [np.nan] * operation_count]
+    references_list = [[-1] * operation_count, [-1] * operation_count]
+    depths_list = [0] * operation_count
+    errors: List[Optional[str]] = [None] * operation_count
+
+    # This is the only per-operation Python loop
+    for operation_index, operation in enumerate(operations):
+        try:
+            op_code = _OPERATION_CODES[operation["op"]]
+            parsed_operands = [_parse_operand(operation["a"], operation_index), _parse_operand(operation["b"], operation_index)]
+        except (KeyError, TypeError, ValueError) as e:
+            errors[operation_index] = f"Invalid operation: {e}"
+            continue
+        op_codes_list[operation_index] = op_code
+        for operand_slot, (literal, reference_index) in enumerate(parsed_operands):
+            literals_list[operand_slot][operation_index] = literal
+            references_list[operand_slot][operation_index] = reference_index
+            if reference_index >= 0:
+                depths_list[operation_index] = max(depths_list[operation_index], depths_list[reference_index] + 1)
+
+    op_codes = np.array(op_codes_list, dtype=np.int8)
+    literals = np.array(literals_list, dtype=np.float64)
+    references = np.array(references_list, dtype=np.int64)
+    depths = np.array(depths_list, dtype=np.int64)
+    results = np.full(operation_count, np.nan)
+    failed = np.array([error is not None for error in errors], dtype=bool)
+
+    for depth in range(int(depths.max()) + 1):
+        indices = np.flatnonzero((depths == depth) & ~failed)
+        if not indices.size:
+            continue
+        operand_references = references[:, indices]
+        is_reference = operand_references >= 0
+        # Literal operands come from the parsed values, references from results computed at a lower depth
+        operands = np.where(is_reference, results[operand_references], literals[:, indices])
+        upstream_failed = (is_reference & failed[operand_references]).any(axis=0)
+
+        level_op_codes = op_codes[indices]
+        level_results = _apply_operations(level_op_codes, operands[0], operands[1])
+        divide_by_zero = (level_op_codes == _OPERATION_CODES["divide"]) & (operands[1] == 0)
+        not_finite = ~np.isfinite(level_results)
+
+        results[indices] = level_results
+        for position in np.flatnonzero(upstream_failed | divide_by_zero | not_finite):
+            operation_index = int(indices[position])
+            if upstream_failed[position]:
+                failed_references = operand_references[:, position][failed[operand_references[:, position]]]
+                errors[operation_index] = f"Depends on failed operation {REFERENCE_PREFIX}{int(failed_references[0])}"
+            elif divide_by_zero[position]:
+                errors[operation_index] = "Division by zero"
+            else:
+                errors[operation_index] = "Result is not a finite number"
+            failed[operation_index] = True
+
+    return [
+        {"error": error} if error is not None else result
+        for result, error in zip(results.tolist(), errors)
+    ]
+
+
+def _make_benchmark_batch(operation_count: int, seed: int = 7) -> List[Dict[str, Any]]:
+    """Random line-item style operations; every fourth one chains on the previous result."""
+    rng = random.Random(seed)
+    operations = []
+    for operation_index in range(operation_count):
+        op = rng.choice(OPERATIONS)
+        a: Operand = f"{REFERENCE_PREFIX}{operation_index - 1}" if operation_index % 4 == 3 else rng.uniform(1, 500)
+        operations.append({"op": op, "a": a, "b": rng.uniform(1, 20)})
+    return operations
+
+
+def _run_per_item(operations: Sequence[Mapping[str, Any]]) -> List[float]:
+    """Baseline: one `calculator` call per operation, resolving references as it goes."""
+    from tools import calculator
+
+    results: List[float] = []
+    for operation in operations:
+        operands = [
+            results[int(operand[1:])] if isinstance(operand, str) else operand
+            for operand in (operation["a"], operation["b"])
+        ]
+        results.append(calculator(operation["op"], *operands))
+    return results
+
+
+# Micro-benchmark: batch evaluation vs one calculator call per operation
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the batch calculator against per-item calls.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--repeats", type=int, default=20)
+    # Latency of one tool round trip (model -> tool -> model), to estimate end-to-end time; 0 = compute time only
+    parser.add_argument("--round-trip-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        operations = _make_benchmark_batch(size)
+        assert np.allclose(evaluate_batch(operations), _run_per_item(operations))
+        timings = {}
+        for name, run in (("per-item", _run_per_item), ("batch", evaluate_batch)):
+            started_at = time.perf_counter()
+            for _ in range(args.repeats):
+                run(operations)
+            timings[name] = (time.perf_counter() - started_at) / args.repeats
+        print(
+            f"{size:>6} ops: per-item {timings['per-item'] * 1000:8.3f} ms ({size} tool calls), "
+            f"batch {timings['batch'] * 1000:8.3f} ms (1 tool call)"
+        )
+        if args.round_trip_ms:
+            print(
+                f"{'':>6}      with {args.round_trip_ms:.0f} ms per tool round trip: "
+                f"per-item {timings['per-item'] * 1000 + size * args.round_trip_ms:,.0f} ms, "
+                f"batch {timings['batch'] * 1000 + args.round_trip_ms:,.0f} ms"
+            )
@@ -0,0 +1,297 @@
+import argparse
+import atexit
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from row_scheduler import batch_retries
+
+# <ai_context>
+# Offline batch mode: regenerate suggestions for a JSONL file of archived conversations (e.g. to compare prompt versions).
+# Each input line is {"salutation", "last_name", "conversation", "current_date_time", "unit_open_issues_max_limit"},
+# optionally with "id" (defaults to the line number) and "unit_id". Records are read lazily and at most 2x the pool size
+# are in flight, so the input can be arbitrarily large.
+# The pool is `--pool thread` (default; the pipeline is I/O bound) or `--pool process` (spawned workers, each warmed
+# once). Every finished record is appended to the output JSONL and flushed right away, in completion order:
+# {"id", "suggestion", "error", "seconds"}; a failed record gets its error and the batch goes on.
+# The output file doubles as the checkpoint: on restart, records whose id already has a successful line are skipped and
+# a line cut off by the crash is truncated, so re-running the same command resumes. Failed records are retried on
+# resume; readers should keep the last line per id.
+# Progress (done/total, records/s, ETA, errors) goes to stderr every --progress-interval seconds.
+# Prompt calls can be replayed offline with PROMPT_CASSETTE (prompt_cassette.py) in both pool kinds, and use the
+# eval/batch retry policy of row_scheduler.py when throttled. Recording (PROMPT_CASSETTE_MODE=record) works in both too:
+# each process worker records into its own part file, saved when the worker exits, and the parent merges the parts into
+# the cassette once the pool has shut down.
+# Usage: python batch_suggestions.py conversations.jsonl suggestions.jsonl --workers 16
+# </ai_context>
+
+RECORD_FIELDS = ("salutation", "last_name", "conversation", "current_date_time", "unit_open_issues_max_limit")
+# Records queued or running per worker, so the pool never idles between completions
+IN_FLIGHT_PER_WORKER = 2
+DEFAULT_PROGRESS_INTERVAL_SECONDS = 5.0
+
+# The worker's entered cassette (PROMPT_CASSETTE); held so it is not garbage collected, which would restore the real
+# `braintrust.invoke` as soon as init_worker returned
+_worker_cassette = None
+
+
+def _is_recording_cassette() -> bool:
+    from prompt_cassette import CASSETTE_MODE_ENV_VAR, CASSETTE_PATH_ENV_VAR
+
+    return bool(os.environ.get(CASSETTE_PATH_ENV_VAR)) and os.environ.get(CASSETTE_MODE_ENV_VAR) == "record"
+
+
+@dataclass(frozen=True)
+class BatchProgress:
+    """Counts for the progress line and the final summary."""
+
+    total: int
+    skipped: int
+    completed: int
+    errors: int
+    elapsed_seconds: float
+
+    @property
+    def records_per_second(self) -> float:
+        return self.completed / self.elapsed_seconds if self.elapsed_seconds > 0 else 0.0
+
+    @property
+    def eta_seconds(self) -> Optional[float]:
+        remaining = self.total - self.skipped - self.completed
+        return remaining / self.records_per_second if self.records_per_second > 0 else None
+
+
+def format_progress(progress: BatchProgress) -> str:
+    """One-line progress report: done/total, throughput, ETA and errors."""
+    done = progress.skipped + progress.completed
+    percent = done / progress.total * 100 if progress.total else 100.0
+    eta = "--:--" if progress.eta_seconds is None else time.strftime("%H:%M:%S", time.gmtime(progress.eta_seconds))
+    return (
+        f"{done}/{progress.total} ({percent:.1f}%) | {progress.records_per_second:.2f} records/s | ETA {eta} | "
+        f"errors {progress.errors} | resumed past {progress.skipped}"
+    )
+
+
+def load_checkpoint(output_path: Path) -> Set[str]:
+    """
+    Returns the ids already completed successfully in `output_path`, truncating a last line left partial by a crash.
+    """
+    if not output_path.exists():
+        return set()
+    completed_ids: Set[str] = set()
+    valid_bytes = 0
+    with output_path.open("rb") as output_file:
+        for line in output_file:
+            # Only the last line can be cut off; it and anything unparsable after the last good line are dropped
+            if not line.endswith(b"\n"):
+                break
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            valid_bytes += len(line)
+            if result.get("error") is None:
+                completed_ids.add(str(result["id"]))
+    if valid_bytes < output_path.stat().st_size:
+        with output_path.open("r+b") as output_file:
+            output_file.truncate(valid_bytes)
+    return completed_ids
+
+
+def count_records(input_path: Path) -> int:
+    """Counts the non-empty lines of the input (a quick scan, for progress and ETA)."""
+    with input_path.open("rb") as input_file:
+        return sum(1 for line in input_file if line.strip())
+
+
+def iter_records(input_path: Path) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yields (id, record) for every non-empty input line; the id is the record's "id" or its 1-based line number."""
+    with input_path.open(encoding="utf-8") as input_file:
+        for line_number, line in enumerate(input_file, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as error:
+                # Passed through so it is reported as that record's error instead of stopping the batch
+                yield str(line_number), {"_invalid": f"Invalid JSON: {error}"}
+                continue
+            yield str(record.get("id", line_number)), record
+
+
+def generate_for_record(record: Dict[str, Any]) -> str:
+    """Runs the pipeline for one record and returns the full suggestion."""
+    from suggested_response import generate_suggested_response
+
+    if "_invalid" in record:
+        raise ValueError(record["_invalid"])
+    missing_fields = [field_name for field_name in RECORD_FIELDS if field_name not in record]
+    if missing_fields:
+        raise ValueError(f"Missing fields: {', '.join(missing_fields)}")
+    return "".join(
+        generate_suggested_response(
+            **{field_name: record[field_name] for field_name in RECORD_FIELDS}, unit_id=record.get("unit_id")
+        )
+    )
+
+
+def run_record(record_id: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    """Pool task: one record in, one output line out (errors are captured, not raised)."""
+    started_at = time.perf_counter()
+    try:
+        # Batch work can wait out a throttled provider, unlike a live suggestion
+        with batch_retries():
+            suggestion, error = generate_for_record(record), None
+    except Exception as exception:
+        suggestion, error = None, f"{type(exception).__name__}: {exception}"
+    return {"id": record_id, "suggestion": suggestion, "error": error, "seconds": round(time.perf_counter() - started_at, 4)}
+
+
+def init_worker(process_worker: bool = False) -> None:
+    """
+    Prepares a worker (or the main process for thread pools): cassette from the environment, then warm-up.
+
+    A recording process worker writes its own part file of the cassette, saved when the process exits, since the pool
+    gives no hook to run `close_worker` in each worker and parallel saves would overwrite each other.
+    """
+    global _worker_cassette
+    from prompt_cassette import CASSETTE_PATH_ENV_VAR, install_from_env, worker_cassette_path
+    from suggested_response import warm_up_worker
+
+    if process_worker and _is_recording_cassette():
+        os.environ[CASSETTE_PATH_ENV_VAR] = worker_cassette_path(os.environ[CASSETTE_PATH_ENV_VAR], os.getpid())
+        atexit.register(close_worker)
+    _worker_cassette = install_from_env()
+    warm_up_worker()
+
+
+def close_worker() -> None:
+    """Exits the worker's cassette, if any (restores `braintrust.invoke`, saves a recording)."""
+    global _worker_cassette
+    if _worker_cassette is not None:
+        _worker_cassette.__exit__(None, None, None)
+        _worker_cassette = None
+
+
+def _make_pool(pool_kind: str, workers: int) -> Executor:
+    if pool_kind == "process":
+        # Spawned, not forked: the parent may already run SDK and pool threads, which do not survive a fork
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(True,),
+        )
+    init_worker()
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-record")
+
+
+def run_batch(
+    input_path: Path,
+    output_path: Path,
+    workers: int,
+    pool_kind: str = "thread",
+    progress_interval: float = DEFAULT_PROGRESS_INTERVAL_SECONDS,
+    limit: Optional[int] = None,
+) -> BatchProgress:
+    """
+    Generates suggestions for every record of `input_path` not yet completed in `output_path`, appending results.
+
+    Args:
+        input_path: JSONL conversations.
+        output_path: JSONL results; also the checkpoint for resuming.
+        workers: Pool size.
+        pool_kind: "thread" or "process".
+        progress_interval: Seconds between progress lines on stderr.
+        limit: Process at most this many new records (e.g. for a trial run).
+
+    Returns:
+        The final counts.
+    """
+    completed_ids = load_checkpoint(output_path)
+    total = count_records(input_path)
+    skipped = 0
+    completed = 0
+    errors = 0
+    max_in_flight = workers * IN_FLIGHT_PER_WORKER
+    started_at = time.perf_counter()
+    last_report_at = started_at
+
+    def progress() -> BatchProgress:
+        return BatchProgress(
+            total=total, skipped=skipped, completed=completed, errors=errors,
+            elapsed_seconds=time.perf_counter() - started_at,
+        )
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    pending_records = iter_records(input_path)
+    submitted = 0
+    in_flight: Set[Future] = set()
+    with _make_pool(pool_kind, workers) as pool, output_path.open("a", encoding="utf-8") as output_file:
+        while True:
+            # Top up the pool from the input, skipping records the checkpoint already has
+            while len(in_flight) < max_in_flight and (limit is None or submitted < limit):
+                next_record = next(pending_records, None)
+                if next_record is None:
+                    break
+                record_id, record = next_record
+                if record_id in completed_ids:
+                    skipped += 1
+                    continue
+                in_flight.add(pool.submit(run_record, record_id, record))
+                submitted += 1
+            if not in_flight:
+                break
+
+            finished, in_flight = wait(in_flight, timeout=progress_interval, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                # One flushed line per record, so a crash loses at most the records still running
+                output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output_file.flush()
+                completed += 1
+                errors += result["error"] is not None
+
+            if time.perf_counter() - last_report_at >= progress_interval:
+                print(format_progress(progress()), file=sys.stderr, flush=True)
+                last_report_at = time.perf_counter()
+
+    if pool_kind == "thread":
+        # Thread pools share this process's cassette; process workers keep theirs until they exit
+        close_worker()
+    elif _is_recording_cassette():
+        # The pool has shut down, so every worker has saved its part file
+        from prompt_cassette import CASSETTE_PATH_ENV_VAR, merge_worker_cassettes
+
+        merge_worker_cassettes(os.environ[CASSETTE_PATH_ENV_VAR])
+    final_progress = progress()
+    print(format_progress(final_progress), file=sys.stderr, flush=True)
+    return final_progress
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate suggested responses for a JSONL file of conversations.")
+    parser.add_argument("input", help="JSONL file, one conversation record per line")
+    parser.add_argument("output", help="JSONL results file (appended to; re-run the same command to resume)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--pool", choices=["thread", "process"], default="thread")
+    parser.add_argument("--progress-interval", type=float, default=DEFAULT_PROGRESS_INTERVAL_SECONDS)
+    parser.add_argument("--limit", type=int, help="Process at most this many new records")
+    args = parser.parse_args()
+
+    final_progress = run_batch(
+        Path(args.input), Path(args.output), args.workers, args.pool, args.progress_interval, args.limit
+    )
+    print(
+        f"Done: {final_progress.completed} records in {final_progress.elapsed_seconds:.1f}s "
+        f"({final_progress.records_per_second:.2f}/s), {final_progress.errors} errors, "
+        f"{final_progress.skipped} already in {args.output}"
+    )
+    if final_progress.errors:
+        sys.exit(1)
@@ -0,0 +1,227 @@
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# <ai_context>
+# Cold-start benchmark: how long a fresh interpreter takes to import a module of this repo.
+# Every run is a new `python -X importtime -c "import <module>"` process, so nothing is cached in-process; the wall time
+# of the import and the interpreter's per-module import timings are collected, and the report lists the median total
+# plus the module's most expensive direct imports (cumulative time, median across runs).
+# `--first-suggestion` also times the first suggested-response chunk in the same fresh process (prompts answered by a local
+# stub with --stub-latency), which includes the deferred SDK/logger setup that now happens on the first request.
+# `--max-import-ms` turns it into a regression check (exit code 1 when the median import is slower).
+# Results are written as JSON tagged with the git commit, like bench_suggested_response.py.
+# Usage: python bench_startup.py --module tools --runs 10 --max-import-ms 150
+# </ai_context>
+
+# Wall time of the import statement, printed by the child process
+_IMPORT_TIMER = (
+    "import time as _time; _started_at = _time.perf_counter(); import {module}; "
+    "print(_time.perf_counter() - _started_at)"
+)
+
+# Child process for --first-suggestion: import the pipeline, then time the first streamed chunk with prompt calls
+# answered by a local stub (fixed latency, no network), so the numbers isolate the worker's own startup cost
+_FIRST_SUGGESTION_TIMER = """
+import time
+started_at = time.perf_counter()
+import suggested_response
+import invoke_cache
+imported_at = time.perf_counter()
+
+class _StubChunk:
+    def __init__(self, data):
+        self.data = data
+
+def _stub_upstream(project_name, slug, input, stream, version, invoke_kwargs):
+    time.sleep({stub_latency})
+    if stream:
+        return iter([_StubChunk("Good evening, Ms. Chan. "), _StubChunk("The pool opens at 7am.")])
+    if slug.startswith("language-selection"):
+        return {{"reason": "stub", "language": "English"}}
+    return "Guest asked about the pool opening hours."
+
+invoke_cache._invoke_upstream = _stub_upstream
+suggestion = suggested_response.generate_suggested_response(
+    salutation="Ms.",
+    last_name="Chan",
+    conversation="[2025-01-06 17:59:14] Guest: when the pool open? \\n",
+    current_date_time="2025-01-06 17:59:26",
+    unit_open_issues_max_limit="4 hours",
+)
+next(suggestion)
+first_chunk_at = time.perf_counter()
+print(imported_at - started_at)
+print(first_chunk_at - started_at)
+"""
+
+
+def _parse_importtime(stderr: str, module: str) -> Dict[str, float]:
+    """
+    Returns import name -> cumulative import seconds from `-X importtime` output, for `module` itself and every module
+    it imports directly (what it costs to import, broken down by dependency).
+    """
+    module_seconds: Dict[str, float] = {}
+    # importtime prints a module after everything it imported, so direct imports are collected until their parent appears
+    direct_imports: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative_text, module_text = line.split("|", 2)
+        if not cumulative_text.strip().isdigit():
+            # Header line
+            continue
+        # One space after the separator, then two more per nesting level
+        nesting_level = (len(module_text) - len(module_text.lstrip(" ")) - 1) // 2
+        import_name = module_text.strip()
+        cumulative_seconds = int(cumulative_text) / 1_000_000
+        if nesting_level == 1:
+            direct_imports[import_name] = cumulative_seconds
+        elif nesting_level == 0:
+            if import_name == module:
+                module_seconds[import_name] = cumulative_seconds
+                module_seconds.update(direct_imports)
+            direct_imports = {}
+    return module_seconds
+
+
+def measure_import(module: str) -> Dict[str, Any]:
+    """Imports `module` in a fresh interpreter; returns the import wall time and per-module timings (seconds)."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _IMPORT_TIMER.format(module=module)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return {
+        "import_seconds": float(completed.stdout.strip().splitlines()[-1]),
+        "modules": _parse_importtime(completed.stderr, module),
+    }
+
+
+def measure_first_suggestion(stub_latency: float) -> Dict[str, Any]:
+    """
+    Starts a fresh interpreter that imports suggested_response and streams one suggestion against stubbed prompts.
+
+    Returns:
+        Import seconds, seconds from process start of the import to the first chunk, and per-module import timings.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _FIRST_SUGGESTION_TIMER.format(stub_latency=stub_latency)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_seconds, first_chunk_seconds = (float(line) for line in completed.stdout.strip().splitlines()[-2:])
+    return {
+        "import_seconds": import_seconds,
+        "first_chunk_seconds": first_chunk_seconds,
+        "modules": _parse_importtime(completed.stderr, "suggested_response"),
+    }
+
+
+def get_git_commit() -> str:
+    """Returns the current git commit (short sha), or "unknown" outside a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def summarize_imports(runs: List[Dict[str, Any]], top: int) -> Dict[str, Any]:
+    """Median import time and the `top` most expensive imports (median per module across runs)."""
+    module_names = {module_name for run in runs for module_name in run["modules"]}
+    module_medians = {
+        module_name: statistics.median(run["modules"].get(module_name, 0.0) for run in runs)
+        for module_name in module_names
+    }
+    summary: Dict[str, Any] = {}
+    for metric_name in ("import_seconds", "first_chunk_seconds"):
+        values = sorted(run[metric_name] for run in runs if metric_name in run)
+        if values:
+            summary[metric_name] = {"median": statistics.median(values), "min": values[0], "max": values[-1]}
+    summary["slowest_modules"] = dict(sorted(module_medians.items(), key=lambda item: item[1], reverse=True)[:top])
+    return summary
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    """Prints the import summary in milliseconds, with the median delta against a baseline if given."""
+    import_stats = report["summary"]["import_seconds"]
+    delta = ""
+    if baseline:
+        baseline_median = baseline["summary"]["import_seconds"]["median"]
+        delta = f" ({(import_stats['median'] / baseline_median - 1) * 100:+.1f}% vs baseline)"
+    print(
+        f"commit={report['commit']} module={report['config']['module']} runs={report['config']['runs']}: "
+        f"import median {import_stats['median'] * 1000:.1f} ms (min {import_stats['min'] * 1000:.1f}, "
+        f"max {import_stats['max'] * 1000:.1f}){delta}"
+    )
+    first_chunk_stats = report["summary"].get("first_chunk_seconds")
+    if first_chunk_stats:
+        print(
+            f"time to first suggestion chunk (stubbed prompts, {report['config']['stub_latency'] * 1000:.0f} ms each): "
+            f"median {first_chunk_stats['median'] * 1000:.1f} ms (min {first_chunk_stats['min'] * 1000:.1f}, "
+            f"max {first_chunk_stats['max'] * 1000:.1f})"
+        )
+    print(f"{'module':<40}{'cumulative ms':>15}")
+    for module_name, seconds in report["summary"]["slowest_modules"].items():
+        print(f"{module_name:<40}{seconds * 1000:>15.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure cold-start import time of a module in fresh interpreters.")
+    parser.add_argument("--module", default="tools", help="Module to import (e.g. tools, suggested_response)")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10, help="How many of the slowest imports to list")
+    parser.add_argument("--max-import-ms", type=float, help="Exit with status 1 if the median import is slower")
+    parser.add_argument(
+        "--first-suggestion",
+        action="store_true",
+        help="Also time the first suggested-response chunk after import (implies --module suggested_response)",
+    )
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Stubbed prompt latency for --first-suggestion (s)")
+    parser.add_argument("--output", help="Result JSON path (default: bench_results/startup-<module>-<commit>.json)")
+    parser.add_argument("--compare", help="Previous result JSON to print the median delta against")
+    args = parser.parse_args()
+    if args.first_suggestion:
+        args.module = "suggested_response"
+    measure = (lambda: measure_first_suggestion(args.stub_latency)) if args.first_suggestion else (lambda: measure_import(args.module))
+
+    # One unmeasured run so every measured run sees warm file and bytecode caches
+    measure()
+    started_at = time.perf_counter()
+    runs = [measure() for _ in range(args.runs)]
+
+    report = {
+        "benchmark": "startup",
+        "commit": get_git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "duration_seconds": time.perf_counter() - started_at,
+        "summary": summarize_imports(runs, args.top),
+    }
+
+    output_path = Path(args.output or f"bench_results/startup-{args.module}-{report['commit']}.json")
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    baseline = json.loads(Path(args.compare).read_text(encoding="utf-8")) if args.compare else None
+    print_report(report, baseline)
+    print(f"Results written to {output_path}")
+
+    if args.max_import_ms is not None and report["summary"]["import_seconds"]["median"] * 1000 > args.max_import_ms:
+        sys.exit(f"Median import {report['summary']['import_seconds']['median'] * 1000:.1f} ms exceeds {args.max_import_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+import argparse
+import asyncio
+import contextvars
+import json
+import platform
+import resource
+import subprocess
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import braintrust
+from braintrust.functions.stream import BraintrustStream, BraintrustTextChunk
+
+import suggested_response
+from lazy_tracing import disable_logging
+from pipeline_concurrency import configure_loop
+from prompt_cassette import make_async_invoke, use_cassette
+
+# <ai_context>
+# Benchmark harness for `generate_suggested_response` / `agenerate_suggested_response`.
+# Runs the pipeline against a stubbed invoke backend: either a synthetic backend with configurable per-slug latency and
+# chunking (default) or a recorded cassette (--cassette, replayed via prompt_cassette.py), so no network is needed.
+# Per run it records every stage's duration from the pipeline's own `DagResult.timings` (value_extractor, open_issues,
+# rag_data, language_selection, generator = until the stream is open), plus time to first chunk, streaming time,
+# chunks/sec and end-to-end latency; it reports p50/p95/p99 per metric plus peak memory (max RSS, and a tracemalloc
+# peak from a separate pass so tracing overhead does not skew timings).
+# Runs alternate between an English conversation (the local language detector answers) and a Spanish one (the
+# language-selection prompt is called), so language_selection is reported per conversation (`--conversations` picks).
+# Braintrust logging is disabled for the run (no logger, no login), so the benchmark never touches the network.
+# Results are written as JSON tagged with the git commit so runs can be compared (--compare previous.json).
+# Usage: python bench_suggested_response.py --iterations 200 --concurrency 16 --mode concurrent
+# </ai_context>
+
+# Stages whose duration depends on the conversation are reported per conversation (e.g. language_selection:spanish)
+PER_CONVERSATION_STAGES = ("language_selection",)
+
+# Metrics reported after the stage durations (in the order they are printed)
+RUN_METRICS = [
+    "time_to_first_chunk",
+    "streaming",
+    "end_to_end",
+    "chunks_per_second",
+]
+
+# Benchmark conversations. "english" is the example from the `__main__` block of suggested_response.py, which the local
+# language detector answers; "spanish" makes the pipeline call the language-selection prompt
+BENCH_CONVERSATIONS = {
+    "english": (
+        "[2025-01-05 13:26:42] Guest: What should I have for lunch at your hotel? \\n"
+        "[2025-01-05 13:27:13] You: Good afternoon, Ms. Chan. You can enjoy a la carte dining at the Manor Club. \\n"
+        "[2025-01-06 17:59:14] Guest: when the pool open? \\n"
+    ),
+    "spanish": (
+        "[2025-01-05 13:26:42] Guest: ¿Qué puedo almorzar en su hotel? \\n"
+        "[2025-01-05 13:27:13] You: Buenas tardes, Sra. Chan. Puede disfrutar de la carta en el Manor Club. \\n"
+        "[2025-01-06 17:59:14] Guest: ¿A qué hora abre la piscina? \\n"
+    ),
+}
+
+BENCH_INPUT = {
+    "salutation": "Ms.",
+    "last_name": "Chan",
+    "current_date_time": "2025-01-06 17:59:26",
+    "unit_open_issues_max_limit": "4 hours",
+}
+
+# Per-run stage timings; a contextvar so stages running on pool threads (which copy the context) report to their run
+_current_run_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "bench_run_timings", default=None
+)
+
+
+# Conversation of the run that is currently executing
+_current_conversation: contextvars.ContextVar[str] = contextvars.ContextVar("bench_conversation", default="english")
+
+
+def _record_dag_timings(timings: Any) -> None:
+    """Stores a pipeline's `DagResult.timings` in the timings of the run that is currently executing (if any)."""
+    run_timings = _current_run_timings.get()
+    if run_timings is None:
+        return
+    for timing in timings:
+        stage_name = timing.stage
+        if stage_name in PER_CONVERSATION_STAGES:
+            stage_name = f"{stage_name}:{_current_conversation.get()}"
+        run_timings[stage_name] = timing.duration_s
+
+
+def _wrap_stage_timing_hook(record_stage_timings: Callable[[Any], None]) -> Callable[[Any], None]:
+    """Wraps the pipeline's stage-timing hook so the benchmark sees the same timings the metrics do."""
+
+    def record_and_capture(timings: Any) -> None:
+        timings = tuple(timings)
+        record_stage_timings(timings)
+        _record_dag_timings(timings)
+
+    return record_and_capture
+
+
+def reported_metrics(conversation_names: List[str]) -> List[str]:
+    """Every metric in report order: each DAG stage (per conversation where it matters), then the run metrics."""
+    stage_metrics = []
+    for stage in suggested_response.SUGGESTED_RESPONSE_DAG.stages:
+        if stage.name in PER_CONVERSATION_STAGES:
+            stage_metrics.extend(f"{stage.name}:{conversation_name}" for conversation_name in conversation_names)
+        else:
+            stage_metrics.append(stage.name)
+    return stage_metrics + RUN_METRICS
+
+
+def make_synthetic_invoke(
+    invoke_latency_s: float,
+    first_chunk_latency_s: float,
+    chunk_interval_s: float,
+    chunk_count: int,
+) -> Callable[..., Any]:
+    """
+    Builds a stub for `braintrust.invoke` with fixed, configurable latencies.
+
+    Non-streamed prompts sleep `invoke_latency_s`; the streamed generator sleeps `first_chunk_latency_s` before the first
+    chunk and `chunk_interval_s` between chunks.
+    """
+
+    def synthetic_invoke(project_name=None, slug=None, input=None, stream=False, **invoke_kwargs):
+        if not stream:
+            time.sleep(invoke_latency_s)
+            if slug == "language-selection-handler-1bb5":
+                return {"reason": "Guest's most recent message is in English.", "language": "English"}
+            return "The guest is asking about the swimming pool opening hours."
+
+        def stream_chunks() -> Iterator[Any]:
+            time.sleep(first_chunk_latency_s)
+            for chunk_index in range(chunk_count):
+                if chunk_index:
+                    time.sleep(chunk_interval_s)
+                yield BraintrustTextChunk(data=f"token{chunk_index} ")
+
+        return BraintrustStream(stream_chunks())
+
+    return synthetic_invoke
+
+
+def _finish_run(run_timings: Dict[str, float], started_at: float, chunk_times: List[float]) -> Dict[str, float]:
+    """Derives TTFT, chunk throughput and end-to-end latency for one run."""
+    run_timings["end_to_end"] = time.perf_counter() - started_at
+    if chunk_times:
+        run_timings["time_to_first_chunk"] = chunk_times[0] - started_at
+        streaming_window_s = chunk_times[-1] - chunk_times[0]
+        run_timings["streaming"] = streaming_window_s
+        # A single chunk has no measurable rate
+        if streaming_window_s > 0:
+            run_timings["chunks_per_second"] = (len(chunk_times) - 1) / streaming_window_s
+    return run_timings
+
+
+def run_sync_pipeline(execution_mode: str, conversation_name: str) -> Dict[str, float]:
+    """Runs one synchronous pipeline and returns its timings."""
+    run_timings: Dict[str, float] = {}
+    _current_run_timings.set(run_timings)
+    _current_conversation.set(conversation_name)
+    chunk_times: List[float] = []
+    started_at = time.perf_counter()
+    for _ in suggested_response.generate_suggested_response(
+        **BENCH_INPUT, conversation=BENCH_CONVERSATIONS[conversation_name], execution_mode=execution_mode
+    ):
+        chunk_times.append(time.perf_counter())
+    return _finish_run(run_timings, started_at, chunk_times)
+
+
+async def run_async_pipeline(conversation_name: str) -> Dict[str, float]:
+    """Runs one async pipeline and returns its timings (each asyncio task has its own context)."""
+    run_timings: Dict[str, float] = {}
+    _current_run_timings.set(run_timings)
+    _current_conversation.set(conversation_name)
+    chunk_times: List[float] = []
+    started_at = time.perf_counter()
+    async for _ in suggested_response.agenerate_suggested_response(
+        **BENCH_INPUT, conversation=BENCH_CONVERSATIONS[conversation_name]
+    ):
+        chunk_times.append(time.perf_counter())
+    return _finish_run(run_timings, started_at, chunk_times)
+
+
+def run_batch(mode: str, iterations: int, concurrency: int, conversation_names: List[str]) -> List[Dict[str, float]]:
+    """
+    Runs `iterations` pipelines with up to `concurrency` in flight, cycling through `conversation_names`, and returns
+    the per-run timings.
+    """
+    run_conversations = [conversation_names[run_index % len(conversation_names)] for run_index in range(iterations)]
+    if mode == "async":
+
+        async def run_all() -> List[Dict[str, float]]:
+            configure_loop()
+            # Bound in-flight pipelines to `concurrency`, like the thread pool does for the sync modes
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def bounded_run(conversation_name: str) -> Dict[str, float]:
+                async with semaphore:
+                    return await run_async_pipeline(conversation_name)
+
+            return list(await asyncio.gather(*(bounded_run(name) for name in run_conversations)))
+
+        return asyncio.run(run_all())
+
+    # Each run gets a fresh context so its timings dict does not leak into the next run on the same thread
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench-run") as executor:
+        futures = [
+            executor.submit(contextvars.Context().run, run_sync_pipeline, mode, conversation_name)
+            for conversation_name in run_conversations
+        ]
+        return [future.result() for future in futures]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Linear-interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * fraction
+    lower_index = int(position)
+    upper_index = min(lower_index + 1, len(sorted_values) - 1)
+    return sorted_values[lower_index] + (sorted_values[upper_index] - sorted_values[lower_index]) * (position - lower_index)
+
+
+def summarize(run_results: List[Dict[str, float]], metric_names: List[str]) -> Dict[str, Dict[str, float]]:
+    """Computes count/mean/p50/p95/p99/max per metric across runs."""
+    summary = {}
+    for metric_name in metric_names:
+        values = sorted(run[metric_name] for run in run_results if metric_name in run)
+        if not values:
+            continue
+        summary[metric_name] = {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+            "max": values[-1],
+        }
+    return summary
+
+
+def measure_tracemalloc_peak(mode: str, conversation_names: List[str]) -> int:
+    """Runs one pipeline per conversation under tracemalloc and returns the peak traced Python allocation in bytes."""
+    tracemalloc.start()
+    try:
+        run_batch(mode, len(conversation_names), 1, conversation_names)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def get_git_commit() -> str:
+    """Returns the current git commit (short sha), or "unknown" outside a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    """Prints a table of the summary (milliseconds, except chunks/sec), with deltas against a baseline if given."""
+    print(f"commit={report['commit']} mode={report['config']['mode']} iterations={report['config']['iterations']} "
+          f"concurrency={report['config']['concurrency']} throughput={report['throughput_runs_per_second']:.1f} runs/s")
+    print(f"{'metric':<30}{'p50':>12}{'p95':>12}{'p99':>12}{'Δp50':>10}")
+    for metric_name, stats in report["summary"].items():
+        # Latencies are stored in seconds; show milliseconds
+        scale = 1.0 if metric_name == "chunks_per_second" else 1000.0
+        delta = ""
+        baseline_stats = (baseline or {}).get("summary", {}).get(metric_name)
+        if baseline_stats and baseline_stats["p50"]:
+            delta = f"{(stats['p50'] / baseline_stats['p50'] - 1) * 100:+.1f}%"
+        print(f"{metric_name:<30}{stats['p50'] * scale:>12.3f}{stats['p95'] * scale:>12.3f}{stats['p99'] * scale:>12.3f}{delta:>10}")
+    print(f"peak_rss_kb={report['memory']['peak_rss_kb']} tracemalloc_peak_bytes={report['memory']['tracemalloc_peak_bytes']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the suggested-response pipeline against a stubbed backend.")
+    parser.add_argument("--mode", choices=["concurrent", "serial", "async"], default="concurrent")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5, help="Runs discarded before measuring")
+    parser.add_argument(
+        "--conversations",
+        nargs="+",
+        choices=sorted(BENCH_CONVERSATIONS),
+        default=["english", "spanish"],
+        help="Conversations the runs cycle through",
+    )
+    parser.add_argument("--cassette", help="Replay this cassette instead of the synthetic backend")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Cassette replay latency multiplier")
+    parser.add_argument("--invoke-latency", type=float, default=0.05, help="Synthetic non-streamed prompt latency (s)")
+    parser.add_argument("--first-chunk-latency", type=float, default=0.05, help="Synthetic generator TTFT (s)")
+    parser.add_argument("--chunk-interval", type=float, default=0.002, help="Synthetic gap between chunks (s)")
+    parser.add_argument("--chunks", type=int, default=50, help="Synthetic chunk count")
+    parser.add_argument("--output", help="Result JSON path (default: bench_results/suggested_response-<commit>-<mode>.json)")
+    parser.add_argument("--compare", help="Previous result JSON to print p50 deltas against")
+    args = parser.parse_args()
+
+    # Offline: no logger and no login, so spans are no-ops and nothing is sent
+    disable_logging()
+    # Install the stub backend: a cassette or the synthetic backend
+    real_invoke = braintrust.invoke
+    real_invoke_async = braintrust.invoke_async
+    if args.cassette:
+        cassette = use_cassette(args.cassette, mode="replay", latency_scale=args.latency_scale, match_on="slug")
+        cassette.__enter__()
+    else:
+        cassette = None
+        braintrust.invoke = make_synthetic_invoke(
+            args.invoke_latency, args.first_chunk_latency, args.chunk_interval, args.chunks
+        )
+        # The async pipeline calls `invoke_async`
+        braintrust.invoke_async = make_async_invoke(braintrust.invoke)
+    # suggested_response looks the hook up at call time, so patching its module global is enough
+    real_record_stage_timings = suggested_response.record_stage_timings
+    suggested_response.record_stage_timings = _wrap_stage_timing_hook(real_record_stage_timings)
+
+    try:
+        if args.warmup:
+            run_batch(args.mode, args.warmup, min(args.concurrency, args.warmup), args.conversations)
+        batch_started_at = time.perf_counter()
+        run_results = run_batch(args.mode, args.iterations, args.concurrency, args.conversations)
+        batch_duration_s = time.perf_counter() - batch_started_at
+        tracemalloc_peak_bytes = measure_tracemalloc_peak(args.mode, args.conversations)
+    finally:
+        braintrust.invoke = real_invoke
+        braintrust.invoke_async = real_invoke_async
+        suggested_response.record_stage_timings = real_record_stage_timings
+        if cassette is not None:
+            cassette.__exit__(None, None, None)
+
+    report = {
+        "benchmark": "suggested_response",
+        "commit": get_git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "throughput_runs_per_second": args.iterations / batch_duration_s,
+        "summary": summarize(run_results, reported_metrics(args.conversations)),
+        "memory": {
+            # ru_maxrss is kilobytes on Linux
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "tracemalloc_peak_bytes": tracemalloc_peak_bytes,
+        },
+    }
+
+    output_path = Path(args.output or f"bench_results/suggested_response-{report['commit']}-{args.mode}.json")
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    baseline = json.loads(Path(args.compare).read_text(encoding="utf-8")) if args.compare else None
+    print_report(report, baseline)
+    print(f"Results written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from braintrust import EvalCase, init_dataset
+from braintrust.logger import Dataset
+
+from streaming_dataset import open_dataset_stream
+
+# <ai_context>
+# Local snapshots of Braintrust datasets, so repeated eval runs read rows from disk instead of re-downloading them.
+# `pull_snapshot` streams a dataset (streaming_dataset.py) into `<DATASET_SNAPSHOT_DIR>/<project>/<dataset>/<version>.snap`,
+# where version is the dataset's latest transaction id, writing rows as they arrive (memory stays bounded).
+# File layout (all integers little-endian):
+#   header  MAGIC, uint32 header length, header JSON ({"fields": [...], "project", "dataset", "dataset_id", "pulled_at"})
+#   rows    per row, per field in header order: uint32 length + the field's JSON (length 0 = field absent)
+#   index   uint64 offset of every row
+#   footer  uint64 index offset, uint64 row count, MAGIC
+# `open_snapshot` memory-maps the file and casts the index to a uint64 view without copying; `SnapshotRow` only records
+# where each field's bytes are and decodes a field (e.g. `input`) the first time it is read.
+# Eval gets `EvalCase`s (`iterate_eval_cases`): with a callable data source Eval does not know the dataset, so each case
+# carries its own `origin` ({"object_type": "dataset", "object_id": <dataset_id from the header>, "id", "_xact_id"}),
+# which is what links each result to its dataset row.
+# `snapshot_for_eval` (EVAL_DATASET_SNAPSHOT=1) asks Braintrust only for the dataset's latest version (one-row query) and
+# re-pulls only when it changed; with no connection it uses the newest local snapshot.
+# CLI: python dataset_snapshot.py pull|info --project workflow-glowing --dataset story-input
+# </ai_context>
+
+SNAPSHOT_DIR_ENV_VAR = "DATASET_SNAPSHOT_DIR"
+SNAPSHOT_ENABLED_ENV_VAR = "EVAL_DATASET_SNAPSHOT"
+DEFAULT_SNAPSHOT_DIR = "data/dataset_snapshots"
+
+MAGIC = b"BTSNAP01"
+SNAPSHOT_SUFFIX = ".snap"
+# Fields kept per row, in storage order (the dataset record fields Eval reads)
+SNAPSHOT_FIELDS = ("id", "_xact_id", "created", "input", "expected", "metadata", "tags", "origin")
+
+_UINT32 = struct.Struct("<I")
+_FOOTER = struct.Struct("<QQ8s")
+
+
+@dataclass(frozen=True)
+class DatasetSnapshot:
+    """An open, memory-mapped snapshot."""
+
+    path: Path
+    header: Dict[str, Any]
+    row_count: int
+    # Zero-copy views over the mapped file
+    buffer: memoryview
+    row_offsets: memoryview
+
+
+class SnapshotRow:
+    """
+    One snapshot row. Field bytes stay in the mapped file until a field is first read, then the decoded value is kept.
+    """
+
+    __slots__ = ("_buffer", "_field_spans", "_decoded")
+
+    def __init__(self, buffer: memoryview, field_spans: Dict[str, Tuple[int, int]]):
+        self._buffer = buffer
+        self._field_spans = field_spans
+        self._decoded: Dict[str, Any] = {}
+
+    def get(self, field_name: str, default: Any = None) -> Any:
+        if field_name in self._decoded:
+            return self._decoded[field_name]
+        span = self._field_spans.get(field_name)
+        if span is None:
+            return default
+        start, length = span
+        value = json.loads(self._buffer[start : start + length].tobytes()) if length else default
+        self._decoded[field_name] = value
+        return value
+
+    def __getitem__(self, field_name: str) -> Any:
+        if field_name not in self._field_spans:
+            raise KeyError(field_name)
+        return self.get(field_name)
+
+    def __getattr__(self, field_name: str) -> Any:
+        # EvalCase-style attribute access (`row.input`, `row._xact_id`); trial_count is not stored
+        if field_name in SNAPSHOT_FIELDS or field_name == "trial_count":
+            return self.get(field_name)
+        raise AttributeError(field_name)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {field_name: self.get(field_name) for field_name in self._field_spans}
+
+    def to_eval_case(self, dataset_id: Optional[str]) -> EvalCase:
+        """
+        Builds the EvalCase Eval would make from the live dataset row, including the `origin` linking results to it.
+        """
+        row_id = self.get("id")
+        xact_id = self.get("_xact_id")
+        created = self.get("created")
+        origin = self.get("origin")
+        if dataset_id and isinstance(row_id, str) and isinstance(xact_id, str):
+            origin = {"object_type": "dataset", "object_id": dataset_id, "id": row_id, "_xact_id": xact_id}
+            if isinstance(created, str):
+                origin["created"] = created
+        return EvalCase(
+            input=self.get("input"),
+            expected=self.get("expected"),
+            metadata=self.get("metadata"),
+            tags=self.get("tags"),
+            id=row_id,
+            _xact_id=xact_id,
+            created=created,
+            origin=origin,
+        )
+
+
+def _get_snapshot_dir() -> Path:
+    return Path(os.environ.get(SNAPSHOT_DIR_ENV_VAR, DEFAULT_SNAPSHOT_DIR))
+
+
+def _snapshot_folder(project_name: str, dataset_name: str, snapshot_dir: Optional[Path] = None) -> Path:
+    return (snapshot_dir or _get_snapshot_dir()) / project_name / dataset_name
+
+
+def fetch_remote_version(dataset: Dataset) -> str:
+    """
+    Returns the dataset's current version (its latest transaction id) without downloading the rows.
+
+    Uses a one-row BTQL query sorted on `_xact_id`; falls back to the SDK's `Dataset.version` (a full fetch) if the
+    query is rejected.
+    """
+    if dataset._pinned_version is not None:
+        return dataset._pinned_version
+    try:
+        response = dataset._get_state().api_conn().post(
+            "btql",
+            json={
+                "query": {
+                    "select": [{"alias": "_xact_id", "expr": {"op": "ident", "name": ["_xact_id"]}}],
+                    "from": {
+                        "op": "function",
+                        "name": {"op": "ident", "name": ["dataset"]},
+                        "args": [{"op": "literal", "value": dataset.id}],
+                    },
+                    "sort": [{"expr": {"op": "ident", "name": ["_xact_id"]}, "dir": "desc"}],
+                    "limit": 1,
+                },
+                "use_columnstore": False,
+                "query_source": "dataset_snapshot_version",
+            },
+        )
+        response.raise_for_status()
+        rows = response.json()["data"]
+        return str(rows[0]["_xact_id"]) if rows else "0"
+    except Exception:
+        return dataset.version
+
+
+def write_snapshot(
+    rows: Iterator[Dict[str, Any]], path: Path, header: Dict[str, Any]
+) -> Tuple[int, str]:
+    """
+    Writes rows to a snapshot file (atomically, via a temp file).
+
+    Returns:
+        (row count, latest `_xact_id` seen), the latter being the dataset version the snapshot holds.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(path.suffix + ".tmp")
+    header_bytes = json.dumps({**header, "fields": list(SNAPSHOT_FIELDS)}).encode("utf-8")
+    row_offsets = []
+    latest_xact_id = "0"
+
+    with open(temp_path, "wb") as snapshot_file:
+        snapshot_file.write(MAGIC + _UINT32.pack(len(header_bytes)) + header_bytes)
+        position = snapshot_file.tell()
+        for row in rows:
+            row_offsets.append(position)
+            for field_name in SNAPSHOT_FIELDS:
+                value = row.get(field_name)
+                field_bytes = b"" if value is None else json.dumps(value, ensure_ascii=False).encode("utf-8")
+                snapshot_file.write(_UINT32.pack(len(field_bytes)) + field_bytes)
+                position += _UINT32.size + len(field_bytes)
+            # Transaction ids are numeric strings of equal width, so string order is version order
+            xact_id = str(row.get("_xact_id") or "0")
+            if (len(xact_id), xact_id) > (len(latest_xact_id), latest_xact_id):
+                latest_xact_id = xact_id
+
+        index_offset = position
+        snapshot_file.write(struct.pack(f"<{len(row_offsets)}Q", *row_offsets))
+        snapshot_file.write(_FOOTER.pack(index_offset, len(row_offsets), MAGIC))
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+
+    os.replace(temp_path, path)
+    return len(row_offsets), latest_xact_id
+
+
+def pull_snapshot(project_name: str, dataset_name: str, snapshot_dir: Optional[Path] = None) -> Path:
+    """
+    Downloads a dataset into a local snapshot keyed by its version, and removes older snapshots of it.
+
+    Returns:
+        The snapshot path.
+    """
+    dataset = init_dataset(project=project_name, name=dataset_name)
+    folder = _snapshot_folder(project_name, dataset_name, snapshot_dir)
+    # Not matched by the *.snap lookups until it is complete and renamed
+    staging_path = folder / "pulling.partial"
+    _, version = write_snapshot(
+        open_dataset_stream(dataset).rows,
+        staging_path,
+        {"project": project_name, "dataset": dataset_name, "dataset_id": dataset.id, "pulled_at": time.time()},
+    )
+
+    # The snapshot is named after the newest row it actually contains
+    snapshot_path = folder / f"{version}{SNAPSHOT_SUFFIX}"
+    os.replace(staging_path, snapshot_path)
+    for old_path in folder.glob(f"*{SNAPSHOT_SUFFIX}"):
+        if old_path != snapshot_path:
+            old_path.unlink(missing_ok=True)
+    return snapshot_path
+
+
+def find_snapshot(project_name: str, dataset_name: str, version: Optional[str] = None) -> Optional[Path]:
+    """Returns the local snapshot for `version` (or the newest one when version is None), if any."""
+    folder = _snapshot_folder(project_name, dataset_name)
+    if version is not None:
+        snapshot_path = folder / f"{version}{SNAPSHOT_SUFFIX}"
+        return snapshot_path if snapshot_path.exists() else None
+    snapshot_paths = sorted(
+        folder.glob(f"*{SNAPSHOT_SUFFIX}"), key=lambda snapshot_path: snapshot_path.stat().st_mtime, reverse=True
+    )
+    return snapshot_paths[0] if snapshot_paths else None
+
+
+def open_snapshot(path: Path) -> DatasetSnapshot:
+    """
+    Memory-maps a snapshot file.
+
+    Raises:
+        ValueError: If the file is not a complete snapshot.
+    """
+    with open(path, "rb") as snapshot_file:
+        # The mapping stays valid after the file object is closed
+        mapped_file = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+    buffer = memoryview(mapped_file)
+    if len(buffer) < len(MAGIC) + _FOOTER.size or bytes(buffer[: len(MAGIC)]) != MAGIC:
+        raise ValueError(f"{path} is not a dataset snapshot")
+    index_offset, row_count, footer_magic = _FOOTER.unpack(buffer[-_FOOTER.size :])
+    if footer_magic != MAGIC:
+        raise ValueError(f"{path} is incomplete (missing footer)")
+
+    (header_length,) = _UINT32.unpack(buffer[len(MAGIC) : len(MAGIC) + _UINT32.size])
+    header_start = len(MAGIC) + _UINT32.size
+    header = json.loads(buffer[header_start : header_start + header_length].tobytes())
+    row_offsets = buffer[index_offset : index_offset + row_count * 8].cast("Q")
+    return DatasetSnapshot(path=Path(path), header=header, row_count=row_count, buffer=buffer, row_offsets=row_offsets)
+
+
+def read_row(snapshot: DatasetSnapshot, row_index: int) -> SnapshotRow:
+    """Returns a lazily decoded row by position."""
+    position = snapshot.row_offsets[row_index]
+    field_spans: Dict[str, Tuple[int, int]] = {}
+    for field_name in snapshot.header["fields"]:
+        (length,) = _UINT32.unpack_from(snapshot.buffer, position)
+        position += _UINT32.size
+        field_spans[field_name] = (position, length)
+        position += length
+    return SnapshotRow(snapshot.buffer, field_spans)
+
+
+def iterate_snapshot(snapshot: DatasetSnapshot) -> Iterator[SnapshotRow]:
+    """Yields every row in dataset order."""
+    for row_index in range(snapshot.row_count):
+        yield read_row(snapshot, row_index)
+
+
+def iterate_eval_cases(snapshot: DatasetSnapshot) -> Iterator[EvalCase]:
+    """Yields every row as an EvalCase linked to its dataset row (snapshots pulled before `dataset_id` get no link)."""
+    dataset_id = snapshot.header.get("dataset_id")
+    for row in iterate_snapshot(snapshot):
+        yield row.to_eval_case(dataset_id)
+
+
+def resolve_snapshot(project_name: str, dataset_name: str) -> Path:
+    """
+    Returns a snapshot matching the remote dataset version, pulling a new one only when the version changed.
+
+    When the version cannot be checked (offline), the newest local snapshot is used.
+    """
+    try:
+        remote_version = fetch_remote_version(init_dataset(project=project_name, name=dataset_name))
+    except Exception as error:
+        local_path = find_snapshot(project_name, dataset_name)
+        if local_path is None:
+            raise
+        print(f"Could not check the version of '{dataset_name}' ({error}); using {local_path}", file=sys.stderr)
+        return local_path
+
+    return find_snapshot(project_name, dataset_name, remote_version) or pull_snapshot(project_name, dataset_name)
+
+
+def snapshot_for_eval(project_name: str, dataset_name: str, fallback: Any) -> Any:
+    """
+    Returns what to pass as `Eval(data=...)`: rows from a local snapshot when EVAL_DATASET_SNAPSHOT=1, else `fallback`.
+    """
+    if os.environ.get(SNAPSHOT_ENABLED_ENV_VAR, "").lower() not in ("1", "true", "yes", "on"):
+        return fallback
+    # Resolved when Eval asks for the data, not at import time
+    data_source: Callable[[], Iterator[EvalCase]] = lambda: iterate_eval_cases(
+        open_snapshot(resolve_snapshot(project_name, dataset_name))
+    )
+    return data_source
+
+
+# CLI: pull a snapshot, or describe the local one
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Local snapshots of Braintrust datasets.")
+    parser.add_argument("command", choices=["pull", "info"])
+    parser.add_argument("--project", required=True)
+    parser.add_argument("--dataset", required=True)
+    args = parser.parse_args()
+
+    if args.command == "pull":
+        started_at = time.perf_counter()
+        snapshot_path = pull_snapshot(args.project, args.dataset)
+        print(f"Pulled {snapshot_path} in {time.perf_counter() - started_at:.1f}s")
+    snapshot_path = find_snapshot(args.project, args.dataset)
+    if snapshot_path is None:
+        sys.exit(f"No local snapshot of '{args.dataset}'. Run: python dataset_snapshot.py pull ...")
+
+    started_at = time.perf_counter()
+    snapshot = open_snapshot(snapshot_path)
+    for row in iterate_snapshot(snapshot):
+        _ = row.input
+    read_seconds = time.perf_counter() - started_at
+    print(
+        f"{snapshot_path}: {snapshot.row_count} rows, {snapshot_path.stat().st_size / 1024:.1f} KiB, "
+        f"version {snapshot_path.stem}, read all inputs in {read_seconds * 1000:.1f} ms"
+    )
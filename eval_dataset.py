@@ -1,6 +1,18 @@
-import braintrust
 from dotenv import load_dotenv
 from braintrust import Eval, init_dataset
+from prompt_dag import Stage, build_dag, prompt_stage, run_dag
+from row_scheduler import format_row_stats, get_max_in_flight_rows, scheduled_task
+from dataset_snapshot import snapshot_for_eval
+from streaming_dataset import dataset_for_eval
+
+# <ai_context>
+# Two-prompt chain eval (structured output) over the "story-input" dataset stored in Braintrust.
+# The chain is declared with prompt_dag.py (`story_chain`): outline prompt -> outline extraction -> story prompt.
+# Both prompts are called via `cached_invoke`; set BRAINTRUST_INVOKE_CACHE=1 to reuse responses across eval runs.
+# Rows go through `row_scheduler.scheduled_task` (in-flight cap + rows/sec report); per-slug rate limits and 429 backoff
+# are configured with PROMPT_RATE_LIMITS / PROMPT_RATE_LIMIT_DEFAULT.
+# Repeated runs can read the rows from a local memory-mapped snapshot instead (EVAL_DATASET_SNAPSHOT=1).
+# </ai_context>
 
 """
 This script is used to evaluate the performance of a prompt chain (2 prompts) but with structured output.
@@ -18,40 +30,52 @@ load_dotenv()
 # Replace these with your actual project name
 project_name = "workflow-glowing"
 
-# Define the task function that chains the two prompts
-def chain_task(input_data):
+# Define the chain of the two prompts
+story_chain = build_dag([
     # First prompt - generates initial content based on genre and context
     # The response is a structured dictionary with 'reason' and 'outline' fields
-    story_outline_response = braintrust.invoke(
+    prompt_stage(
+        name="story_outline_response",
         project_name=project_name,
         slug="storyoutline-geminiflash001-so",
-        input={
-            "genre": input_data["genre"],
-            "context": input_data["context"]
-        }
-    )
-    
+        inputs=("genre", "context"),
+    ),
     # Extract the outline directly from the dictionary, if doesn't exist, return empty string
-    story_outline = story_outline_response.get("outline", "")
-    
+    Stage(
+        name="story_outline",
+        fn=lambda story_outline_response: story_outline_response.get("outline", ""),
+        inputs=("story_outline_response",),
+        inline=True,
+    ),
     # Second prompt - refines or extends the first output
-    final_story = braintrust.invoke(
+    prompt_stage(
+        name="final_story",
         project_name=project_name,
         slug="story-4omini",
-        input={
-            "outline": story_outline
-        }
-    )
-    
+        inputs=("story_outline",),
+        build_input=lambda story_outline: {"outline": story_outline},
+    ),
+])
+
+# Define the task function that runs the chain
+def chain_task(input_data):
+    dag_result = run_dag(story_chain, {"genre": input_data["genre"], "context": input_data["context"]})
+
     # Return the final output for Braintrust
-    return final_story
+    return dag_result.values["final_story"]
 
 # Create and run the evaluation
 eval_task = Eval(
     project_name,
     # Initialize the dataset from Braintrust UI
-    data=init_dataset(project=project_name, name="story-input"),
-    task=chain_task,
+    # EVAL_STREAM_DATASET=1 streams the rows page by page instead (see streaming_dataset.py)
+    # EVAL_DATASET_SNAPSHOT=1 reads a local snapshot, re-pulled only when the dataset changes (see dataset_snapshot.py)
+    data=snapshot_for_eval(
+        project_name, "story-input", fallback=dataset_for_eval(init_dataset(project=project_name, name="story-input"))
+    ),
+    # Rows are capped at EVAL_MAX_IN_FLIGHT_ROWS and counted for the rows/sec report (see row_scheduler.py)
+    task=scheduled_task(chain_task),
+    max_concurrency=get_max_in_flight_rows(),
     scores=[],
     experiment_name="prompt_chain_evaluation_structured_output",
     # Note that you cannot add description. Not sure why. But you can add others like metadata.
@@ -66,3 +90,4 @@ eval_task = Eval(
 # If you want to run the evaluation directly from this script
 if __name__ == "__main__":
     eval_task.run()
+    print(format_row_stats())
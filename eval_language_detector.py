@@ -0,0 +1,110 @@
+from dotenv import load_dotenv
+from braintrust import Eval, init_dataset
+from invoke_cache import cached_invoke
+from language_detector import detect_conversation_language, meets_fast_path_threshold
+from row_scheduler import with_batch_retries
+from unit_config import get_unit_config
+import os
+
+# <ai_context>
+# Agreement eval for the local language detector (language_detector.py) against the language-selection prompt.
+# Each row runs both: the prompt's answer is the reference, and the detector is scored only on the rows where it would
+# take the fast path (confidence >= LANGUAGE_FAST_PATH_MIN_CONFIDENCE), plus a coverage score for how often that is.
+# Rows come from the built-in conversations below, or from a Braintrust dataset named in LANGUAGE_EVAL_DATASET
+# (rows with input {"conversation": ...}). The task uses the eval/batch retry policy for throttled calls.
+# </ai_context>
+
+"""
+This script checks that the local language detector agrees with the language-selection prompt.
+
+use this command to run the evaluation:
+braintrust eval eval_language_detector.py
+"""
+
+# Load environment variables from .env file
+load_dotenv()
+
+project_name = "suggested-response"
+
+# Sample conversations covering each script the detector handles, plus cases it should leave to the prompt
+sample_conversations = [
+    "[2025-01-06 17:59:14] Guest: when the pool open? \\n",
+    "[2025-01-03 13:48:15] Guest: 澄雲吃什麼啊 \\n",
+    "[2025-01-03 18:01:37] Guest: 澄云供应哪种类型的食物？ \\n",
+    "[2025-01-03 18:01:37] Guest: 請問Manor Club幾點開門？ \\n",
+    "[2025-01-04 09:12:00] Guest: 朝食は何時からですか？ \\n",
+    "[2025-01-04 09:15:00] Guest: 조식은 몇 시부터인가요? \\n",
+    "[2025-01-04 10:01:00] Guest: สระว่ายน้ำเปิดกี่โมงคะ \\n",
+    "[2025-01-04 11:30:00] Guest: ¿A qué hora abre la piscina? \\n",
+    "[2025-01-04 11:32:00] Guest: Is 澄雲 open for dinner tonight? \\n",
+    # Latin-script messages built from words English shares with Dutch, German and Spanish; the prompt must decide
+    "[2025-01-04 11:40:00] Guest: Wanneer is het zwembad open? \\n",
+    "[2025-01-04 11:41:00] Guest: Is het zwembad morgen open? \\n",
+    "[2025-01-04 11:42:00] Guest: Das Zimmer is open? \\n",
+    "[2025-01-04 11:43:00] Guest: Hola, la piscina is open? \\n",
+    "[2025-01-04 12:00:00] Guest: 你好 \\n",
+    # Kana-free Japanese written only in kanji that Traditional Chinese shares; the prompt must decide
+    "[2025-01-04 12:05:00] Guest: 駐車場予約 \\n",
+    "[2025-01-04 12:06:00] Guest: 電話番号 \\n",
+    "[2025-01-05 13:26:42] Guest: 澄雲吃啥啊 \\n[2025-01-05 13:27:13] You: 下午好。 \\n"
+    "[2025-01-05 13:30:00] Guest: Can I book a table for two? \\n",
+]
+
+# Select the dataset: a Braintrust dataset if configured, otherwise the samples above
+dataset_name = os.environ.get("LANGUAGE_EVAL_DATASET")
+
+
+def load_data():
+    if dataset_name:
+        return init_dataset(project=project_name, name=dataset_name)
+    return [{"input": {"conversation": conversation}} for conversation in sample_conversations]
+
+
+# Task: the prompt's answer (reference) alongside the local detection
+def language_task(input_data):
+    extracted_values = get_unit_config()
+    prompt_response = cached_invoke(
+        project_name=project_name,
+        slug="language-selection-handler-1bb5",
+        input={
+            "brand_customer_term": extracted_values["brand_customer_term"],
+            "conversation": input_data["conversation"],
+            "unit_name": extracted_values["unit_name"],
+        }
+    )
+    detection = detect_conversation_language(input_data["conversation"], extracted_values["brand_customer_term"])
+
+    return {
+        "prompt_language": prompt_response["language"],
+        "detected_language": detection.language,
+        "confidence": detection.confidence,
+        "fast_path": meets_fast_path_threshold(detection),
+    }
+
+
+# Scorers: agreement only counts rows that would skip the prompt (None = not applicable)
+def fast_path_agreement(input, output, expected=None):
+    if not output["fast_path"]:
+        return None
+    return 1.0 if output["detected_language"].lower() == str(output["prompt_language"]).lower() else 0.0
+
+
+def fast_path_coverage(input, output, expected=None):
+    return 1.0 if output["fast_path"] else 0.0
+
+
+eval_task = Eval(
+    project_name,
+    data=load_data,
+    task=with_batch_retries(language_task),
+    scores=[fast_path_agreement, fast_path_coverage],
+    experiment_name="language_detector_agreement",
+    metadata={
+        "reference": "language-selection-handler-1bb5",
+        "dataset": dataset_name or "built-in samples",
+    }
+)
+
+# If you want to run the evaluation directly from this script
+if __name__ == "__main__":
+    eval_task.run()
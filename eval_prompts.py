@@ -1,6 +1,14 @@
-import braintrust
 from dotenv import load_dotenv
 from braintrust import Eval
+from prompt_dag import build_dag, prompt_stage, run_dag
+from row_scheduler import with_batch_retries
+
+# <ai_context>
+# Two-prompt chain eval over an in-memory dataset.
+# The chain is declared with prompt_dag.py (`story_chain`), so the dependency of the second prompt on the first is explicit.
+# Prompt calls go through `cached_invoke` (invoke_cache.py) so re-runs during prompt iteration can be served from
+# the response cache when BRAINTRUST_INVOKE_CACHE=1. The task uses the eval/batch retry policy for throttled calls.
+# </ai_context>
 
 """
 This script is used to evaluate the performance of a prompt chain (2 prompts).
@@ -38,37 +46,39 @@ dataset = [
     }
 ]
 
-# Define the task function that chains the two prompts
-def chain_task(input_data):
+# Define the chain of the two prompts
+story_chain = build_dag([
     # First prompt - generates initial content based on genre and context
-    # Note that braintrust.invoke returns a string, not a dictionary.
-    story_outline = braintrust.invoke(
+    # Note that invoke returns a string, not a dictionary.
+    prompt_stage(
+        name="story_outline",
         project_name=project_name,
         slug="storyoutline-geminiFlash001",
-        input={
-            "genre": input_data["genre"],
-            "context": input_data["context"]
-        }
-    )
-    
+        inputs=("genre", "context"),
+    ),
     # Second prompt - refines or extends the first output
-    final_story = braintrust.invoke(
+    prompt_stage(
+        name="final_story",
         project_name=project_name,
         slug="story-4omini",
-        input={
-            "outline": story_outline
-        }
-    )
-    
+        inputs=("story_outline",),
+        build_input=lambda story_outline: {"outline": story_outline},
+    ),
+])
+
+# Define the task function that runs the chain
+def chain_task(input_data):
+    dag_result = run_dag(story_chain, {"genre": input_data["genre"], "context": input_data["context"]})
+
     # Return the final output for Braintrust
-    return final_story
+    return dag_result.values["final_story"]
 
 # Create and run the evaluation
 eval_task = Eval(
     project_name,
     # lambda is used to lazily load the dataset. This is particularly useful when your dataset is large, as it prevents loading the entire dataset into memory until it's actually needed during evaluation. It's a common pattern in Braintrust to wrap datasets with a lambda.
     data=lambda: dataset,
-    task=chain_task,
+    task=with_batch_retries(chain_task),
     scores=[],
     experiment_name="prompt_chain_evaluation"
 )
@@ -1,9 +1,23 @@
-import braintrust
 from dotenv import load_dotenv
-from braintrust import Eval, init_dataset, traced
+from braintrust import Eval, init_dataset
+from prompt_dag import Stage, build_dag, prompt_stage, run_dag
+from row_scheduler import format_row_stats, get_max_in_flight_rows, scheduled_task
+from span_export import sampled_traced
+from dataset_snapshot import snapshot_for_eval
+from streaming_dataset import dataset_for_eval
 import random
 import time
 
+# <ai_context>
+# Two-prompt chain eval over the "story-input" dataset, with a traced local function between the prompts.
+# The chain is declared with prompt_dag.py (`story_chain`). `generate_random_context` does not depend on the outline
+# prompt, so the executor runs the two side by side and the story prompt starts once both are done.
+# The prompt invokes use `cached_invoke` from invoke_cache.py (opt-in response cache).
+# Large datasets: rows are capped by EVAL_MAX_IN_FLIGHT_ROWS and prompt calls are rate limited per slug (row_scheduler.py).
+# With EVAL_DATASET_SNAPSHOT=1 the rows come from a local snapshot, pulled again only when the dataset version changes.
+# `generate_random_context` is traced with `sampled_traced` (span_export.py), so TRACE_SAMPLE_RATES applies to it.
+# </ai_context>
+
 """
 This script is used to evaluate the performance of a prompt chain (2 prompts) but with structured output.
 It uses the Braintrust API to invoke the prompts and dataset from the UI.
@@ -20,7 +34,7 @@ load_dotenv()
 # Replace these with your actual project name
 project_name = "workflow-glowing"
 
-@traced(type="function", metadata={"description": "Generate a random context for the story with a 1-second delay."})
+@sampled_traced(type="function", metadata={"description": "Generate a random context for the story with a 1-second delay."})
 def generate_random_context():
     """Generate a random context for the story with a 1-second delay."""
     contexts = [
@@ -36,44 +50,54 @@ def generate_random_context():
     
     return selected_context
 
-# Define the task function that chains the two prompts
-def chain_task(input_data):
+# Define the chain: the outline prompt and the random context are independent, the story prompt needs both
+story_chain = build_dag([
     # First prompt - generates initial content based on genre and context
     # The response is a structured dictionary with 'reason' and 'outline' fields
-    story_outline_response = braintrust.invoke(
+    prompt_stage(
+        name="story_outline_response",
         project_name=project_name,
         slug="storyoutline-geminiflash001-so",
-        input={
-            "genre": input_data["genre"],
-            "context": input_data["context"]
-        }
-    )
-    
+        inputs=("genre", "context"),
+    ),
     # Extract the outline directly from the dictionary, if doesn't exist, return empty string
-    story_outline = story_outline_response.get("outline", "")
-    
+    Stage(
+        name="story_outline",
+        fn=lambda story_outline_response: story_outline_response.get("outline", ""),
+        inputs=("story_outline_response",),
+        inline=True,
+    ),
     # Generate a random context with a delay
-    random_context = generate_random_context()
-    
+    Stage(name="random_context", fn=generate_random_context),
     # Second prompt - refines or extends the first output
-    final_story = braintrust.invoke(
+    prompt_stage(
+        name="final_story",
         project_name=project_name,
         slug="story-4omini-xtra",
-        input={
-            "outline": story_outline,
-            "context": random_context
-        }
-    )
-    
+        inputs=("story_outline", "random_context"),
+        build_input=lambda story_outline, random_context: {"outline": story_outline, "context": random_context},
+    ),
+])
+
+# Define the task function that runs the chain
+def chain_task(input_data):
+    dag_result = run_dag(story_chain, {"genre": input_data["genre"], "context": input_data["context"]})
+
     # Return the final output for Braintrust
-    return final_story
+    return dag_result.values["final_story"]
 
 # Create and run the evaluation
 eval_task = Eval(
     project_name,
     # Initialize the dataset from Braintrust UI
-    data=init_dataset(project=project_name, name="story-input"),
-    task=chain_task,
+    # EVAL_STREAM_DATASET=1 streams the rows page by page instead (see streaming_dataset.py)
+    # EVAL_DATASET_SNAPSHOT=1 reads a local snapshot, re-pulled only when the dataset changes (see dataset_snapshot.py)
+    data=snapshot_for_eval(
+        project_name, "story-input", fallback=dataset_for_eval(init_dataset(project=project_name, name="story-input"))
+    ),
+    # Rows are capped at EVAL_MAX_IN_FLIGHT_ROWS and counted for the rows/sec report (see row_scheduler.py)
+    task=scheduled_task(chain_task),
+    max_concurrency=get_max_in_flight_rows(),
     scores=[],
     experiment_name="prompt_chain_trace",
     # Note that you cannot add description. Not sure why. But you can add others like metadata.
@@ -88,3 +112,4 @@ eval_task = Eval(
 # If you want to run the evaluation directly from this script
 if __name__ == "__main__":
     eval_task.run()
+    print(format_row_stats())
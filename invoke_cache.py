@@ -0,0 +1,529 @@
+import copy
+import dataclasses
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional
+
+from pipeline_metrics import PROMPT_INPUT_BYTES, PROMPT_INVOKE_SECONDS, increment, observe
+from pipeline_concurrency import run_blocking
+from prompt_input import PromptInput, encode_canonical
+from row_scheduler import acall_with_rate_limit, call_with_rate_limit
+
+# <ai_context>
+# Content-addressed response cache for `braintrust.invoke`.
+# `cached_invoke` is a drop-in replacement used by the eval chains and the suggested-response pipeline.
+# Keys are a sha256 over (project, slug, resolved prompt version, stream flag, canonical JSON input) plus any other
+# `braintrust.invoke` argument that changes the response (`messages`, `mode`, `overrides`, ...). Calls passing
+# `parent`, `metadata` or `tags` bypass the cache, since a cached response would silently skip their logging.
+# Tiers: an in-memory LRU (always on when caching is enabled) and an optional on-disk tier with TTL and size-based eviction.
+# Streamed responses are recorded chunk by chunk on a miss and replayed on a hit; both are returned as a
+# `BraintrustStream`. Non-streamed hits return a copy, so callers cannot mutate the cached value.
+# Caching is opt-in (BRAINTRUST_INVOKE_CACHE=1) because prompt outputs are non-deterministic; when off, calls pass straight through.
+# `get_cache_stats()` exposes hit/miss/eviction counters.
+# Upstream calls (pass-through and misses) go through `row_scheduler.call_with_rate_limit`, so per-slug rate limits and
+# 429 backoff apply to real prompt calls only.
+# `acached_invoke` is the async counterpart for code on an event loop: misses await `braintrust.invoke_async` (and
+# versions `braintrust.load_prompt_async`) instead of holding a pool thread; cache lookups run inline unless the disk
+# tier is on, then on the blocking pool. Streams are returned as `BraintrustStream` either way, for `async for`.
+# The Braintrust SDK is imported on first use (not at import time) to keep worker cold starts short.
+# Every call records its duration per slug and its input size in pipeline_metrics.py (cache hits included).
+# Inputs built with prompt_input.py (`PromptInput`) are canonicalized and sized from their cached static fragments.
+# </ai_context>
+
+# Configuration (all read lazily so tests and scripts can toggle them at runtime)
+CACHE_ENABLED_ENV_VAR = "BRAINTRUST_INVOKE_CACHE"
+CACHE_DIR_ENV_VAR = "BRAINTRUST_INVOKE_CACHE_DIR"
+CACHE_MAX_ENTRIES_ENV_VAR = "BRAINTRUST_INVOKE_CACHE_MAX_ENTRIES"
+CACHE_TTL_ENV_VAR = "BRAINTRUST_INVOKE_CACHE_TTL_SECONDS"
+CACHE_MAX_BYTES_ENV_VAR = "BRAINTRUST_INVOKE_CACHE_MAX_BYTES"
+# How long a resolved "latest" prompt version is trusted before asking Braintrust again
+VERSION_TTL_ENV_VAR = "BRAINTRUST_INVOKE_CACHE_VERSION_TTL_SECONDS"
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_VERSION_TTL_SECONDS = 60
+
+# Map of chunk `type` -> name of the chunk dataclass in braintrust.functions.stream, used to rebuild streamed chunks
+_CHUNK_CLASS_NAMES = {
+    "text_delta": "BraintrustTextChunk",
+    "json_delta": "BraintrustJsonChunk",
+    "error": "BraintrustErrorChunk",
+    "console": "BraintrustConsoleChunk",
+    "progress": "BraintrustProgressChunk",
+}
+
+# `braintrust.invoke` arguments that only say how to reach Braintrust; they never change the response or the key
+_CONNECTION_KWARGS = frozenset(("org_name", "api_key", "app_url", "force_login"))
+# Arguments that matter for what the call logs (the parent span, its metadata and tags); calls passing them bypass the
+# cache so each one is really made and logged
+_UNCACHEABLE_KWARGS = frozenset(("parent", "metadata", "tags"))
+
+# In-memory LRU tier: key -> entry dict ({"created_at", "stream", "value" | "chunks"})
+_memory_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+# Resolved prompt versions: (project_name, slug) -> (version, resolved_at)
+_resolved_versions: Dict[tuple, tuple] = {}
+
+# Hit/miss counters, guarded by `_cache_lock`
+_stats = {
+    "memory_hits": 0,
+    "disk_hits": 0,
+    "misses": 0,
+    "stores": 0,
+    "memory_evictions": 0,
+    "disk_evictions": 0,
+    "expired": 0,
+}
+
+
+def is_cache_enabled() -> bool:
+    """Returns True when BRAINTRUST_INVOKE_CACHE is set to a truthy value."""
+    return os.environ.get(CACHE_ENABLED_ENV_VAR, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def canonicalize_input(input: Any) -> str:
+    """
+    Serializes an invoke input into a stable JSON string (sorted keys, no whitespace).
+
+    Two inputs that differ only in dict ordering produce the same string, so they share a cache entry. A `PromptInput`
+    reuses the pre-encoded fragments of its static fields.
+    """
+    if isinstance(input, PromptInput):
+        return input.canonical_json()
+    return encode_canonical(input)
+
+
+def canonical_input_size(input: Any) -> int:
+    """Returns the UTF-8 byte size of `canonicalize_input(input)` (without building it for a `PromptInput`)."""
+    if isinstance(input, PromptInput):
+        return input.canonical_size()
+    canonical_text = encode_canonical(input)
+    return len(canonical_text) if canonical_text.isascii() else len(canonical_text.encode("utf-8"))
+
+
+def make_cache_key(
+    project_name: str,
+    slug: str,
+    version: str,
+    input: Any,
+    stream: bool,
+    invoke_kwargs: Optional[Mapping[str, Any]] = None,
+) -> str:
+    """
+    Builds the content address for one invoke call.
+
+    Args:
+        invoke_kwargs: Other `braintrust.invoke` arguments of the call; connection arguments are ignored.
+
+    Returns:
+        A sha256 hex digest over the project, slug, prompt version, stream flag, canonical input and the other
+        response-relevant arguments (left out when there are none, so plain calls keep their existing keys).
+    """
+    # Hashes the same text as canonicalizing the whole dict: "input" sorts first, so the canonical input is fed ahead of
+    # the other (small) fields, and a `PromptInput` feeds its pre-encoded static fragments directly
+    key_fields: Dict[str, Any] = {"project_name": project_name, "slug": slug, "version": version, "stream": stream}
+    key_kwargs = {
+        name: value
+        for name, value in (invoke_kwargs or {}).items()
+        if name not in _CONNECTION_KWARGS and value is not None
+    }
+    if key_kwargs:
+        key_fields["invoke_kwargs"] = key_kwargs
+    other_fields = encode_canonical(key_fields)
+    hasher = hashlib.sha256(b'{"input":')
+    if isinstance(input, PromptInput):
+        input.update_hash(hasher)
+    else:
+        hasher.update(canonicalize_input(input).encode("utf-8"))
+    hasher.update(f",{other_fields[1:]}".encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Returns a snapshot of the cache counters, plus the derived hit rate and current memory size."""
+    with _cache_lock:
+        snapshot = dict(_stats)
+        snapshot["memory_entries"] = len(_memory_cache)
+    total_lookups = snapshot["memory_hits"] + snapshot["disk_hits"] + snapshot["misses"]
+    snapshot["hit_rate"] = (snapshot["memory_hits"] + snapshot["disk_hits"]) / total_lookups if total_lookups else 0.0
+    return snapshot
+
+
+def clear_cache(include_disk: bool = False) -> None:
+    """Empties the in-memory tier (and the on-disk tier if requested) and resets the counters."""
+    with _cache_lock:
+        _memory_cache.clear()
+        _resolved_versions.clear()
+        for counter_name in _stats:
+            _stats[counter_name] = 0
+    cache_dir = _get_cache_dir()
+    if include_disk and cache_dir is not None:
+        for entry_path in cache_dir.glob("*.json"):
+            entry_path.unlink(missing_ok=True)
+
+
+def _get_cache_dir() -> Optional[Path]:
+    """Returns the on-disk tier directory (created if needed), or None when the disk tier is disabled."""
+    cache_dir = os.environ.get(CACHE_DIR_ENV_VAR)
+    if not cache_dir:
+        return None
+    path = Path(cache_dir)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _get_ttl_seconds() -> float:
+    return float(os.environ.get(CACHE_TTL_ENV_VAR, DEFAULT_TTL_SECONDS))
+
+
+def _is_expired(entry: Dict[str, Any]) -> bool:
+    return time.time() - entry["created_at"] > _get_ttl_seconds()
+
+
+def _resolve_prompt_version(project_name: str, slug: str, version: Optional[str]) -> str:
+    """
+    Resolves the prompt version used in the cache key.
+
+    An explicit version is used as-is. Otherwise the current version is looked up with `braintrust.load_prompt`
+    (memoized for a short TTL), so editing a prompt in the UI invalidates cached outputs instead of serving stale ones.
+    Falls back to "latest" if the lookup fails (e.g. the slug is not a prompt).
+    """
+    if version is not None:
+        return str(version)
+    resolved_version = _get_memoized_version(project_name, slug)
+    if resolved_version is not None:
+        return resolved_version
+
+    try:
+        import braintrust
+
+        resolved_version = str(braintrust.load_prompt(project=project_name, slug=slug, no_trace=True).version)
+    except Exception:
+        resolved_version = "latest"
+    _resolved_versions[(project_name, slug)] = (resolved_version, time.time())
+    return resolved_version
+
+
+async def _aresolve_prompt_version(project_name: str, slug: str, version: Optional[str]) -> str:
+    """Async `_resolve_prompt_version` (same memo), looking the version up with `braintrust.load_prompt_async`."""
+    if version is not None:
+        return str(version)
+    resolved_version = _get_memoized_version(project_name, slug)
+    if resolved_version is not None:
+        return resolved_version
+
+    try:
+        import braintrust
+
+        prompt = await braintrust.load_prompt_async(project=project_name, slug=slug, no_trace=True)
+        resolved_version = str(prompt.version)
+    except Exception:
+        resolved_version = "latest"
+    _resolved_versions[(project_name, slug)] = (resolved_version, time.time())
+    return resolved_version
+
+
+def _get_memoized_version(project_name: str, slug: str) -> Optional[str]:
+    """Returns the prompt's resolved version if it was looked up less than the version TTL ago."""
+    version_ttl = float(os.environ.get(VERSION_TTL_ENV_VAR, DEFAULT_VERSION_TTL_SECONDS))
+    resolved = _resolved_versions.get((project_name, slug))
+    if resolved is not None and time.time() - resolved[1] < version_ttl:
+        return resolved[0]
+    return None
+
+
+def _memory_get(key: str) -> Optional[Dict[str, Any]]:
+    """Looks up the memory tier, refreshing LRU order on a hit and dropping expired entries."""
+    with _cache_lock:
+        entry = _memory_cache.get(key)
+        if entry is None:
+            return None
+        if _is_expired(entry):
+            del _memory_cache[key]
+            _stats["expired"] += 1
+            return None
+        _memory_cache.move_to_end(key)
+        _stats["memory_hits"] += 1
+        return entry
+
+
+def _memory_put(key: str, entry: Dict[str, Any]) -> None:
+    """Inserts into the memory tier, evicting least-recently-used entries past the size limit."""
+    max_entries = int(os.environ.get(CACHE_MAX_ENTRIES_ENV_VAR, DEFAULT_MAX_ENTRIES))
+    with _cache_lock:
+        _memory_cache[key] = entry
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > max_entries:
+            _memory_cache.popitem(last=False)
+            _stats["memory_evictions"] += 1
+
+
+def _disk_get(key: str) -> Optional[Dict[str, Any]]:
+    """Looks up the disk tier, deleting the file if it is expired or unreadable."""
+    cache_dir = _get_cache_dir()
+    if cache_dir is None:
+        return None
+    entry_path = cache_dir / f"{key}.json"
+    try:
+        entry = json.loads(entry_path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        # Corrupt or partially written entry: treat as a miss and remove it
+        entry_path.unlink(missing_ok=True)
+        return None
+    if _is_expired(entry):
+        entry_path.unlink(missing_ok=True)
+        with _cache_lock:
+            _stats["expired"] += 1
+        return None
+    with _cache_lock:
+        _stats["disk_hits"] += 1
+    return entry
+
+
+def _disk_put(key: str, entry: Dict[str, Any]) -> None:
+    """Writes an entry to the disk tier atomically, then enforces the size limit."""
+    cache_dir = _get_cache_dir()
+    if cache_dir is None:
+        return
+    entry_path = cache_dir / f"{key}.json"
+    # Write to a temp file and rename so concurrent readers never see a partial entry
+    temp_path = cache_dir / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+    temp_path.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+    os.replace(temp_path, entry_path)
+    _enforce_disk_limit(cache_dir)
+
+
+def _enforce_disk_limit(cache_dir: Path) -> None:
+    """Evicts the oldest disk entries (by modification time) until the tier fits in BRAINTRUST_INVOKE_CACHE_MAX_BYTES."""
+    max_bytes = int(os.environ.get(CACHE_MAX_BYTES_ENV_VAR, DEFAULT_MAX_BYTES))
+    entries = []
+    total_bytes = 0
+    for entry_path in cache_dir.glob("*.json"):
+        try:
+            entry_stat = entry_path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_path))
+        total_bytes += entry_stat.st_size
+    if total_bytes <= max_bytes:
+        return
+    # Oldest first
+    entries.sort()
+    for _, entry_size, entry_path in entries:
+        if total_bytes <= max_bytes:
+            break
+        entry_path.unlink(missing_ok=True)
+        total_bytes -= entry_size
+        with _cache_lock:
+            _stats["disk_evictions"] += 1
+
+
+def _store(key: str, entry: Dict[str, Any]) -> None:
+    """Stores an entry in both tiers."""
+    _memory_put(key, entry)
+    _disk_put(key, entry)
+    with _cache_lock:
+        _stats["stores"] += 1
+
+
+def serialize_chunk(chunk: Any) -> Dict[str, Any]:
+    """Converts a streamed chunk dataclass into a JSON-safe dict."""
+    return dataclasses.asdict(chunk)
+
+
+def deserialize_chunk(chunk_dict: Dict[str, Any]) -> Any:
+    """Rebuilds a streamed chunk dataclass from its dict form."""
+    from braintrust.functions import stream
+
+    chunk_class = getattr(stream, _CHUNK_CLASS_NAMES[chunk_dict["type"]])
+    return chunk_class(**chunk_dict)
+
+
+def _record_stream(key: str, live_stream: Any) -> Iterator[Any]:
+    """
+    Passes a live stream through chunk by chunk while recording it.
+
+    The entry is only stored once the stream is fully consumed, so an abandoned or failed stream is never cached.
+    """
+    recorded_chunks: List[Dict[str, Any]] = []
+    for chunk in live_stream:
+        recorded_chunks.append(serialize_chunk(chunk))
+        yield chunk
+    _store(key, {"created_at": time.time(), "stream": True, "chunks": recorded_chunks})
+
+
+def _invoke_upstream(
+    project_name: str, slug: str, input: Any, stream: bool, version: Optional[str], invoke_kwargs: Dict[str, Any]
+) -> Any:
+    """Calls the real prompt, within the slug's rate limit (resolved at call time so it can be patched)."""
+    import braintrust
+
+    return call_with_rate_limit(
+        slug,
+        lambda: braintrust.invoke(
+            project_name=project_name, slug=slug, input=input, stream=stream, version=version, **invoke_kwargs
+        ),
+    )
+
+
+async def _ainvoke_upstream(
+    project_name: str, slug: str, input: Any, stream: bool, version: Optional[str], invoke_kwargs: Dict[str, Any]
+) -> Any:
+    """Async `_invoke_upstream`: awaits `braintrust.invoke_async` within the slug's rate limit."""
+    import braintrust
+
+    return await acall_with_rate_limit(
+        slug,
+        lambda: braintrust.invoke_async(
+            project_name=project_name, slug=slug, input=input, stream=stream, version=version, **invoke_kwargs
+        ),
+    )
+
+
+def cached_invoke(
+    project_name: str,
+    slug: str,
+    input: Any = None,
+    stream: bool = False,
+    version: Optional[str] = None,
+    **invoke_kwargs: Any,
+) -> Any:
+    """
+    Drop-in replacement for `braintrust.invoke` that serves repeated calls from the cache.
+
+    Args:
+        project_name: The Braintrust project containing the prompt.
+        slug: The prompt slug.
+        input: The prompt input.
+        stream: Whether to stream the response.
+        version: Optional pinned prompt version; resolved automatically when omitted.
+        **invoke_kwargs: Any other `braintrust.invoke` arguments (passed through on a miss).
+
+    Returns:
+        The prompt output. Streamed responses are a `BraintrustStream` (replayed on a hit, recorded while the live
+        chunks pass through on a miss); a non-streamed hit is a copy of the cached value.
+    """
+    increment(PROMPT_INPUT_BYTES, canonical_input_size(input), slug)
+    started_at = time.perf_counter()
+    try:
+        return _invoke_through_cache(project_name, slug, input, stream, version, invoke_kwargs)
+    finally:
+        observe(PROMPT_INVOKE_SECONDS, time.perf_counter() - started_at, slug)
+
+
+async def acached_invoke(
+    project_name: str,
+    slug: str,
+    input: Any = None,
+    stream: bool = False,
+    version: Optional[str] = None,
+    **invoke_kwargs: Any,
+) -> Any:
+    """
+    Async `cached_invoke`, a drop-in replacement for `braintrust.invoke_async`; same arguments, keys and return values.
+
+    A streamed response is a `BraintrustStream`; iterate it with `async for`.
+    """
+    increment(PROMPT_INPUT_BYTES, canonical_input_size(input), slug)
+    started_at = time.perf_counter()
+    try:
+        return await _ainvoke_through_cache(project_name, slug, input, stream, version, invoke_kwargs)
+    finally:
+        observe(PROMPT_INVOKE_SECONDS, time.perf_counter() - started_at, slug)
+
+
+def _bypasses_cache(invoke_kwargs: Dict[str, Any]) -> bool:
+    """Caching disabled, or a call whose logging must really happen."""
+    return not is_cache_enabled() or any(invoke_kwargs.get(name) is not None for name in _UNCACHEABLE_KWARGS)
+
+
+def _lookup(key: str) -> Optional[Dict[str, Any]]:
+    """Memory tier first, then disk (promoting disk hits into memory); counts a miss."""
+    entry = _memory_get(key)
+    if entry is None:
+        entry = _disk_get(key)
+        if entry is not None:
+            _memory_put(key, entry)
+    if entry is None:
+        with _cache_lock:
+            _stats["misses"] += 1
+    return entry
+
+
+def _response_from_entry(entry: Dict[str, Any]) -> Any:
+    """What a hit returns: a replayed stream, or a copy of the value."""
+    if entry["stream"]:
+        from braintrust.functions.stream import BraintrustStream
+
+        return BraintrustStream([deserialize_chunk(chunk_dict) for chunk_dict in entry["chunks"]])
+    # The entry is shared with later hits; the caller gets its own copy
+    return copy.deepcopy(entry["value"])
+
+
+def _non_stream_entry(response: Any) -> Dict[str, Any]:
+    return {"created_at": time.time(), "stream": False, "value": copy.deepcopy(response)}
+
+
+def _recording_stream(key: str, response: Any) -> Any:
+    """Wraps a live stream so it is stored once fully consumed."""
+    from braintrust.functions.stream import BraintrustStream
+
+    # Same type as a hit, so callers can use `final_value()`, `copy()` or async iteration either way
+    return BraintrustStream(_record_stream(key, response))
+
+
+async def _run_cache_io(fn: Callable[..., Any], *args: Any) -> Any:
+    """Runs a cache tier operation: inline for the memory tier, on the blocking pool when it may touch the disk."""
+    if _get_cache_dir() is None:
+        return fn(*args)
+    return await run_blocking(fn, *args)
+
+
+def _invoke_through_cache(
+    project_name: str, slug: str, input: Any, stream: bool, version: Optional[str], invoke_kwargs: Dict[str, Any]
+) -> Any:
+    """Serves the call from the cache, or invokes the prompt (storing the response) on a miss."""
+    # Guard clause: behave exactly like braintrust.invoke
+    if _bypasses_cache(invoke_kwargs):
+        return _invoke_upstream(project_name, slug, input, stream, version, invoke_kwargs)
+
+    resolved_version = _resolve_prompt_version(project_name, slug, version)
+    key = make_cache_key(project_name, slug, resolved_version, input, stream, invoke_kwargs)
+    entry = _lookup(key)
+    if entry is not None:
+        return _response_from_entry(entry)
+
+    response = _invoke_upstream(project_name, slug, input, stream, version, invoke_kwargs)
+    if stream:
+        return _recording_stream(key, response)
+    _store(key, _non_stream_entry(response))
+    return response
+
+
+async def _ainvoke_through_cache(
+    project_name: str, slug: str, input: Any, stream: bool, version: Optional[str], invoke_kwargs: Dict[str, Any]
+) -> Any:
+    """Async `_invoke_through_cache`."""
+    if _bypasses_cache(invoke_kwargs):
+        return await _ainvoke_upstream(project_name, slug, input, stream, version, invoke_kwargs)
+
+    resolved_version = await _aresolve_prompt_version(project_name, slug, version)
+    key = make_cache_key(project_name, slug, resolved_version, input, stream, invoke_kwargs)
+    entry = await _run_cache_io(_lookup, key)
+    if entry is not None:
+        return _response_from_entry(entry)
+
+    response = await _ainvoke_upstream(project_name, slug, input, stream, version, invoke_kwargs)
+    if stream:
+        return _recording_stream(key, response)
+    await _run_cache_io(_store, key, _non_stream_entry(response))
+    return response
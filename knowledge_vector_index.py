@@ -0,0 +1,407 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from quick_reply_index import STOPWORDS
+
+# <ai_context>
+# Local vector index for knowledge-base lookups in `rag_data`.
+# Embeddings are offline and deterministic: signed feature hashing of word unigrams and character n-grams (crc32, so the
+# same text maps to the same vector in every process), L2-normalised float32. Stopwords shared with the quick-reply
+# index are dropped first so boilerplate like "Guest asks..." in open-issues queries does not dominate.
+# The index lives in a directory. Each build writes its own generation of files, named after its build id:
+# `vectors-<id>.npy` (N x dim float32), `documents-<id>.bin` (UTF-8 ids and texts back to back),
+# `offsets-<id>.npy` (N x 3 int64: id start, text start, text end in the blob) and `hashes-<id>.npy` (content hashes,
+# read only by the builder). `manifest.json` ({"format", "build_id", "dim", "count"}) is replaced last and names the
+# generation to read, so a load during a rebuild gets either the old or the new files, never a mix.
+# Readers memory-map the vectors, the blob and the offsets, so many worker processes share one copy through the page
+# cache and a search only decodes the texts of its top-k hits.
+# `build_or_update_index` is incremental: unchanged documents reuse their stored vectors, only new/edited ones are
+# embedded. The previous generation is kept (readers that just read the old manifest can still open it, and open
+# mappings stay valid); older ones are deleted.
+# `search_knowledge_base` embeds a batch of queries and scores them with one matrix product per block of rows; hits at or
+# below DEFAULT_MIN_SCORE (calibrated against hash-collision noise) are dropped.
+# CLI: python knowledge_vector_index.py build --source data/knowledge_base --index data/knowledge_base_index
+#      python knowledge_vector_index.py search --index data/knowledge_base_index "pool opening hours"
+# </ai_context>
+
+DEFAULT_DIM = 512
+# Character n-gram sizes used by the hashed embedding
+CHAR_NGRAM_SIZES = (3, 4, 5)
+# Cosine similarity a hit must exceed. Hash collisions give unrelated texts small positive scores (typically below 0.15),
+# while real matches score 0.25 and up, so a 0 threshold would always return top-k noise.
+DEFAULT_MIN_SCORE = 0.2
+# Rows scored per matrix product, bounding the temporary score matrix for very large indexes
+SEARCH_BLOCK_ROWS = 65_536
+
+# Bumped when the file layout changes; older indexes must be rebuilt
+INDEX_FORMAT_VERSION = 2
+MANIFEST_FILE = "manifest.json"
+# Per-build files, formatted with the build id
+VECTORS_FILE = "vectors-{build_id}.npy"
+DOCUMENTS_FILE = "documents-{build_id}.bin"
+OFFSETS_FILE = "offsets-{build_id}.npy"
+HASHES_FILE = "hashes-{build_id}.npy"
+# Times a load re-reads the manifest when a rebuild removed the generation it named in the meantime
+LOAD_ATTEMPTS = 3
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass(frozen=True)
+class KnowledgeVectorIndex:
+    """A loaded index: the memory-mapped vectors, document blob and offsets of one build (row-aligned)."""
+
+    vectors: np.ndarray
+    # Row -> (id start, text start, text end) in `documents`
+    document_offsets: np.ndarray
+    # UTF-8 ids and texts back to back
+    documents: np.ndarray
+    dim: int
+    build_id: str
+
+    @property
+    def document_count(self) -> int:
+        return self.vectors.shape[0]
+
+    def document(self, row: int) -> Tuple[str, str]:
+        """Decodes one row's (document id, text) from the mapped blob."""
+        id_start, text_start, text_end = (int(offset) for offset in self.document_offsets[row])
+        return (
+            self.documents[id_start:text_start].tobytes().decode("utf-8"),
+            self.documents[text_start:text_end].tobytes().decode("utf-8"),
+        )
+
+
+def _feature_hash(feature: str) -> int:
+    """Stable 32-bit hash of a feature (unlike `hash()`, identical across processes and runs)."""
+    return zlib.crc32(feature.encode("utf-8"))
+
+
+def embed_texts(texts: Sequence[str], dim: int = DEFAULT_DIM) -> np.ndarray:
+    """
+    Embeds texts with signed feature hashing of words and character n-grams.
+
+    Returns:
+        A (len(texts), dim) float32 matrix with L2-normalised rows (all-zero rows for empty texts).
+    """
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row_index, text in enumerate(texts):
+        normalized_text = " ".join(word for word in _WORD_PATTERN.findall(text.lower()) if word not in STOPWORDS)
+        features = normalized_text.split()
+        # Pad with spaces so n-grams capture word boundaries
+        padded_text = f" {normalized_text} "
+        for ngram_size in CHAR_NGRAM_SIZES:
+            features.extend(padded_text[i : i + ngram_size] for i in range(len(padded_text) - ngram_size + 1))
+        for feature in features:
+            feature_hash = _feature_hash(feature)
+            # Low bits pick the column, one high bit picks the sign (reduces collision bias)
+            matrix[row_index, feature_hash % dim] += 1.0 if feature_hash & 0x80000000 else -1.0
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _read_manifest(index_dir: Path) -> Optional[dict]:
+    manifest_path = index_dir / MANIFEST_FILE
+    if not manifest_path.exists():
+        return None
+    return json.loads(manifest_path.read_text(encoding="utf-8"))
+
+
+def _write_atomically(path: Path, write_fn) -> None:
+    """Writes via a temp file + rename, so readers see either the old or the new file, never a partial one."""
+    temp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    write_fn(temp_path)
+    os.replace(temp_path, path)
+
+
+def _save_matrix(path: Path, matrix: np.ndarray) -> None:
+    # Save through a file handle: np.save would append ".npy" to a temp file name
+    with open(path, "wb") as matrix_file:
+        np.save(matrix_file, matrix)
+
+
+def _write_documents(path: Path, document_ids: Sequence[str], documents: Dict[str, str]) -> np.ndarray:
+    """Writes ids and texts back to back as UTF-8 and returns their (N x 3) offsets."""
+    offsets = np.empty((len(document_ids), 3), dtype=np.int64)
+    position = 0
+    with open(path, "wb") as documents_file:
+        for row, document_id in enumerate(document_ids):
+            id_bytes = document_id.encode("utf-8")
+            text_bytes = documents[document_id].encode("utf-8")
+            documents_file.write(id_bytes)
+            documents_file.write(text_bytes)
+            offsets[row] = (position, position + len(id_bytes), position + len(id_bytes) + len(text_bytes))
+            position = int(offsets[row, 2])
+    return offsets
+
+
+def _remove_other_builds(index_path: Path, kept_build_ids: Sequence[str]) -> None:
+    """Deletes the files of every build except `kept_build_ids` (plus files of the pre-generation layout)."""
+    kept_names = {
+        file_pattern.format(build_id=build_id)
+        for build_id in kept_build_ids
+        for file_pattern in (VECTORS_FILE, DOCUMENTS_FILE, OFFSETS_FILE, HASHES_FILE)
+    }
+    for file_pattern in (VECTORS_FILE, DOCUMENTS_FILE, OFFSETS_FILE, HASHES_FILE, "vectors.npy", "documents.jsonl"):
+        for file_path in index_path.glob(file_pattern.format(build_id="*")):
+            if file_path.name not in kept_names:
+                file_path.unlink(missing_ok=True)
+
+
+def build_or_update_index(documents: Dict[str, str], index_dir: str, dim: int = DEFAULT_DIM) -> Dict[str, int]:
+    """
+    Builds the index, or updates it incrementally if one already exists with the same dimension.
+
+    Args:
+        documents: Mapping of document id -> text. Documents missing from the mapping are removed from the index.
+        index_dir: Directory holding the index files.
+        dim: Embedding dimension.
+
+    Returns:
+        Counts of reused, embedded and removed documents.
+    """
+    index_path = Path(index_dir)
+    index_path.mkdir(parents=True, exist_ok=True)
+
+    # Map of content hash -> row in the existing matrix, for vectors that can be reused
+    reusable_rows: Dict[str, int] = {}
+    previous_hashes: List[str] = []
+    existing_vectors: Optional[np.ndarray] = None
+    existing_manifest = _read_manifest(index_path)
+    if existing_manifest is not None and existing_manifest.get("format") == INDEX_FORMAT_VERSION:
+        previous_build_id = existing_manifest["build_id"]
+        previous_hashes = [
+            content_hash.decode("ascii")
+            for content_hash in np.load(index_path / HASHES_FILE.format(build_id=previous_build_id))
+        ]
+        if existing_manifest["dim"] == dim:
+            existing_vectors = np.load(index_path / VECTORS_FILE.format(build_id=previous_build_id), mmap_mode="r")
+            reusable_rows = {content_hash: row for row, content_hash in enumerate(previous_hashes)}
+
+    document_ids = sorted(documents)
+    content_hashes = [_content_hash(documents[document_id]) for document_id in document_ids]
+    vectors = np.empty((len(document_ids), dim), dtype=np.float32)
+
+    # Copy reusable vectors, collect the rest for one batched embedding pass
+    rows_to_embed: List[int] = []
+    for row, content_hash in enumerate(content_hashes):
+        existing_row = reusable_rows.get(content_hash)
+        if existing_vectors is not None and existing_row is not None:
+            vectors[row] = existing_vectors[existing_row]
+        else:
+            rows_to_embed.append(row)
+    if rows_to_embed:
+        vectors[rows_to_embed] = embed_texts([documents[document_ids[row]] for row in rows_to_embed], dim)
+
+    removed_count = len(set(previous_hashes) - set(content_hashes))
+
+    # A new generation of files, then the manifest that points readers at it
+    build_id = f"{time.time_ns():x}"
+    offsets = _write_documents(index_path / DOCUMENTS_FILE.format(build_id=build_id), document_ids, documents)
+    _save_matrix(index_path / OFFSETS_FILE.format(build_id=build_id), offsets)
+    _save_matrix(index_path / VECTORS_FILE.format(build_id=build_id), vectors)
+    _save_matrix(index_path / HASHES_FILE.format(build_id=build_id), np.array(content_hashes, dtype="S64"))
+    _write_atomically(
+        index_path / MANIFEST_FILE,
+        lambda temp_path: temp_path.write_text(
+            json.dumps(
+                {"format": INDEX_FORMAT_VERSION, "build_id": build_id, "dim": dim, "count": len(document_ids)}
+            ),
+            encoding="utf-8",
+        ),
+    )
+    # Keep the previous generation for readers that read the old manifest just before the swap
+    kept_build_ids = [build_id]
+    if existing_manifest is not None and existing_manifest.get("format") == INDEX_FORMAT_VERSION:
+        kept_build_ids.append(existing_manifest["build_id"])
+    _remove_other_builds(index_path, kept_build_ids)
+
+    return {"reused": len(document_ids) - len(rows_to_embed), "embedded": len(rows_to_embed), "removed": removed_count}
+
+
+def _open_build(index_path: Path, manifest: dict) -> KnowledgeVectorIndex:
+    """Maps the files of the build the manifest names, checking they belong together."""
+    build_id = manifest["build_id"]
+    vectors = np.load(index_path / VECTORS_FILE.format(build_id=build_id), mmap_mode="r")
+    document_offsets = np.load(index_path / OFFSETS_FILE.format(build_id=build_id), mmap_mode="r")
+    documents_path = index_path / DOCUMENTS_FILE.format(build_id=build_id)
+    # An empty file cannot be mapped (index without documents)
+    documents = (
+        np.memmap(documents_path, dtype=np.uint8, mode="r")
+        if documents_path.stat().st_size
+        else np.empty(0, dtype=np.uint8)
+    )
+    if vectors.shape != (manifest["count"], manifest["dim"]) or document_offsets.shape != (manifest["count"], 3):
+        raise ValueError(f"Knowledge index build '{build_id}' in '{index_path}' does not match its manifest")
+    return KnowledgeVectorIndex(
+        vectors=vectors, document_offsets=document_offsets, documents=documents, dim=manifest["dim"], build_id=build_id
+    )
+
+
+def load_index(index_dir: str) -> KnowledgeVectorIndex:
+    """
+    Opens the build named by the manifest, memory-mapping its vectors, documents and offsets read-only (shared across
+    processes via the page cache; texts are decoded only for the rows a search returns).
+
+    Raises:
+        FileNotFoundError: If no index has been built in `index_dir`.
+        ValueError: If the index was built in an older format.
+    """
+    index_path = Path(index_dir)
+    for attempt in range(LOAD_ATTEMPTS):
+        manifest = _read_manifest(index_path)
+        if manifest is None:
+            raise FileNotFoundError(f"No knowledge index in '{index_dir}'; build it first")
+        if manifest.get("format") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Knowledge index in '{index_dir}' uses an older format; rebuild it")
+        try:
+            return _open_build(index_path, manifest)
+        except FileNotFoundError:
+            # Two rebuilds finished since the manifest was read and removed its generation; read the new manifest
+            if attempt == LOAD_ATTEMPTS - 1:
+                raise
+    raise FileNotFoundError(f"No knowledge index in '{index_dir}'")
+
+
+# Process-wide cache of loaded indexes: index_dir -> (manifest mtime, index)
+_loaded_indexes: Dict[str, Tuple[float, KnowledgeVectorIndex]] = {}
+_loaded_indexes_lock = threading.Lock()
+
+
+def get_index(index_dir: str) -> Optional[KnowledgeVectorIndex]:
+    """
+    Returns the cached index for a directory, reloading it only when the manifest changes (i.e. after a rebuild).
+
+    Returns None if no index has been built there.
+    """
+    manifest_path = Path(index_dir) / MANIFEST_FILE
+    try:
+        manifest_mtime = manifest_path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    cached = _loaded_indexes.get(index_dir)
+    if cached is not None and cached[0] == manifest_mtime:
+        return cached[1]
+    with _loaded_indexes_lock:
+        cached = _loaded_indexes.get(index_dir)
+        if cached is None or cached[0] != manifest_mtime:
+            cached = (manifest_mtime, load_index(index_dir))
+            _loaded_indexes[index_dir] = cached
+    return cached[1]
+
+
+def search_knowledge_base(
+    index: KnowledgeVectorIndex,
+    queries: Sequence[str],
+    top_k: int = 3,
+    min_score: float = DEFAULT_MIN_SCORE,
+) -> List[List[Tuple[str, str, float]]]:
+    """
+    Batched top-k cosine search.
+
+    Args:
+        index: A loaded index.
+        queries: Query texts, embedded together.
+        top_k: Results per query.
+        min_score: Results at or below this cosine similarity are dropped.
+
+    Returns:
+        One list per query of (document_id, text, score), best first.
+    """
+    document_count = index.document_count
+    if not queries or document_count == 0:
+        return [[] for _ in queries]
+
+    query_matrix = embed_texts(queries, index.dim)
+    k = min(top_k, document_count)
+    # Running best (score, row) per query, merged block by block
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+
+    for block_start in range(0, document_count, SEARCH_BLOCK_ROWS):
+        block = index.vectors[block_start : block_start + SEARCH_BLOCK_ROWS]
+        # (queries x dim) @ (dim x block_rows): one vectorised product scores every query against the block
+        block_scores = query_matrix @ block.T
+        candidate_scores = np.concatenate([best_scores, block_scores], axis=1)
+        candidate_rows = np.concatenate(
+            [best_rows, np.broadcast_to(np.arange(block_start, block_start + block.shape[0]), block_scores.shape)], axis=1
+        )
+        # argpartition keeps the k best without a full sort
+        keep = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k] if candidate_scores.shape[1] > k else np.argsort(-candidate_scores, axis=1)
+        best_scores = np.take_along_axis(candidate_scores, keep, axis=1)
+        best_rows = np.take_along_axis(candidate_rows, keep, axis=1)
+
+    # Final ordering of the k survivors per query
+    order = np.argsort(-best_scores, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    best_rows = np.take_along_axis(best_rows, order, axis=1)
+
+    # Only the returned rows are decoded from the mapped blob
+    results: List[List[Tuple[str, str, float]]] = []
+    for query_scores, query_rows in zip(best_scores, best_rows):
+        results.append(
+            [(*index.document(int(row)), float(score)) for score, row in zip(query_scores, query_rows) if score > min_score]
+        )
+    return results
+
+
+def load_source_documents(source_dir: str) -> Dict[str, str]:
+    """
+    Reads *.md / *.txt files under a directory into documents, one per blank-line-separated paragraph.
+
+    Document ids are "<relative path>#<paragraph number>", so editing one paragraph only re-embeds that paragraph.
+    """
+    documents: Dict[str, str] = {}
+    source_path = Path(source_dir)
+    for file_path in sorted(list(source_path.rglob("*.md")) + list(source_path.rglob("*.txt"))):
+        paragraphs = [paragraph.strip() for paragraph in re.split(r"\n\s*\n", file_path.read_text(encoding="utf-8"))]
+        for paragraph_number, paragraph in enumerate(paragraph for paragraph in paragraphs if paragraph):
+            documents[f"{file_path.relative_to(source_path)}#{paragraph_number}"] = paragraph
+    return documents
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the local knowledge-base vector index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Build or incrementally update the index from source files")
+    build_parser.add_argument("--source", required=True, help="Directory of *.md / *.txt knowledge files")
+    build_parser.add_argument("--index", required=True, help="Index directory")
+    build_parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    search_parser = subparsers.add_parser("search", help="Query the index")
+    search_parser.add_argument("--index", required=True, help="Index directory")
+    search_parser.add_argument("--top-k", type=int, default=3)
+    search_parser.add_argument("--min-score", type=float, default=DEFAULT_MIN_SCORE)
+    search_parser.add_argument("queries", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        started_at = time.perf_counter()
+        counts = build_or_update_index(load_source_documents(args.source), args.index, args.dim)
+        print(f"Index updated in {(time.perf_counter() - started_at) * 1000:.1f} ms: {counts}")
+    else:
+        started_at = time.perf_counter()
+        all_results = search_knowledge_base(
+            load_index(args.index), args.queries, top_k=args.top_k, min_score=args.min_score
+        )
+        print(f"Searched {len(args.queries)} queries in {(time.perf_counter() - started_at) * 1000:.2f} ms")
+        for query, query_results in zip(args.queries, all_results):
+            print(f"\n{query}")
+            for document_id, text, score in query_results:
+                print(f"  {score:.3f}  {document_id}: {text[:100]}")
@@ -0,0 +1,273 @@
+import os
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+# <ai_context>
+# Local language detection for the suggested-response pipeline, so the `language-selection-handler` prompt is only
+# called when the answer is not obvious.
+# `extract_last_customer_message` finds the most recent guest turn in the conversation transcript
+# ("[timestamp] Guest: text" lines, separated by real or escaped "\n").
+# `detect_language` classifies that text from its script in microseconds: kana -> Japanese, hangul -> Korean, Thai,
+# Han ideographs split into Traditional/Simplified Chinese by characters unique to each variant (and not also Japanese
+# kanji, so kana-free Japanese such as "駐車場予約" is left to the prompt), and Latin text is
+# English only when English-only function words are at least MIN_ENGLISH_MARKER_SHARE of its words, with no accented
+# letters and no Dutch/German/Spanish/French/Italian function words (other Latin languages fall back to the prompt).
+# `select_language_locally` is what the pipeline calls: it returns a response shaped like the prompt's
+# ({"reason", "language"}) when confidence >= LANGUAGE_FAST_PATH_MIN_CONFIDENCE, else None, and counts both outcomes
+# (`get_language_fast_path_stats`). LANGUAGE_FAST_PATH=0 disables the fast path entirely.
+# Agreement with the prompt is measured by eval_language_detector.py.
+# </ai_context>
+
+FAST_PATH_ENV_VAR = "LANGUAGE_FAST_PATH"
+MIN_CONFIDENCE_ENV_VAR = "LANGUAGE_FAST_PATH_MIN_CONFIDENCE"
+DEFAULT_MIN_CONFIDENCE = 0.9
+
+# Labels returned in the "language" field, matching the ones the language-selection prompt uses
+ENGLISH = "English"
+TRADITIONAL_CHINESE = "Traditional Chinese"
+SIMPLIFIED_CHINESE = "Simplified Chinese"
+JAPANESE = "Japanese"
+KOREAN = "Korean"
+THAI = "Thai"
+
+# Common characters that only exist in one Chinese variant, as (traditional, simplified) pairs.
+# Pairs where the simplified form is also a regular traditional character (e.g. 後/后, 裡/里, 臺/台) are left out.
+_VARIANT_PAIRS = (
+    "麼么 們们 這这 個个 來来 時时 會会 為为 說说 對对 過过 還还 當当 與与 學学 點点 從从 開开 關关 門门 問问 間间 "
+    "電电 話话 東东 車车 長长 書书 見见 現现 發发 經经 無无 體体 麗丽 樣样 實实 聽听 讀读 買买 賣卖 氣气 網网 頁页 "
+    "號号 館馆 飯饭 訂订 場场 務务 嗎吗 應应 該该 請请 謝谢 幫帮 給给 讓让 單单 認认 識识 機机 廳厅 樓楼 層层 預预 "
+    "約约 費费 錢钱 數数 辦办 變变 雲云 類类 種种 愛爱 鐘钟 燈灯 熱热 歲岁 兒儿 區区 華华 國国 灣湾 檢检 條条 紙纸 "
+    "備备 戶户 習习 聯联 絡络 態态 邊边 歡欢 離离 選选 擇择 傳传 帶带 壞坏 員员 飲饮 衛卫 線线 訊讯 資资 須须 "
+    "價价 寫写 夠够 啟启 專专 護护 療疗 藥药 醫医 頭头 腦脑 雙双 觀观 議议 際际 語语 設设 計计"
+).split()
+# Forms of the pairs above that are also standard Japanese kanji (駐車場, 予約, 電話番号, 会議, 国際, ...). They say nothing
+# about the Chinese variant of a kana-free message that may well be Japanese, so they are not counted as evidence.
+_JAPANESE_KANJI = frozenset(
+    "個時過還開門問間電話東車長書見現無麗買網頁館飯訂場務該請謝給認識機層預約費雲類種愛鐘熱華紙備習絡態離選員飲衛線"
+    "訊資須護療頭議際語設計来会当与学点体号区国条医双灯数湾写楼"
+)
+_TRADITIONAL_ONLY = frozenset(pair[0] for pair in _VARIANT_PAIRS) - _JAPANESE_KANJI
+_SIMPLIFIED_ONLY = frozenset(pair[1] for pair in _VARIANT_PAIRS) - _JAPANESE_KANJI
+
+# Frequent English words that are not also words in Dutch, German, Spanish, French or Italian (so "is", "open",
+# "want", "room", "was", "will", "has", "pool" and the like are deliberately absent, as are greetings and loanwords such
+# as "hi", "hello" and "check" that non-English speakers use too)
+_ENGLISH_MARKERS = frozenset(
+    "the are were what when where why how which who can could would should have does did you your our this that these "
+    "those there please thank thanks with and from about close book need any time today tomorrow tonight morning out "
+    "available".split()
+)
+# Function words of other Latin-script languages; any of them means the message is not (only) English
+_NON_ENGLISH_MARKERS = frozenset(
+    "het een wanneer zijn niet ik ook nog der die das und ist nicht ich wann ein eine el los las una por para que como "
+    "cuando hola donde est les une pour quand avec je il della quando sono".split()
+)
+# Share of a message's words that must be English markers; below it the prompt decides
+MIN_ENGLISH_MARKER_SHARE = 0.25
+
+# One transcript line: optional "[timestamp]", speaker, colon, text
+_TURN_PATTERN = re.compile(r"^\s*(?:\[[^\]]*\]\s*)?([^:\[\]]{1,40}):\s*(.*)$")
+_LATIN_WORD_PATTERN = re.compile(r"[a-z']+")
+# Scripts are compared in word-sized units (a Latin word vs a CJK character). A script holding at least this share is
+# the message's language even with embedded names in another script ("Manor Club幾點開門", "Is 澄雲 open?")
+DOMINANT_SCRIPT_SHARE = 0.6
+
+
+@dataclass(frozen=True)
+class LanguageDetection:
+    """Outcome of local detection: the language label (None if unknown), how sure we are, and the dominant script."""
+
+    language: Optional[str]
+    confidence: float
+    script: str
+
+
+# Fast-path counters (read with `get_language_fast_path_stats`)
+_stats_lock = threading.Lock()
+_stats = {
+    "fast_path": 0,
+    "fallback_low_confidence": 0,
+    "fallback_disabled": 0,
+}
+_fast_path_languages: Dict[str, int] = {}
+
+
+def _is_fast_path_enabled() -> bool:
+    return os.environ.get(FAST_PATH_ENV_VAR, "1").lower() not in ("0", "false", "no", "off")
+
+
+def _get_min_confidence() -> float:
+    return float(os.environ.get(MIN_CONFIDENCE_ENV_VAR, DEFAULT_MIN_CONFIDENCE))
+
+
+def extract_last_customer_message(conversation: str, customer_term: str = "guest") -> str:
+    """
+    Returns the text of the most recent turn by the customer, or "" if there is none.
+
+    Args:
+        conversation: Transcript with one "[timestamp] Speaker: text" turn per line (real or escaped "\\n").
+        customer_term: Speaker label of the customer (case-insensitive), e.g. the brand's `brand_customer_term`.
+    """
+    speaker = customer_term.strip().lower()
+    turns = conversation.replace("\\n", "\n").splitlines()
+    for turn in reversed(turns):
+        match = _TURN_PATTERN.match(turn)
+        if match and match.group(1).strip().lower() == speaker and match.group(2).strip():
+            return match.group(2).strip()
+    return ""
+
+
+def _scale_by_share(evidence: float, script_share: float) -> float:
+    """Confidence from the per-script evidence, discounted when the script does not clearly dominate the message."""
+    return evidence if script_share >= DOMINANT_SCRIPT_SHARE else evidence * script_share
+
+
+def _classify_latin(text: str, latin_share: float) -> LanguageDetection:
+    """English if English function words make up a clear share of the words; anything else stays undecided."""
+    lowered_text = text.lower()
+    undecided = LanguageDetection(language=None, confidence=0.3, script="latin")
+    # Accented letters point at another Latin-script language; let the prompt decide
+    if any(character.isalpha() and ord(character) > 0x7F and ord(character) < 0x250 for character in lowered_text):
+        return undecided
+
+    words = _LATIN_WORD_PATTERN.findall(lowered_text)
+    if any(word in _NON_ENGLISH_MARKERS for word in words):
+        return undecided
+    marker_count = sum(1 for word in words if word in _ENGLISH_MARKERS)
+    # A couple of English words in a longer message ("Hola, what time ...") is not enough
+    if marker_count == 0 or marker_count / len(words) < MIN_ENGLISH_MARKER_SHARE:
+        return undecided
+    # One marker word is suggestive, two or more is conclusive
+    evidence = 1.0 if marker_count >= 2 else 0.85
+    return LanguageDetection(language=ENGLISH, confidence=_scale_by_share(evidence, latin_share), script="latin")
+
+
+def _classify_han(text: str, han_share: float) -> LanguageDetection:
+    """Traditional vs Simplified Chinese from the variant-only characters present (Japanese kanji excluded)."""
+    traditional_count = sum(1 for character in text if character in _TRADITIONAL_ONLY)
+    simplified_count = sum(1 for character in text if character in _SIMPLIFIED_ONLY)
+    # Only shared characters (e.g. "你好", or kana-free Japanese such as "電話番号"): the variant, or even whether it
+    # is Chinese, is unknown
+    if traditional_count + simplified_count == 0:
+        return LanguageDetection(language=None, confidence=0.5, script="han")
+
+    is_traditional = traditional_count >= simplified_count
+    variant_share = max(traditional_count, simplified_count) / (traditional_count + simplified_count)
+    # A single variant character is enough in a pure-Chinese message, but not next to words in another script
+    if traditional_count + simplified_count == 1 and han_share < 1.0:
+        variant_share *= 0.85
+    return LanguageDetection(
+        language=TRADITIONAL_CHINESE if is_traditional else SIMPLIFIED_CHINESE,
+        confidence=_scale_by_share(variant_share, han_share),
+        script="han",
+    )
+
+
+def detect_language(text: str) -> LanguageDetection:
+    """
+    Classifies a message by its writing system.
+
+    Returns:
+        A `LanguageDetection`; `language` is None when the script alone does not identify the language.
+    """
+    # Count letters per script in a single pass
+    latin_count = han_count = kana_count = hangul_count = thai_count = other_count = 0
+    for character in text:
+        code_point = ord(character)
+        if code_point < 0x250:
+            if character.isalpha():
+                latin_count += 1
+        elif 0x3040 <= code_point <= 0x30FF:
+            kana_count += 1
+        elif 0x3400 <= code_point <= 0x9FFF or 0xF900 <= code_point <= 0xFAFF:
+            han_count += 1
+        elif 0xAC00 <= code_point <= 0xD7AF or 0x1100 <= code_point <= 0x11FF:
+            hangul_count += 1
+        elif 0x0E00 <= code_point <= 0x0E7F:
+            thai_count += 1
+        elif character.isalpha():
+            other_count += 1
+
+    # Latin letters are counted per word so they weigh the same as CJK characters
+    latin_word_count = len(_LATIN_WORD_PATTERN.findall(text.lower())) if latin_count else 0
+    unit_count = latin_word_count + han_count + kana_count + hangul_count + thai_count + other_count
+    # Guard clause: nothing to go on (empty message, emoji, numbers only)
+    if unit_count == 0:
+        return LanguageDetection(language=None, confidence=0.0, script="none")
+
+    # Japanese mixes kana with Han ideographs, so any meaningful share of kana decides it
+    if kana_count and kana_count >= 0.1 * (kana_count + han_count):
+        japanese_share = (kana_count + han_count) / unit_count
+        return LanguageDetection(language=JAPANESE, confidence=_scale_by_share(1.0, japanese_share), script="kana")
+    if hangul_count:
+        return LanguageDetection(
+            language=KOREAN, confidence=_scale_by_share(1.0, hangul_count / unit_count), script="hangul"
+        )
+    if thai_count:
+        return LanguageDetection(language=THAI, confidence=_scale_by_share(1.0, thai_count / unit_count), script="thai")
+    if han_count and han_count >= latin_word_count:
+        return _classify_han(text, han_count / unit_count)
+    if latin_word_count > other_count:
+        return _classify_latin(text, latin_word_count / unit_count)
+    return LanguageDetection(language=None, confidence=0.0, script="other")
+
+
+def detect_conversation_language(conversation: str, customer_term: str = "guest") -> LanguageDetection:
+    """Detects the language of the customer's most recent message in a conversation transcript."""
+    return detect_language(extract_last_customer_message(conversation, customer_term))
+
+
+def meets_fast_path_threshold(detection: LanguageDetection) -> bool:
+    """True if a detection is confident enough to skip the language-selection prompt."""
+    return detection.language is not None and detection.confidence >= _get_min_confidence()
+
+
+def select_language_locally(conversation: str, customer_term: str = "guest") -> Optional[Dict[str, Any]]:
+    """
+    Fast path for the language-selection stage.
+
+    Returns:
+        A response shaped like the language-selection prompt's ({"reason", "language"}) when the local detector is
+        confident enough, or None when the caller should fall back to the prompt.
+    """
+    if not _is_fast_path_enabled():
+        with _stats_lock:
+            _stats["fallback_disabled"] += 1
+        return None
+
+    detection = detect_conversation_language(conversation, customer_term)
+    if not meets_fast_path_threshold(detection):
+        with _stats_lock:
+            _stats["fallback_low_confidence"] += 1
+        return None
+
+    with _stats_lock:
+        _stats["fast_path"] += 1
+        _fast_path_languages[detection.language] = _fast_path_languages.get(detection.language, 0) + 1
+    return {
+        "reason": (
+            f"Detected locally from the {detection.script} script of the {customer_term}'s most recent message "
+            f"(confidence {detection.confidence:.2f})."
+        ),
+        "language": detection.language,
+    }
+
+
+def get_language_fast_path_stats() -> Dict[str, Any]:
+    """Returns a snapshot of the fast-path counters, the fast-path rate and the per-language fast-path counts."""
+    with _stats_lock:
+        snapshot: Dict[str, Any] = dict(_stats)
+        snapshot["fast_path_languages"] = dict(_fast_path_languages)
+    total_selections = snapshot["fast_path"] + snapshot["fallback_low_confidence"] + snapshot["fallback_disabled"]
+    snapshot["fast_path_rate"] = snapshot["fast_path"] / total_selections if total_selections else 0.0
+    return snapshot
+
+
+def reset_language_fast_path_stats() -> None:
+    """Zeroes the fast-path counters."""
+    with _stats_lock:
+        for counter_name in _stats:
+            _stats[counter_name] = 0
+        _fast_path_languages.clear()
@@ -0,0 +1,130 @@
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Mapping, Optional, Sequence
+
+# <ai_context>
+# Deferred Braintrust setup for the suggested-response worker, so importing the pipeline does not pay for the SDK.
+# `ensure_env()` loads .env once (API keys for Braintrust and the tools), whether or not logging is enabled.
+# `ensure_logger(project)` calls it and then `init_logger` once per project, on first use (thread-safe); hot paths call
+# it, so the first suggestion pays the setup and later ones only a dict lookup. The traced helpers use `sampled_traced`
+# (span_export.py), which likewise imports the SDK only when the first sampled span starts.
+# `warm_up(...)` is an optional hook for serverless/autoscaled workers: it runs the deferred setup, logs in (opening
+# the HTTP connection to Braintrust), resolves the prompt versions when the invoke cache needs them and builds the local
+# indexes before the first request, returning the time each step took.
+# Offline runs (benchmarks, stub or cassette backends) call `disable_logging()` or set BRAINTRUST_LOGGING=0: no logger is
+# created, so every span is a no-op, and `warm_up` skips the logger and login steps; nothing reaches the network.
+# </ai_context>
+
+LOGGING_ENV_VAR = "BRAINTRUST_LOGGING"
+
+# project name -> Braintrust logger, created by `ensure_logger`
+_loggers: Dict[str, Any] = {}
+_logger_lock = threading.Lock()
+# Set by `disable_logging()`; takes precedence over BRAINTRUST_LOGGING
+_logging_disabled = False
+# Set once `ensure_env` has loaded .env
+_env_loaded = False
+_env_lock = threading.Lock()
+
+
+def ensure_env() -> None:
+    """Loads .env into the environment on the first call; later calls are a flag check."""
+    global _env_loaded
+    if _env_loaded:
+        return
+    with _env_lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+
+            load_dotenv()
+            _env_loaded = True
+
+
+def disable_logging() -> None:
+    """Turns Braintrust logging off for this process (offline runs): no logger, no login, spans become no-ops."""
+    global _logging_disabled
+    _logging_disabled = True
+
+
+def is_logging_enabled() -> bool:
+    """False after `disable_logging()` or with BRAINTRUST_LOGGING=0."""
+    if _logging_disabled:
+        return False
+    return os.environ.get(LOGGING_ENV_VAR, "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def ensure_logger(project_name: str) -> Optional[Any]:
+    """
+    Returns the project's Braintrust logger, loading .env and initializing it on the first call.
+
+    Returns:
+        The logger returned by `braintrust.init_logger`, or None when logging is disabled (.env is still loaded, since
+        the prompt and tool calls need its API keys either way).
+    """
+    logger = _loggers.get(project_name)
+    if logger is not None:
+        return logger
+    # Before the logging check: .env may also set BRAINTRUST_LOGGING
+    ensure_env()
+    if not is_logging_enabled():
+        return None
+    with _logger_lock:
+        if project_name not in _loggers:
+            from braintrust import init_logger
+
+            _loggers[project_name] = init_logger(project=project_name)
+    return _loggers[project_name]
+
+
+def warm_up(
+    project_name: str,
+    prompt_slugs: Sequence[str] = (),
+    local_setup: Optional[Mapping[str, Callable[[], Any]]] = None,
+) -> Dict[str, float]:
+    """
+    Does the first-request setup ahead of time; safe to call more than once. A failing step is reported on stderr and
+    skipped.
+
+    Args:
+        project_name: Braintrust project the worker logs to and whose prompts it calls.
+        prompt_slugs: Prompts whose current version is resolved now, when the invoke cache is enabled (it keys entries on
+            the version).
+        local_setup: Step name -> extra callable to run (e.g. building the quick-reply index).
+
+    Returns:
+        Step name -> seconds it took.
+    """
+    step_seconds: Dict[str, float] = {}
+
+    def timed_step(step_name: str, step: Callable[[], Any]) -> None:
+        started_at = time.perf_counter()
+        try:
+            step()
+        except Exception as error:
+            # Warm-up is best effort: the first request redoes whatever failed here
+            print(f"Warm-up step '{step_name}' failed: {error}", file=sys.stderr)
+        step_seconds[step_name] = time.perf_counter() - started_at
+
+    def login() -> None:
+        # Fetches the org info, which also opens the pooled HTTPS connection later calls reuse
+        from braintrust import login as braintrust_login
+
+        braintrust_login()
+
+    timed_step("env", ensure_env)
+    # Offline runs have nothing to log in to
+    if is_logging_enabled():
+        timed_step("logger", lambda: ensure_logger(project_name))
+        timed_step("login", login)
+
+    from invoke_cache import _resolve_prompt_version, is_cache_enabled
+
+    if is_cache_enabled():
+        for slug in prompt_slugs:
+            timed_step(f"prompt:{slug}", lambda slug=slug: _resolve_prompt_version(project_name, slug, None))
+
+    for step_name, setup in (local_setup or {}).items():
+        timed_step(step_name, setup)
+    return step_seconds
@@ -0,0 +1,183 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Literal, Optional
+
+# <ai_context>
+# Shared concurrency helpers for the prompt pipelines.
+# Provides the execution-mode switch ("concurrent" vs "serial") used by `generate_suggested_response`
+# and a lazily created, process-wide thread pool for fanning out independent `braintrust.invoke` calls.
+# `submit_in_context` copies the caller's contextvars into the worker thread so Braintrust spans created
+# in the worker stay nested under the span that was active when the work was submitted.
+# Async helpers: `run_blocking` awaits a blocking local call (helper lookups, disk cache) on a dedicated, bounded pool
+# without blocking the event loop (prompt calls use `braintrust.invoke_async` instead), and `get_pipeline_semaphore`
+# caps in-flight pipelines per loop.
+# The SDK runs its async calls on the loop's default executor (min(32, cpus + 4) threads). `configure_loop()` is the
+# explicit, one-time opt-in that sizes it (ASYNC_PIPELINE_MAX_SDK_CALLS); the app owning the loop calls it at startup
+# (suggestion_server.py's lifespan, the `asyncio.run` entry points), since it affects every user of that loop.
+# `shutdown_executors()` stops both pools (long-running servers call it on shutdown); they are recreated on next use.
+# </ai_context>
+
+# The two supported execution modes for pipelines with independent stages
+ExecutionMode = Literal["concurrent", "serial"]
+
+# Environment variable that forces an execution mode for every pipeline call (e.g. "serial" to restore the old behaviour)
+EXECUTION_MODE_ENV_VAR = "SUGGESTED_RESPONSE_EXECUTION_MODE"
+# Environment variable that sizes the shared worker pool
+MAX_WORKERS_ENV_VAR = "PIPELINE_MAX_WORKERS"
+
+# Environment variables bounding the async pipelines: in-flight pipelines per event loop, and threads for blocking SDK calls
+ASYNC_MAX_CONCURRENCY_ENV_VAR = "ASYNC_PIPELINE_MAX_CONCURRENCY"
+ASYNC_MAX_BLOCKING_CALLS_ENV_VAR = "ASYNC_PIPELINE_MAX_BLOCKING_CALLS"
+# Threads for the SDK's own async calls (`invoke_async`, `async for` over a stream) per event loop
+ASYNC_MAX_SDK_CALLS_ENV_VAR = "ASYNC_PIPELINE_MAX_SDK_CALLS"
+
+DEFAULT_EXECUTION_MODE: ExecutionMode = "concurrent"
+DEFAULT_MAX_WORKERS = 32
+DEFAULT_ASYNC_MAX_CONCURRENCY = 256
+DEFAULT_ASYNC_MAX_BLOCKING_CALLS = 64
+DEFAULT_ASYNC_MAX_SDK_CALLS = 64
+
+# Shared pool, created on first use so importing this module stays cheap
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# Separate pool for blocking calls made on behalf of async pipelines, so they never starve the sync fan-out pool
+_blocking_executor: Optional[ThreadPoolExecutor] = None
+# One semaphore per running event loop (asyncio primitives cannot be shared across loops)
+_pipeline_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+# Loops whose default executor `configure_loop` already set
+_configured_loops: "weakref.WeakSet[asyncio.AbstractEventLoop]" = weakref.WeakSet()
+
+
+def resolve_execution_mode(execution_mode: Optional[str] = None) -> ExecutionMode:
+    """
+    Resolves which execution mode a pipeline call should use.
+
+    Precedence: explicit argument, then the environment variable, then the default ("concurrent").
+
+    Args:
+        execution_mode: Optional explicit mode passed by the caller.
+
+    Returns:
+        Either "concurrent" or "serial".
+    """
+    resolved_mode = (execution_mode or os.environ.get(EXECUTION_MODE_ENV_VAR) or DEFAULT_EXECUTION_MODE).strip().lower()
+    # Guard clause: fail loudly on typos instead of silently picking a mode
+    if resolved_mode not in ("concurrent", "serial"):
+        raise ValueError(f"Unknown execution mode '{resolved_mode}'. Expected 'concurrent' or 'serial'.")
+    return resolved_mode  # type: ignore[return-value]
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the shared thread pool used to run independent pipeline stages.
+
+    The pool is created lazily (double-checked under a lock) and sized from `PIPELINE_MAX_WORKERS`.
+    """
+    global _executor
+    if _executor is not None:
+        return _executor
+    with _executor_lock:
+        if _executor is None:
+            max_workers = int(os.environ.get(MAX_WORKERS_ENV_VAR, DEFAULT_MAX_WORKERS))
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline-stage")
+    return _executor
+
+
+def submit_in_context(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    """
+    Submits `fn(*args, **kwargs)` to the shared pool, running it inside a copy of the caller's context.
+
+    Braintrust tracks the active span in contextvars, which new threads do not inherit.
+    Copying the context at submit time keeps every span created by `fn` nested under the caller's span.
+    A fresh copy is taken per submission because a Context cannot be entered by two threads at once.
+
+    Returns:
+        A Future resolving to the function's return value (or raising its exception).
+    """
+    caller_context = contextvars.copy_context()
+    return get_executor().submit(caller_context.run, fn, *args, **kwargs)
+
+
+def get_blocking_executor() -> ThreadPoolExecutor:
+    """
+    Returns the bounded pool that async pipelines use for blocking local calls (helper lookups, disk cache I/O).
+
+    Sized from `ASYNC_PIPELINE_MAX_BLOCKING_CALLS`; extra calls queue on the pool instead of spawning threads.
+    """
+    global _blocking_executor
+    if _blocking_executor is not None:
+        return _blocking_executor
+    with _executor_lock:
+        if _blocking_executor is None:
+            max_workers = int(os.environ.get(ASYNC_MAX_BLOCKING_CALLS_ENV_VAR, DEFAULT_ASYNC_MAX_BLOCKING_CALLS))
+            _blocking_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline-blocking")
+    return _blocking_executor
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    """
+    Shuts down the stage pool and the blocking pool, waiting for running calls to finish unless `wait` is False.
+    A later `get_executor()` / `get_blocking_executor()` creates fresh pools.
+    """
+    global _executor, _blocking_executor
+    with _executor_lock:
+        executors = [executor for executor in (_executor, _blocking_executor) if executor is not None]
+        _executor = None
+        _blocking_executor = None
+    for executor in executors:
+        executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+def configure_loop(loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+    """
+    Sizes the loop's default executor, where the SDK's `invoke_async` and async stream reads run, to
+    `ASYNC_PIPELINE_MAX_SDK_CALLS` threads. Later calls for the same loop do nothing.
+
+    This changes the executor for every `asyncio.to_thread` / `run_in_executor(None, ...)` user of the loop, so only the
+    code that owns the loop calls it, at startup and before anything has run on the default executor (the loop shuts
+    the new executor down when it closes).
+
+    Args:
+        loop: The loop to configure; defaults to the running loop.
+    """
+    loop = loop or asyncio.get_running_loop()
+    if loop in _configured_loops:
+        return
+    max_sdk_calls = int(os.environ.get(ASYNC_MAX_SDK_CALLS_ENV_VAR, DEFAULT_ASYNC_MAX_SDK_CALLS))
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=max_sdk_calls, thread_name_prefix="pipeline-sdk"))
+    _configured_loops.add(loop)
+
+
+def get_pipeline_semaphore() -> asyncio.Semaphore:
+    """
+    Returns the semaphore bounding in-flight async pipelines on the running event loop.
+
+    Pipelines beyond the limit wait as suspended coroutines (no thread held) until a slot frees up.
+    The limit comes from `ASYNC_PIPELINE_MAX_CONCURRENCY`.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = _pipeline_semaphores.get(loop)
+    if semaphore is None:
+        # No lock needed: this runs on the loop's thread, so there is no interleaving between get and set
+        semaphore = asyncio.Semaphore(int(os.environ.get(ASYNC_MAX_CONCURRENCY_ENV_VAR, DEFAULT_ASYNC_MAX_CONCURRENCY)))
+        _pipeline_semaphores[loop] = semaphore
+    return semaphore
+
+
+async def run_blocking(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Awaits a blocking call on the bounded blocking pool without blocking the event loop.
+
+    Like `submit_in_context`, the call runs inside a copy of the caller's context so span nesting is preserved.
+    """
+    loop = asyncio.get_running_loop()
+    caller_context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_blocking_executor(), functools.partial(caller_context.run, fn, *args, **kwargs)
+    )
@@ -0,0 +1,303 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import runpy
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Literal, Optional
+
+import braintrust
+from braintrust.functions.stream import BraintrustStream
+
+from invoke_cache import canonicalize_input, deserialize_chunk, make_cache_key, serialize_chunk
+
+# <ai_context>
+# Record/replay stand-in for Braintrust prompts, so pipelines can be benchmarked and load-tested offline.
+# `use_cassette(path, mode="record")` swaps `braintrust.invoke` for a wrapper that calls the real prompt and captures the
+# response (including each streamed chunk and its time offset) into a JSON cassette file.
+# `use_cassette(path, mode="replay")` serves those recordings back with no network, sleeping to reproduce the recorded
+# latency (scaled by `latency_scale`) or a fixed synthetic latency (`fixed_latency_s` / `chunk_interval_s`).
+# Because it patches `braintrust.invoke` itself, it sits below `cached_invoke` and works for every chain in the repo.
+# `braintrust.invoke_async` is patched too (`make_async_invoke`), so async pipelines (`acached_invoke`) are served alike.
+# Processes recording in parallel (batch_suggestions.py's process pool) each write their own part file
+# (`worker_cassette_path`), which `merge_worker_cassettes` folds back into the cassette, so no recording is lost to a
+# concurrent overwrite.
+# Can also be driven from the environment (`install_from_env`) or as a runner:
+#   python prompt_cassette.py --mode replay --cassette cassettes/suggested.json suggested_response.py
+# </ai_context>
+
+CassetteMode = Literal["record", "replay"]
+# "input" replays the recording for the exact same input; "slug" serves any recording of the slug (for load tests
+# where inputs vary but the prompt responses do not matter)
+MatchOn = Literal["input", "slug"]
+
+CASSETTE_PATH_ENV_VAR = "PROMPT_CASSETTE"
+CASSETTE_MODE_ENV_VAR = "PROMPT_CASSETTE_MODE"
+CASSETTE_LATENCY_SCALE_ENV_VAR = "PROMPT_CASSETTE_LATENCY_SCALE"
+CASSETTE_MATCH_ON_ENV_VAR = "PROMPT_CASSETTE_MATCH_ON"
+
+CASSETTE_FORMAT_VERSION = 1
+# Suffix of the per-process part files, formatted with the process id
+WORKER_CASSETTE_SUFFIX = ".worker-{pid}"
+
+
+class CassetteMissError(KeyError):
+    """Raised in replay mode when the cassette has no recording for a call."""
+
+
+def _interaction_key(project_name: Optional[str], slug: Optional[str], input: Any, stream: bool) -> str:
+    """Content address of a call; the prompt version is pinned to "cassette" since replays are version-agnostic."""
+    return make_cache_key(project_name or "", slug or "", "cassette", input, stream)
+
+
+def load_cassette(path: str) -> List[Dict[str, Any]]:
+    """Reads the interactions stored in a cassette file (empty list if the file does not exist yet)."""
+    cassette_path = Path(path)
+    if not cassette_path.exists():
+        return []
+    cassette = json.loads(cassette_path.read_text(encoding="utf-8"))
+    return cassette["interactions"]
+
+
+def save_cassette(path: str, interactions: List[Dict[str, Any]]) -> None:
+    """Writes interactions to a cassette file atomically."""
+    cassette_path = Path(path)
+    cassette_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = cassette_path.with_suffix(cassette_path.suffix + ".tmp")
+    temp_path.write_text(
+        json.dumps({"version": CASSETTE_FORMAT_VERSION, "interactions": interactions}, ensure_ascii=False, indent=2),
+        encoding="utf-8",
+    )
+    os.replace(temp_path, cassette_path)
+
+
+def worker_cassette_path(path: str, pid: int) -> str:
+    """Part file a recording worker process writes instead of the shared cassette."""
+    return path + WORKER_CASSETTE_SUFFIX.format(pid=pid)
+
+
+def merge_worker_cassettes(path: str) -> int:
+    """
+    Appends the interactions of every worker part file of `path` to the cassette and deletes the parts.
+
+    Returns:
+        The number of interactions merged in.
+    """
+    cassette_path = Path(path)
+    part_prefix = cassette_path.name + WORKER_CASSETTE_SUFFIX.format(pid="")
+    # Parts only, not a temporary file left behind by a worker that died while saving
+    part_paths = sorted(
+        part_path
+        for part_path in cassette_path.parent.glob(part_prefix + "*")
+        if part_path.name[len(part_prefix):].isdigit()
+    )
+    if not part_paths:
+        return 0
+    interactions = load_cassette(path)
+    merged_count = 0
+    for part_path in part_paths:
+        part_interactions = load_cassette(str(part_path))
+        interactions.extend(part_interactions)
+        merged_count += len(part_interactions)
+    save_cassette(path, interactions)
+    # Only removed once the merged cassette is safely written
+    for part_path in part_paths:
+        part_path.unlink()
+    return merged_count
+
+
+def make_async_invoke(invoke: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    """
+    Builds a `braintrust.invoke_async` stand-in from an invoke stand-in, running it on a worker thread the way the SDK's
+    own `invoke_async` runs `invoke`.
+    """
+
+    async def async_invoke(**invoke_kwargs: Any) -> Any:
+        return await asyncio.to_thread(invoke, **invoke_kwargs)
+
+    return async_invoke
+
+
+def _make_recording_invoke(real_invoke: Any, interactions: List[Dict[str, Any]], lock: threading.Lock):
+    """Builds an invoke wrapper that calls the real prompt and appends the response (with timings) to `interactions`."""
+
+    def recording_invoke(project_name=None, slug=None, input=None, stream=False, **invoke_kwargs):
+        started_at = time.perf_counter()
+        response = real_invoke(project_name=project_name, slug=slug, input=input, stream=stream, **invoke_kwargs)
+        interaction = {
+            "key": _interaction_key(project_name, slug, input, stream),
+            "project_name": project_name,
+            "slug": slug,
+            # Keep the canonical input so cassettes are human-readable and diffable
+            "input": json.loads(canonicalize_input(input)),
+            "stream": stream,
+        }
+
+        # Guard clause: non-streamed responses are complete once invoke returns
+        if not stream:
+            interaction["latency_s"] = time.perf_counter() - started_at
+            interaction["value"] = response
+            with lock:
+                interactions.append(interaction)
+            return response
+
+        def record_chunks() -> Iterator[Any]:
+            recorded_chunks = []
+            for chunk in response:
+                # Offset of each chunk from the start of the call, so replay reproduces TTFT and inter-chunk gaps
+                recorded_chunks.append({"offset_s": time.perf_counter() - started_at, "chunk": serialize_chunk(chunk)})
+                yield chunk
+            interaction["latency_s"] = time.perf_counter() - started_at
+            interaction["chunks"] = recorded_chunks
+            with lock:
+                interactions.append(interaction)
+
+        return BraintrustStream(record_chunks())
+
+    return recording_invoke
+
+
+def _make_replaying_invoke(
+    interactions: List[Dict[str, Any]],
+    latency_scale: float,
+    fixed_latency_s: Optional[float],
+    chunk_interval_s: Optional[float],
+    match_on: MatchOn,
+):
+    """Builds an invoke stand-in that serves recorded interactions with synthetic latency."""
+    # Index recordings; repeated recordings of the same call are served round-robin
+    recordings_by_key: Dict[str, List[Dict[str, Any]]] = {}
+    for interaction in interactions:
+        lookup_key = interaction["key"] if match_on == "input" else f"{interaction['slug']}:{interaction['stream']}"
+        recordings_by_key.setdefault(lookup_key, []).append(interaction)
+    replay_counts: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def pick_recording(project_name, slug, input, stream) -> Dict[str, Any]:
+        lookup_key = _interaction_key(project_name, slug, input, stream) if match_on == "input" else f"{slug}:{stream}"
+        recordings = recordings_by_key.get(lookup_key)
+        if not recordings:
+            raise CassetteMissError(f"No recording for slug '{slug}' (stream={stream}) in cassette")
+        with lock:
+            replay_index = replay_counts.get(lookup_key, 0)
+            replay_counts[lookup_key] = replay_index + 1
+        return recordings[replay_index % len(recordings)]
+
+    def replaying_invoke(project_name=None, slug=None, input=None, stream=False, **invoke_kwargs):
+        recording = pick_recording(project_name, slug, input, stream)
+
+        if not stream:
+            time.sleep(fixed_latency_s if fixed_latency_s is not None else recording["latency_s"] * latency_scale)
+            return recording["value"]
+
+        def replay_chunks() -> Iterator[Any]:
+            previous_offset_s = 0.0
+            for chunk_index, recorded_chunk in enumerate(recording["chunks"]):
+                # Delay before this chunk: fixed overrides win, otherwise the recorded gap scaled
+                if chunk_index == 0 and fixed_latency_s is not None:
+                    delay_s = fixed_latency_s
+                elif chunk_index > 0 and chunk_interval_s is not None:
+                    delay_s = chunk_interval_s
+                else:
+                    delay_s = (recorded_chunk["offset_s"] - previous_offset_s) * latency_scale
+                previous_offset_s = recorded_chunk["offset_s"]
+                if delay_s > 0:
+                    time.sleep(delay_s)
+                yield deserialize_chunk(recorded_chunk["chunk"])
+
+        return BraintrustStream(replay_chunks())
+
+    return replaying_invoke
+
+
+@contextlib.contextmanager
+def use_cassette(
+    path: str,
+    mode: CassetteMode = "replay",
+    latency_scale: float = 1.0,
+    fixed_latency_s: Optional[float] = None,
+    chunk_interval_s: Optional[float] = None,
+    match_on: MatchOn = "input",
+):
+    """
+    Context manager that records or replays every `braintrust.invoke` / `braintrust.invoke_async` call made inside it.
+
+    Args:
+        path: Cassette file to write (record) or read (replay).
+        mode: "record" captures real responses; "replay" serves them back offline.
+        latency_scale: Replay only. Multiplier on recorded timings (0 replays instantly).
+        fixed_latency_s: Replay only. Overrides the latency of non-streamed calls and the time to first chunk.
+        chunk_interval_s: Replay only. Overrides the gap between streamed chunks.
+        match_on: Replay only. "input" for exact matches, "slug" to serve any recording of the slug.
+    """
+    real_invoke = braintrust.invoke
+    real_invoke_async = braintrust.invoke_async
+    if mode == "record":
+        # Append to an existing cassette so recordings can be built up across runs
+        interactions = load_cassette(path)
+        braintrust.invoke = _make_recording_invoke(real_invoke, interactions, threading.Lock())
+    elif mode == "replay":
+        interactions = load_cassette(path)
+        if not interactions:
+            raise FileNotFoundError(f"Cassette '{path}' is missing or empty; record it first")
+        braintrust.invoke = _make_replaying_invoke(interactions, latency_scale, fixed_latency_s, chunk_interval_s, match_on)
+    else:
+        raise ValueError(f"Unknown cassette mode '{mode}'. Expected 'record' or 'replay'.")
+    braintrust.invoke_async = make_async_invoke(braintrust.invoke)
+
+    try:
+        yield
+    finally:
+        braintrust.invoke = real_invoke
+        braintrust.invoke_async = real_invoke_async
+        if mode == "record":
+            save_cassette(path, interactions)
+
+
+def install_from_env() -> Optional[contextlib.AbstractContextManager]:
+    """
+    Enters a cassette configured through PROMPT_CASSETTE / PROMPT_CASSETTE_MODE, if set.
+
+    Returns:
+        The entered context manager (call `.__exit__(None, None, None)` to restore and save), or None if not configured.
+    """
+    cassette_path = os.environ.get(CASSETTE_PATH_ENV_VAR)
+    if not cassette_path:
+        return None
+    cassette = use_cassette(
+        cassette_path,
+        mode=os.environ.get(CASSETTE_MODE_ENV_VAR, "replay"),  # type: ignore[arg-type]
+        latency_scale=float(os.environ.get(CASSETTE_LATENCY_SCALE_ENV_VAR, 1.0)),
+        match_on=os.environ.get(CASSETTE_MATCH_ON_ENV_VAR, "input"),  # type: ignore[arg-type]
+    )
+    cassette.__enter__()
+    return cassette
+
+
+# Runner: record or replay a script's prompt calls without editing it
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a script with braintrust.invoke recorded to / replayed from a cassette.")
+    parser.add_argument("script", help="Python script to run (e.g. suggested_response.py)")
+    parser.add_argument("--cassette", required=True, help="Cassette JSON file")
+    parser.add_argument("--mode", choices=["record", "replay"], default="replay")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Replay: multiplier on recorded timings")
+    parser.add_argument("--fixed-latency", type=float, default=None, help="Replay: seconds per call / to first chunk")
+    parser.add_argument("--chunk-interval", type=float, default=None, help="Replay: seconds between streamed chunks")
+    parser.add_argument("--match-on", choices=["input", "slug"], default="input")
+    args = parser.parse_args()
+
+    with use_cassette(
+        args.cassette,
+        mode=args.mode,
+        latency_scale=args.latency_scale,
+        fixed_latency_s=args.fixed_latency,
+        chunk_interval_s=args.chunk_interval,
+        match_on=args.match_on,
+    ):
+        # Run the target as __main__ so its example block executes, with the script's directory on sys.path
+        sys.path.insert(0, str(Path(args.script).resolve().parent))
+        runpy.run_path(args.script, run_name="__main__")
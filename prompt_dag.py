@@ -0,0 +1,333 @@
+import asyncio
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass, replace
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, List, Mapping, Optional, Sequence, Tuple
+
+from invoke_cache import acached_invoke, cached_invoke
+from pipeline_concurrency import resolve_execution_mode, run_blocking, submit_in_context
+
+# <ai_context>
+# Small declarative executor for prompt chains.
+# A chain is a list of `Stage`s, each naming the values it reads (`inputs`) and the values it produces (`outputs`);
+# values are either run inputs or outputs of other stages, so data dependencies are explicit instead of implied by
+# statement order. `build_dag` validates the stages (unique names/outputs, no cycles, streams only at the sinks) once,
+# at import time of the chain's module.
+# `run_dag` starts every stage as soon as its inputs exist, on the shared pool from pipeline_concurrency.py (so spans stay
+# nested), optionally capped by `max_parallelism`; `execution_mode="serial"` runs the stages one by one in declaration
+# order. `arun_dag` is the async counterpart: stages with an async variant (`afn`, e.g. prompt calls through
+# `braintrust.invoke_async`) are awaited on the event loop, the remaining local stages run on the bounded blocking pool.
+# A stage with `streams=True` returns its stream unconsumed so the caller streams the final stage. Per-stage start
+# offsets and durations are returned in `DagResult.timings` and logged as metadata on the current Braintrust span.
+# `prompt_stage` builds a stage that calls a Braintrust prompt through `cached_invoke` (`acached_invoke` under `arun_dag`).
+# </ai_context>
+
+
+@dataclass(frozen=True)
+class Stage:
+    """One node of a chain: `fn(**inputs)` produces the values named in `outputs`."""
+
+    name: str
+    fn: Callable[..., Any]
+    inputs: Tuple[str, ...] = ()
+    # One name: the return value is stored under it. Several names: `fn` returns a tuple in the same order.
+    outputs: Tuple[str, ...] = ()
+    # The stage returns a stream (e.g. `invoke(..., stream=True)`), handed back to the caller unconsumed
+    streams: bool = False
+    # Cheap local stages (e.g. cached lookups) run on the scheduling thread instead of taking a pool hop
+    inline: bool = False
+    # Async variant of `fn` (same inputs and outputs), awaited by `arun_dag` instead of running `fn` on a pool thread
+    afn: Optional[Callable[..., Awaitable[Any]]] = None
+
+
+@dataclass(frozen=True)
+class PromptDag:
+    """A validated chain: stages in a dependency-respecting order plus what each stage waits for."""
+
+    stages: Tuple[Stage, ...]
+    # Values that must be passed to `run_dag` (read by some stage, produced by none)
+    required_inputs: FrozenSet[str]
+    # stage name -> names of the stages producing its inputs
+    dependencies: Mapping[str, FrozenSet[str]]
+
+
+@dataclass(frozen=True)
+class StageTiming:
+    """When a stage started (seconds from the start of the run) and how long it took."""
+
+    stage: str
+    started_at_s: float
+    duration_s: float
+
+
+@dataclass(frozen=True)
+class DagResult:
+    """Every value known at the end of the run (inputs and stage outputs) and the per-stage timings."""
+
+    values: Dict[str, Any]
+    timings: Tuple[StageTiming, ...]
+
+
+def prompt_stage(
+    name: str,
+    project_name: str,
+    slug: str,
+    inputs: Sequence[str],
+    output: Optional[str] = None,
+    build_input: Optional[Callable[..., Dict[str, Any]]] = None,
+    stream: bool = False,
+) -> Stage:
+    """
+    Builds a stage that invokes a Braintrust prompt.
+
+    Args:
+        name: Stage name (also the output name unless `output` is given).
+        project_name: Braintrust project holding the prompt.
+        slug: Prompt slug.
+        inputs: Values the stage reads.
+        output: Name of the value the prompt response is stored under.
+        build_input: Maps the input values to the prompt input. Defaults to passing them through under the same names.
+        stream: Invoke with streaming; the stream is returned unconsumed.
+    """
+
+    def invoke_prompt(**values: Any) -> Any:
+        prompt_input = build_input(**values) if build_input else values
+        return cached_invoke(project_name=project_name, slug=slug, input=prompt_input, stream=stream)
+
+    async def ainvoke_prompt(**values: Any) -> Any:
+        prompt_input = build_input(**values) if build_input else values
+        return await acached_invoke(project_name=project_name, slug=slug, input=prompt_input, stream=stream)
+
+    return Stage(
+        name=name, fn=invoke_prompt, inputs=tuple(inputs), outputs=(output or name,), streams=stream, afn=ainvoke_prompt
+    )
+
+
+def build_dag(stages: Sequence[Stage]) -> PromptDag:
+    """
+    Validates a chain and orders its stages.
+
+    Raises:
+        ValueError: On duplicate stage names or outputs, a dependency cycle, or a streamed output read by another stage.
+    """
+    # Default each stage's output to its own name
+    stages = [stage if stage.outputs else replace(stage, outputs=(stage.name,)) for stage in stages]
+
+    producer_by_value: Dict[str, str] = {}
+    stage_names = set()
+    for stage in stages:
+        if stage.name in stage_names:
+            raise ValueError(f"Duplicate stage name '{stage.name}'")
+        stage_names.add(stage.name)
+        for value_name in stage.outputs:
+            if value_name in producer_by_value:
+                raise ValueError(f"Value '{value_name}' is produced by both '{producer_by_value[value_name]}' and '{stage.name}'")
+            producer_by_value[value_name] = stage.name
+
+    streaming_stage_names = {stage.name for stage in stages if stage.streams}
+    dependencies: Dict[str, FrozenSet[str]] = {}
+    required_inputs = set()
+    for stage in stages:
+        upstream_names = set()
+        for value_name in stage.inputs:
+            producer_name = producer_by_value.get(value_name)
+            if producer_name is None:
+                required_inputs.add(value_name)
+                continue
+            # A stream can only be consumed once, so it must go straight back to the caller
+            if producer_name in streaming_stage_names:
+                raise ValueError(f"Stage '{stage.name}' reads '{value_name}', a stream from '{producer_name}'")
+            upstream_names.add(producer_name)
+        dependencies[stage.name] = frozenset(upstream_names)
+
+    # Stable topological sort: always place the earliest declared stage whose inputs are ready, so serial runs follow
+    # the chain as written
+    ordered_stages: List[Stage] = []
+    remaining_stages = list(stages)
+    placed_names = set()
+    while remaining_stages:
+        next_stage = next((stage for stage in remaining_stages if dependencies[stage.name] <= placed_names), None)
+        if next_stage is None:
+            raise ValueError(f"Dependency cycle between stages: {', '.join(stage.name for stage in remaining_stages)}")
+        ordered_stages.append(next_stage)
+        placed_names.add(next_stage.name)
+        remaining_stages.remove(next_stage)
+
+    return PromptDag(stages=tuple(ordered_stages), required_inputs=frozenset(required_inputs), dependencies=dependencies)
+
+
+def _check_inputs(dag: PromptDag, inputs: Mapping[str, Any]) -> None:
+    missing_inputs = dag.required_inputs - inputs.keys()
+    if missing_inputs:
+        raise ValueError(f"Missing chain inputs: {', '.join(sorted(missing_inputs))}")
+
+
+def _execute_stage(stage: Stage, values: Mapping[str, Any], run_started_at: float) -> Tuple[Dict[str, Any], StageTiming]:
+    """Calls a stage with its inputs; returns its outputs by name and its timing."""
+    started_at = time.perf_counter()
+    result = stage.fn(**{value_name: values[value_name] for value_name in stage.inputs})
+    return _stage_outputs(stage, result, started_at, run_started_at)
+
+
+async def _aexecute_stage(
+    stage: Stage, values: Mapping[str, Any], run_started_at: float
+) -> Tuple[Dict[str, Any], StageTiming]:
+    """Awaits a stage's async variant with its inputs; returns its outputs by name and its timing."""
+    started_at = time.perf_counter()
+    result = await stage.afn(**{value_name: values[value_name] for value_name in stage.inputs})
+    return _stage_outputs(stage, result, started_at, run_started_at)
+
+
+def _stage_outputs(
+    stage: Stage, result: Any, started_at: float, run_started_at: float
+) -> Tuple[Dict[str, Any], StageTiming]:
+    """Maps a stage's return value to its output names and times the stage up to now."""
+    finished_at = time.perf_counter()
+    if len(stage.outputs) == 1:
+        outputs = {stage.outputs[0]: result}
+    else:
+        outputs = dict(zip(stage.outputs, result))
+    return outputs, StageTiming(stage=stage.name, started_at_s=started_at - run_started_at, duration_s=finished_at - started_at)
+
+
+def _release_downstream(
+    dag: PromptDag, finished_stage: Stage, waiting_on: Dict[str, set], ready_stages: List[Stage]
+) -> None:
+    """Marks a stage as finished and queues the stages that were only waiting on it."""
+    for downstream_stage in dag.stages:
+        if finished_stage.name in waiting_on[downstream_stage.name]:
+            waiting_on[downstream_stage.name].discard(finished_stage.name)
+            if not waiting_on[downstream_stage.name]:
+                ready_stages.append(downstream_stage)
+
+
+def _finish_run(values: Dict[str, Any], timings: List[StageTiming]) -> DagResult:
+    """Logs the stage timings on the current span (a no-op outside a trace) and packages the result."""
+    # Imported on use so chain modules can be imported without loading the SDK
+    from braintrust import current_span
+
+    current_span().log(
+        metadata={
+            "dag_stage_timings": {
+                timing.stage: {"started_at_s": round(timing.started_at_s, 4), "duration_s": round(timing.duration_s, 4)}
+                for timing in timings
+            }
+        }
+    )
+    return DagResult(values=values, timings=tuple(timings))
+
+
+def run_dag(
+    dag: PromptDag,
+    inputs: Mapping[str, Any],
+    execution_mode: Optional[str] = None,
+    max_parallelism: Optional[int] = None,
+) -> DagResult:
+    """
+    Runs a chain, starting each stage as soon as everything it reads is available.
+
+    Args:
+        dag: Chain from `build_dag`.
+        inputs: Values for `dag.required_inputs` (extra values are passed through to the result).
+        execution_mode: "concurrent" or "serial" (see `resolve_execution_mode`).
+        max_parallelism: Cap on stages running at once for this run. Defaults to the shared pool's size.
+
+    Returns:
+        A `DagResult`. A streamed stage's value is its unconsumed stream, and its timing covers opening the stream.
+    """
+    _check_inputs(dag, inputs)
+    values: Dict[str, Any] = dict(inputs)
+    timings: List[StageTiming] = []
+    run_started_at = time.perf_counter()
+
+    if resolve_execution_mode(execution_mode) == "serial":
+        for stage in dag.stages:
+            outputs, timing = _execute_stage(stage, values, run_started_at)
+            values.update(outputs)
+            timings.append(timing)
+        return _finish_run(values, timings)
+
+    waiting_on = {stage.name: set(dag.dependencies[stage.name]) for stage in dag.stages}
+    ready_stages = [stage for stage in dag.stages if not waiting_on[stage.name]]
+    running: Dict[Future, Stage] = {}
+
+    def complete(stage: Stage, outputs: Dict[str, Any], timing: StageTiming) -> None:
+        values.update(outputs)
+        timings.append(timing)
+        _release_downstream(dag, stage, waiting_on, ready_stages)
+
+    try:
+        while ready_stages or running:
+            # Start everything that is ready, up to the cap; inline stages run right here
+            while ready_stages and (max_parallelism is None or len(running) < max_parallelism):
+                stage = ready_stages.pop(0)
+                if stage.inline:
+                    complete(stage, *_execute_stage(stage, values, run_started_at))
+                    continue
+                # Inputs are snapshotted at submit time; the stage only reads values that already exist
+                running[submit_in_context(_execute_stage, stage, dict(values), run_started_at)] = stage
+
+            if not running:
+                continue
+            done_futures, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done_futures:
+                stage = running.pop(future)
+                # A failing stage fails the run (its exception is re-raised here)
+                complete(stage, *future.result())
+    except BaseException:
+        # Do not start anything else; stages already running finish in the background
+        for future in running:
+            future.cancel()
+        raise
+
+    return _finish_run(values, timings)
+
+
+async def arun_dag(
+    dag: PromptDag,
+    inputs: Mapping[str, Any],
+    max_parallelism: Optional[int] = None,
+) -> DagResult:
+    """
+    Async counterpart of `run_dag`. Stages with an `afn` are awaited on the event loop; the others run on the bounded
+    blocking pool, so the event loop never blocks.
+    """
+    _check_inputs(dag, inputs)
+    values: Dict[str, Any] = dict(inputs)
+    timings: List[StageTiming] = []
+    run_started_at = time.perf_counter()
+
+    waiting_on = {stage.name: set(dag.dependencies[stage.name]) for stage in dag.stages}
+    ready_stages = [stage for stage in dag.stages if not waiting_on[stage.name]]
+    running: Dict[asyncio.Task, Stage] = {}
+
+    def complete(stage: Stage, outputs: Dict[str, Any], timing: StageTiming) -> None:
+        values.update(outputs)
+        timings.append(timing)
+        _release_downstream(dag, stage, waiting_on, ready_stages)
+
+    try:
+        while ready_stages or running:
+            while ready_stages and (max_parallelism is None or len(running) < max_parallelism):
+                stage = ready_stages.pop(0)
+                if stage.inline:
+                    complete(stage, *_execute_stage(stage, values, run_started_at))
+                    continue
+                if stage.afn is not None:
+                    task = asyncio.ensure_future(_aexecute_stage(stage, dict(values), run_started_at))
+                else:
+                    task = asyncio.ensure_future(run_blocking(_execute_stage, stage, dict(values), run_started_at))
+                running[task] = stage
+
+            if not running:
+                continue
+            done_tasks, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done_tasks:
+                stage = running.pop(task)
+                complete(stage, *task.result())
+    except BaseException:
+        for task in running:
+            task.cancel()
+        raise
+
+    return _finish_run(values, timings)
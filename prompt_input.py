@@ -0,0 +1,244 @@
+import functools
+import json
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Sequence, Tuple
+
+# <ai_context>
+# Prompt inputs split into a static part (per unit: brand/unit guidelines, unit info and terms) and per-request fields.
+# `build_prompt_input(slug, unit_values, static_field_names, request_fields)` returns a `PromptInput`, a plain dict (so
+# `braintrust.invoke` and everything else use it unchanged) that also carries the `StaticPromptInput` it was built from.
+# The static part is built once per (slug, static values) and keeps each field's canonical JSON fragment and byte size,
+# so `canonical_json()`, `canonical_size()` and `update_hash()` only encode the per-request fields and merge them with the
+# cached fragments (`update_hash` feeds a digest fragment by fragment, never building the whole text).
+# invoke_cache.py uses them for cache keys, cassette keys and the prompt input byte metric; the result is byte-for-byte
+# what `encode_canonical(dict(prompt_input))` would produce, so existing cache entries stay valid.
+# Entries are keyed on the static values themselves (the unit config store shares the string objects, so the lookup
+# hashes nothing new) and bounded by PROMPT_INPUT_CACHE_MAX_ENTRIES; a config reload simply produces a new entry.
+# The SDK still encodes the full request body itself; only this repo's own serializations are incremental.
+# `python prompt_input.py` compares encode time and allocations per request against encoding the whole input.
+# </ai_context>
+
+CACHE_MAX_ENTRIES_ENV_VAR = "PROMPT_INPUT_CACHE_MAX_ENTRIES"
+DEFAULT_CACHE_MAX_ENTRIES = 256
+
+# Canonical JSON (sorted keys, no whitespace): the form cache keys and size metrics are computed over
+encode_canonical = functools.partial(json.dumps, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+@dataclass(frozen=True)
+class StaticPromptInput:
+    """The static fields of a prompt input, with each field's `"name":value` canonical fragment precomputed."""
+
+    fields: Mapping[str, Any]
+    # field name -> canonical `"name":value` fragment
+    fragments: Mapping[str, str]
+    # field name -> the same fragment, UTF-8 encoded (fed to hashes as is)
+    encoded_fragments: Mapping[str, bytes]
+
+
+class PromptInput(dict):
+    """
+    A prompt input dict that remembers its static part, so its canonical JSON only encodes the per-request fields.
+    Treat it as read-only once built: a static field replaced afterwards is detected and encoded, not served stale.
+    """
+
+    __slots__ = ("static_input",)
+
+    def _fragments(self) -> List[Tuple[str, str]]:
+        """Returns (name, `"name":value` fragment) for every field, cached fragments for unchanged static fields."""
+        static_fields = self.static_input.fields
+        static_fragments = self.static_input.fragments
+        fragments = []
+        for name, value in self.items():
+            if name in static_fragments and static_fields[name] is value:
+                fragments.append((name, static_fragments[name]))
+            else:
+                fragments.append((name, f"{encode_canonical(name)}:{encode_canonical(value)}"))
+        # Same order as json.dumps(sort_keys=True)
+        fragments.sort()
+        return fragments
+
+    def canonical_json(self) -> str:
+        """Returns the canonical JSON of the whole input, encoding only the per-request fields."""
+        return "{" + ",".join(fragment for _, fragment in self._fragments()) + "}"
+
+    def update_hash(self, hasher: Any) -> None:
+        """Feeds the UTF-8 bytes of `canonical_json()` to `hasher` (e.g. `hashlib.sha256()`) without building it."""
+        static_fields = self.static_input.fields
+        encoded_fragments = self.static_input.encoded_fragments
+        hasher.update(b"{")
+        for position, (name, fragment) in enumerate(self._fragments()):
+            if position:
+                hasher.update(b",")
+            if name in encoded_fragments and static_fields[name] is self[name]:
+                hasher.update(encoded_fragments[name])
+            else:
+                hasher.update(fragment.encode("utf-8"))
+        hasher.update(b"}")
+
+    def canonical_size(self) -> int:
+        """Returns the UTF-8 byte size of `canonical_json()` without building it."""
+        static_fields = self.static_input.fields
+        encoded_fragments = self.static_input.encoded_fragments
+        # Braces and commas
+        size = 2 + max(len(self) - 1, 0)
+        for name, value in self.items():
+            if name in encoded_fragments and static_fields[name] is value:
+                size += len(encoded_fragments[name])
+                continue
+            fragment = f"{encode_canonical(name)}:{encode_canonical(value)}"
+            size += len(fragment) if fragment.isascii() else len(fragment.encode("utf-8"))
+        return size
+
+
+# (slug, static field names, static values) -> static part, least recently used first
+_static_inputs: "OrderedDict[tuple, StaticPromptInput]" = OrderedDict()
+_static_inputs_lock = threading.Lock()
+_stats = {"hits": 0, "builds": 0, "evictions": 0}
+
+
+def _build_static_input(field_values: Mapping[str, Any]) -> StaticPromptInput:
+    fragments = {name: f"{encode_canonical(name)}:{encode_canonical(value)}" for name, value in field_values.items()}
+    return StaticPromptInput(
+        fields=MappingProxyType(dict(field_values)),
+        fragments=MappingProxyType(fragments),
+        encoded_fragments=MappingProxyType({name: fragment.encode("utf-8") for name, fragment in fragments.items()}),
+    )
+
+
+def get_static_input(slug: str, unit_values: Mapping[str, Any], static_field_names: Sequence[str]) -> StaticPromptInput:
+    """Returns the cached static part of `slug`'s input for these unit values, building it on first use."""
+    static_values = tuple(unit_values[name] for name in static_field_names)
+    cache_key = (slug, tuple(static_field_names), static_values)
+    with _static_inputs_lock:
+        static_input = _static_inputs.get(cache_key)
+        if static_input is not None:
+            _static_inputs.move_to_end(cache_key)
+            _stats["hits"] += 1
+            return static_input
+
+    # Encode outside the lock; two threads racing on a new unit build the same value
+    static_input = _build_static_input(dict(zip(static_field_names, static_values)))
+    max_entries = int(os.environ.get(CACHE_MAX_ENTRIES_ENV_VAR, DEFAULT_CACHE_MAX_ENTRIES))
+    with _static_inputs_lock:
+        _static_inputs[cache_key] = static_input
+        _stats["builds"] += 1
+        while len(_static_inputs) > max_entries:
+            _static_inputs.popitem(last=False)
+            _stats["evictions"] += 1
+    return static_input
+
+
+def build_prompt_input(
+    slug: str,
+    unit_values: Mapping[str, Any],
+    static_field_names: Sequence[str],
+    request_fields: Mapping[str, Any],
+) -> PromptInput:
+    """
+    Builds a prompt input from the cached static fields plus the per-request fields.
+
+    Args:
+        slug: The prompt the input is for (static parts are cached per prompt).
+        unit_values: The unit's values (`value_extractor` output); `static_field_names` are read from it.
+        static_field_names: Fields that only change with the unit.
+        request_fields: Fields that change per request.
+    """
+    static_input = get_static_input(slug, unit_values, static_field_names)
+    prompt_input = PromptInput(static_input.fields)
+    prompt_input.update(request_fields)
+    prompt_input.static_input = static_input
+    return prompt_input
+
+
+def get_prompt_input_stats() -> Dict[str, int]:
+    """Returns the static-part cache counters and current size."""
+    with _static_inputs_lock:
+        snapshot = dict(_stats)
+        snapshot["entries"] = len(_static_inputs)
+    return snapshot
+
+
+def clear_prompt_input_cache() -> None:
+    """Drops every cached static part and zeroes the counters."""
+    with _static_inputs_lock:
+        _static_inputs.clear()
+        for counter_name in _stats:
+            _stats[counter_name] = 0
+
+
+# Micro-benchmark: per-request encode time and allocations for the generator input, before and after
+if __name__ == "__main__":
+    import argparse
+    import hashlib
+    import time
+    import tracemalloc
+
+    from invoke_cache import canonical_input_size, make_cache_key
+    # The importable module, not this __main__ copy, defines the PromptInput class invoke_cache checks for
+    from prompt_input import build_prompt_input
+    from suggested_response import GENERATOR_STATIC_FIELDS
+    from unit_config import get_unit_config
+
+    parser = argparse.ArgumentParser(description="Compare encoding the whole generator input with cached static fragments.")
+    parser.add_argument("--unit-id", default=None, help="Unit whose config to use (default: DEFAULT_UNIT_ID)")
+    parser.add_argument("--requests", type=int, default=20_000)
+    args = parser.parse_args()
+
+    unit_values = dict(get_unit_config(args.unit_id))
+    request_fields = {
+        "conversation": "[2025-01-06 17:59:14] Guest: when the pool open? \\n" * 8,
+        "current_date_time": "2025-01-06 17:59:26",
+        "knowledge_base": "The pool on level 6 opens from 7am to 10pm. Towels are provided. " * 6,
+        "language": "English",
+        "last_name": "Chan",
+        "open_issues": "Guest asked about the pool opening hours.",
+        "quick_replies": "We will gladly arrange the reservations that you require. " * 4,
+        "salutation": "Ms.",
+    }
+    slug = "suggested-response-generator-f95c"
+
+    def encode_before(with_cache_key: bool) -> int:
+        # What every request did before: rebuild the 16-field dict, then encode all of it for each use
+        prompt_input = {name: unit_values[name] for name in GENERATOR_STATIC_FIELDS}
+        prompt_input.update(request_fields)
+        input_bytes = len(encode_canonical(prompt_input).encode("utf-8"))
+        if with_cache_key:
+            key_material = encode_canonical(
+                {"project_name": "suggested-response", "slug": slug, "version": "v1", "stream": True, "input": prompt_input}
+            )
+            hashlib.sha256(key_material.encode("utf-8")).hexdigest()
+        return input_bytes
+
+    def encode_after(with_cache_key: bool) -> int:
+        prompt_input = build_prompt_input(slug, unit_values, GENERATOR_STATIC_FIELDS, request_fields)
+        input_bytes = canonical_input_size(prompt_input)
+        if with_cache_key:
+            make_cache_key("suggested-response", slug, "v1", prompt_input, True)
+        return input_bytes
+
+    assert encode_before(False) == encode_after(False)
+    static_bytes = sum(len(encode_canonical(unit_values[name]).encode("utf-8")) for name in GENERATOR_STATIC_FIELDS)
+    print(f"generator input: {encode_before(False):,} bytes canonical JSON, {static_bytes:,} of them static per unit")
+
+    for with_cache_key in (False, True):
+        label = "size + cache key" if with_cache_key else "size only (cache off)"
+        for name, encode in (("before", encode_before), ("after", encode_after)):
+            started_at = time.perf_counter()
+            for _ in range(args.requests):
+                encode(with_cache_key)
+            microseconds = (time.perf_counter() - started_at) / args.requests * 1e6
+
+            # Allocations of one request: peak traced memory above the steady state while it runs
+            tracemalloc.start()
+            encode(with_cache_key)
+            baseline_bytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            encode(with_cache_key)
+            peak_bytes = tracemalloc.get_traced_memory()[1] - baseline_bytes
+            tracemalloc.stop()
+            print(f"{label:<24}{name:<8}{microseconds:8.1f} us/request  peak {peak_bytes:>8,} bytes allocated/request")
@@ -0,0 +1,240 @@
+import heapq
+import math
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+# <ai_context>
+# BM25 retrieval over a hotel's quick-reply corpus, used by `rag_data` to send only the relevant quick replies
+# to the generator prompt instead of the whole corpus.
+# The corpus format is blocks separated by "###", each with "english_guest_questions:" (numbered paraphrases)
+# and "english_reply:". Blocks without a reply are merged into the next block.
+# `build_quick_reply_index` parses the corpus and builds an inverted index once. BM25 term weights do not depend on the
+# query, so each posting stores its precomputed weight and `search_quick_replies` only sums weights over the query terms'
+# posting lists: cost scales with matching postings, not corpus size.
+# Run `python quick_reply_index.py` for a query-latency micro-benchmark on a synthetic corpus of thousands of entries.
+# </ai_context>
+
+# BM25 parameters (standard defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Corpus markers (the corpus stores newlines as the two-character sequence "\n")
+ENTRY_SEPARATOR = "###"
+QUESTIONS_MARKER = "english_guest_questions:"
+REPLY_MARKER = "english_reply:"
+ESCAPED_NEWLINE = "\\n"
+
+# Separator used when joining retrieved entries back into the prompt input, matching the corpus layout
+FORMATTED_ENTRY_SEPARATOR = "\\n\\n###\\n\\n"
+
+# Words that carry no retrieval signal in guest questions or in the open-issues summaries used as queries
+STOPWORDS = frozenset(
+    "a an and are as at be been but by can could do does for from have hello hi how i i'm if in into is it its "
+    "kindly me my of on or our please so that the their there this to us was we what when where which who will "
+    "with would you your dear good day greetings about like know regarding inquire inquiry "
+    "guest guests hotel asks asking asked wants wanting".split()
+)
+
+# Latin words/numbers, or runs of CJK ideographs (indexed as unigrams + bigrams since there are no spaces)
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[\u3400-\u9fff]+")
+# Numbered paraphrases: "1. ...", "2. ..." (also "6.What ..." without a space)
+_NUMBERED_ITEM_PATTERN = re.compile(r"(?:^|\s)\d+\.\s*")
+
+
+@dataclass(frozen=True)
+class QuickReplyDocument:
+    """One quick-reply entry: the guest question paraphrases, the reply, and the raw corpus text for the prompt."""
+
+    document_id: int
+    questions: Tuple[str, ...]
+    reply: str
+    raw_text: str
+
+
+@dataclass(frozen=True)
+class QuickReplyIndex:
+    """Immutable BM25 inverted index over quick-reply documents."""
+
+    documents: Tuple[QuickReplyDocument, ...]
+    # term -> ((document_id, bm25_weight), ...) where bm25_weight = idf * tf * (k1 + 1) / (tf + length_norm)
+    postings: Dict[str, Tuple[Tuple[int, float], ...]]
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercases and splits text into retrieval terms.
+
+    Latin text yields words minus stopwords; CJK runs yield each character and each adjacent character pair.
+    """
+    terms: List[str] = []
+    for token in _TOKEN_PATTERN.findall(text.replace(ESCAPED_NEWLINE, " ").lower()):
+        # CJK run: unigrams + bigrams
+        if "\u3400" <= token[0] <= "\u9fff":
+            terms.extend(token)
+            terms.extend(token[i : i + 2] for i in range(len(token) - 1))
+            continue
+        if token not in STOPWORDS:
+            terms.append(token)
+    return terms
+
+
+def _split_questions(questions_text: str) -> Tuple[str, ...]:
+    """Splits a questions section into individual paraphrases (numbered items or free text lines)."""
+    cleaned_text = questions_text.replace(QUESTIONS_MARKER, " ").replace(ESCAPED_NEWLINE, " ")
+    return tuple(item.strip() for item in _NUMBERED_ITEM_PATTERN.split(cleaned_text) if item.strip())
+
+
+def parse_quick_replies(corpus: str) -> List[QuickReplyDocument]:
+    """
+    Parses a quick-reply corpus into documents.
+
+    A block without a reply (e.g. the questions were split from their reply by a stray separator) is carried over and
+    merged into the next block, so every document has both paraphrases and a reply.
+    """
+    documents: List[QuickReplyDocument] = []
+    pending_questions: List[str] = []
+    pending_raw_text: List[str] = []
+
+    for block in corpus.split(ENTRY_SEPARATOR):
+        stripped_block = block.strip().strip(ESCAPED_NEWLINE).strip()
+        if not stripped_block:
+            continue
+
+        # No reply yet: keep the questions for the next block
+        if REPLY_MARKER not in stripped_block:
+            pending_questions.extend(_split_questions(stripped_block))
+            pending_raw_text.append(stripped_block)
+            continue
+
+        questions_text, reply_text = stripped_block.split(REPLY_MARKER, 1)
+        pending_questions.extend(_split_questions(questions_text))
+        pending_raw_text.append(stripped_block)
+        documents.append(
+            QuickReplyDocument(
+                document_id=len(documents),
+                questions=tuple(pending_questions),
+                reply=reply_text.replace(ESCAPED_NEWLINE, " ").strip(),
+                raw_text=FORMATTED_ENTRY_SEPARATOR.join(pending_raw_text),
+            )
+        )
+        pending_questions = []
+        pending_raw_text = []
+
+    return documents
+
+
+def build_quick_reply_index(corpus: str) -> QuickReplyIndex:
+    """
+    Parses the corpus and builds the BM25 inverted index. Call once at load time and reuse the result.
+
+    Each document is indexed on its paraphrases plus its reply, so both how guests ask and what we answer match.
+    """
+    documents = parse_quick_replies(corpus)
+
+    term_postings: Dict[str, List[Tuple[int, int]]] = {}
+    document_lengths: List[int] = []
+    for document in documents:
+        terms = tokenize(" ".join(document.questions) + " " + document.reply)
+        document_lengths.append(len(terms))
+        term_frequencies: Dict[str, int] = {}
+        for term in terms:
+            term_frequencies[term] = term_frequencies.get(term, 0) + 1
+        for term, term_frequency in term_frequencies.items():
+            term_postings.setdefault(term, []).append((document.document_id, term_frequency))
+
+    document_count = len(documents)
+    average_length = (sum(document_lengths) / document_count) if document_count else 0.0
+    # BM25 idf with the +1 smoothing so very common terms never score negative
+    idf = {
+        term: math.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+        for term, postings in term_postings.items()
+    }
+    # Per-document BM25 length normalisation: k1 * (1 - b + b * doc_len / avg_len)
+    length_norms = [
+        BM25_K1 * (1 - BM25_B + BM25_B * (document_length / average_length if average_length else 0.0))
+        for document_length in document_lengths
+    ]
+
+    # Fold idf, tf saturation and length normalisation into one weight per posting
+    weighted_postings = {
+        term: tuple(
+            (document_id, idf[term] * term_frequency * (BM25_K1 + 1) / (term_frequency + length_norms[document_id]))
+            for document_id, term_frequency in postings
+        )
+        for term, postings in term_postings.items()
+    }
+
+    return QuickReplyIndex(documents=tuple(documents), postings=weighted_postings)
+
+
+def search_quick_replies(
+    index: QuickReplyIndex,
+    query: str,
+    top_k: int = 3,
+    min_score: float = 0.0,
+) -> List[Tuple[QuickReplyDocument, float]]:
+    """
+    Returns the top-k documents for a query, best first, as (document, score) pairs.
+
+    Args:
+        index: Index from `build_quick_reply_index`.
+        query: Free text, typically the open-issues handler output.
+        top_k: Maximum number of documents to return.
+        min_score: Documents scoring at or below this are dropped.
+    """
+    # Guard clause: nothing to search with or in
+    query_terms = set(tokenize(query))
+    if not query_terms or not index.documents:
+        return []
+
+    # Term-at-a-time accumulation of the precomputed posting weights
+    scores: Dict[int, float] = {}
+    get_score = scores.get
+    for term in query_terms:
+        for document_id, weight in index.postings.get(term, ()):
+            scores[document_id] = get_score(document_id, 0.0) + weight
+
+    ranked = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+    return [(index.documents[document_id], score) for document_id, score in ranked if score > min_score]
+
+
+def format_quick_replies(results: List[Tuple[QuickReplyDocument, float]], empty_value: str = "none") -> str:
+    """Joins retrieved documents back into the corpus layout expected by the generator prompt."""
+    if not results:
+        return empty_value
+    return FORMATTED_ENTRY_SEPARATOR.join(document.raw_text for document, _ in results)
+
+
+def _build_synthetic_corpus(entry_count: int) -> str:
+    """Builds a corpus of `entry_count` varied entries for the micro-benchmark."""
+    topics = ["pool", "spa", "breakfast", "parking", "laundry", "gym", "checkout", "shuttle", "wifi", "restaurant"]
+    verbs = ["book", "reserve", "access", "find", "use", "cancel", "extend", "arrange"]
+    entries = []
+    for entry_number in range(entry_count):
+        topic = topics[entry_number % len(topics)]
+        verb = verbs[(entry_number // len(topics)) % len(verbs)]
+        entries.append(
+            f"english_guest_questions:\\n1. How do I {verb} the {topic} option {entry_number}? "
+            f"2. Can you help me {verb} {topic} variant {entry_number} tomorrow? \\n\\n"
+            f"english_reply:\\nCertainly, we will {verb} the {topic} ({entry_number}) for you.\\n\\n"
+        )
+    return ENTRY_SEPARATOR.join(entries)
+
+
+# Micro-benchmark: index build time and query latency on a synthetic corpus
+if __name__ == "__main__":
+    for entry_count in (1_000, 5_000):
+        corpus = _build_synthetic_corpus(entry_count)
+        build_started_at = time.perf_counter()
+        index = build_quick_reply_index(corpus)
+        build_ms = (time.perf_counter() - build_started_at) * 1000
+
+        queries = ["Guest wants to book the spa tomorrow", "When does the pool open?", "late checkout and parking"]
+        query_count = 2_000
+        query_started_at = time.perf_counter()
+        for query_number in range(query_count):
+            search_quick_replies(index, queries[query_number % len(queries)], top_k=3)
+        per_query_us = (time.perf_counter() - query_started_at) / query_count * 1_000_000
+        print(f"{entry_count} entries: build {build_ms:.1f} ms, query {per_query_us:.1f} µs")
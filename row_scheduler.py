@@ -0,0 +1,420 @@
+import asyncio
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Tuple
+
+# <ai_context>
+# Throughput controls for running large datasets through the eval chains.
+# Rows: `scheduled_task(task)` wraps an Eval task so at most EVAL_MAX_IN_FLIGHT_ROWS rows run at once (process-wide, on
+# top of Eval's own `max_concurrency`, which `get_max_in_flight_rows()` also feeds), counts finished/failed rows and
+# prints the achieved rows/sec every EVAL_PROGRESS_INTERVAL_SECONDS.
+# Prompts: `call_with_rate_limit(slug, call)` takes a token from the slug's token bucket before calling, and retries with
+# exponential backoff (honouring Retry-After) when the provider throttles (HTTP 429). `acall_with_rate_limit` is the
+# same for async calls (`braintrust.invoke_async`), waiting on the event loop instead of a thread. Throttling also halves the slug's
+# rate, which then recovers additively on successes (AIMD), so sustained runs settle just under the provider limit.
+# Limits come from PROMPT_RATE_LIMITS ("slug=rps[:burst],...") and PROMPT_RATE_LIMIT_DEFAULT (rps for other slugs);
+# slugs without a limit are not throttled locally but still back off on 429. `cached_invoke` routes every upstream
+# call through here, so cache hits never spend tokens.
+# Retries follow the caller's `RetryPolicy` (a contextvar, so it follows the call onto pool threads and asyncio tasks).
+# The default is the interactive policy (PROMPT_INTERACTIVE_MAX_RETRIES, default 1, sub-second backoff, and no retry when
+# Retry-After asks for a long wait) so a live suggestion fails fast. Eval and batch work opts into the patient policy
+# (PROMPT_THROTTLE_MAX_RETRIES, backoff up to 30 s) with `batch_retries()` / `with_batch_retries(task)`; `scheduled_task`
+# does this for its rows.
+# `get_row_stats()` returns the counters and current per-slug rates.
+# </ai_context>
+
+MAX_IN_FLIGHT_ROWS_ENV_VAR = "EVAL_MAX_IN_FLIGHT_ROWS"
+PROGRESS_INTERVAL_ENV_VAR = "EVAL_PROGRESS_INTERVAL_SECONDS"
+RATE_LIMITS_ENV_VAR = "PROMPT_RATE_LIMITS"
+DEFAULT_RATE_LIMIT_ENV_VAR = "PROMPT_RATE_LIMIT_DEFAULT"
+MAX_RETRIES_ENV_VAR = "PROMPT_THROTTLE_MAX_RETRIES"
+INTERACTIVE_MAX_RETRIES_ENV_VAR = "PROMPT_INTERACTIVE_MAX_RETRIES"
+
+DEFAULT_MAX_IN_FLIGHT_ROWS = 16
+DEFAULT_PROGRESS_INTERVAL_SECONDS = 10.0
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_INTERACTIVE_MAX_RETRIES = 1
+# Backoff after a throttled call: base * 2^attempt, capped, with full jitter
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+# Interactive callers: a short backoff, and give up rather than wait out a longer Retry-After
+INTERACTIVE_BACKOFF_BASE_SECONDS = 0.1
+INTERACTIVE_BACKOFF_MAX_SECONDS = 1.0
+# AIMD: halve the rate on a 429, add back a fraction of the configured rate per successful call
+THROTTLE_RATE_FACTOR = 0.5
+RECOVERY_RATE_FRACTION = 0.05
+# Never adapt a bucket below this share of its configured rate
+MIN_RATE_FRACTION = 0.05
+
+
+@dataclass
+class _TokenBucket:
+    """Token bucket for one prompt slug; `rate` adapts between the configured rate and its floor."""
+
+    configured_rate: float
+    rate: float
+    burst: float
+    tokens: float
+    updated_at: float
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How throttled prompt calls are retried: retry budget (from the environment) and backoff bounds."""
+
+    max_retries_env_var: str
+    default_max_retries: int
+    backoff_base_seconds: float
+    backoff_max_seconds: float
+    # Longest single wait (including Retry-After) worth retrying for; None = always wait
+    max_wait_seconds: Optional[float] = None
+
+    def max_retries(self) -> int:
+        return int(os.environ.get(self.max_retries_env_var, self.default_max_retries))
+
+
+# Eval and batch runs: throughput matters, a row can wait out the provider
+BATCH_RETRY_POLICY = RetryPolicy(MAX_RETRIES_ENV_VAR, DEFAULT_MAX_RETRIES, BACKOFF_BASE_SECONDS, BACKOFF_MAX_SECONDS)
+# Live suggestions: someone is waiting, so fail fast
+INTERACTIVE_RETRY_POLICY = RetryPolicy(
+    INTERACTIVE_MAX_RETRIES_ENV_VAR,
+    DEFAULT_INTERACTIVE_MAX_RETRIES,
+    INTERACTIVE_BACKOFF_BASE_SECONDS,
+    INTERACTIVE_BACKOFF_MAX_SECONDS,
+    max_wait_seconds=INTERACTIVE_BACKOFF_MAX_SECONDS,
+)
+
+_retry_policy: contextvars.ContextVar[RetryPolicy] = contextvars.ContextVar(
+    "prompt_retry_policy", default=INTERACTIVE_RETRY_POLICY
+)
+
+
+# Row accounting
+_row_lock = threading.Lock()
+_row_slots: Optional[threading.BoundedSemaphore] = None
+_row_stats = {
+    "rows_in_flight": 0,
+    "rows_completed": 0,
+    "rows_failed": 0,
+    "throttled_calls": 0,
+    "retries": 0,
+}
+_rows_started_at: Optional[float] = None
+_last_progress_at = 0.0
+
+# slug -> bucket, created on first use from the environment (None = no local limit for that slug)
+_buckets: Dict[str, Optional[_TokenBucket]] = {}
+_bucket_lock = threading.Lock()
+
+
+def get_max_in_flight_rows() -> int:
+    """Max rows running at once; pass it to `Eval(max_concurrency=...)` as well."""
+    return int(os.environ.get(MAX_IN_FLIGHT_ROWS_ENV_VAR, DEFAULT_MAX_IN_FLIGHT_ROWS))
+
+
+def _parse_rate_limits() -> Dict[str, Tuple[float, float]]:
+    """Parses PROMPT_RATE_LIMITS ("slug=rps[:burst],...") into slug -> (rate, burst)."""
+    rate_limits: Dict[str, Tuple[float, float]] = {}
+    for entry in os.environ.get(RATE_LIMITS_ENV_VAR, "").split(","):
+        if "=" not in entry:
+            continue
+        slug, limit = entry.split("=", 1)
+        rate_text, _, burst_text = limit.partition(":")
+        rate = float(rate_text)
+        # Default burst: one second's worth of calls (at least one)
+        rate_limits[slug.strip()] = (rate, float(burst_text) if burst_text else max(1.0, rate))
+    return rate_limits
+
+
+def _get_bucket(slug: str) -> Optional[_TokenBucket]:
+    """Returns the slug's bucket, creating it from the environment on first use."""
+    if slug in _buckets:
+        return _buckets[slug]
+    with _bucket_lock:
+        if slug not in _buckets:
+            rate_limit = _parse_rate_limits().get(slug)
+            default_rate = os.environ.get(DEFAULT_RATE_LIMIT_ENV_VAR)
+            if rate_limit is None and default_rate:
+                rate_limit = (float(default_rate), max(1.0, float(default_rate)))
+            _buckets[slug] = (
+                _TokenBucket(
+                    configured_rate=rate_limit[0],
+                    rate=rate_limit[0],
+                    burst=rate_limit[1],
+                    tokens=rate_limit[1],
+                    updated_at=time.monotonic(),
+                )
+                if rate_limit
+                else None
+            )
+    return _buckets[slug]
+
+
+def _take_token(bucket: _TokenBucket) -> float:
+    """Takes a token if the bucket has one (returns 0), else returns the seconds until it will."""
+    with _bucket_lock:
+        now = time.monotonic()
+        bucket.tokens = min(bucket.burst, bucket.tokens + (now - bucket.updated_at) * bucket.rate)
+        bucket.updated_at = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        return (1 - bucket.tokens) / bucket.rate
+
+
+def _acquire_token(bucket: _TokenBucket) -> None:
+    """Blocks until the bucket has a token, then takes it."""
+    while True:
+        wait_seconds = _take_token(bucket)
+        if not wait_seconds:
+            return
+        # Sleep outside the lock so other slugs (and refills) are not held up
+        time.sleep(wait_seconds)
+
+
+async def _aacquire_token(bucket: _TokenBucket) -> None:
+    """Async `_acquire_token`: waits on the event loop instead of blocking a thread."""
+    while True:
+        wait_seconds = _take_token(bucket)
+        if not wait_seconds:
+            return
+        await asyncio.sleep(wait_seconds)
+
+
+def _adapt_rate(bucket: _TokenBucket, throttled: bool) -> None:
+    """Multiplicative decrease on throttling, additive increase on success."""
+    with _bucket_lock:
+        if throttled:
+            bucket.rate = max(bucket.configured_rate * MIN_RATE_FRACTION, bucket.rate * THROTTLE_RATE_FACTOR)
+            # Drop saved-up tokens so the lower rate applies immediately
+            bucket.tokens = 0.0
+        elif bucket.rate < bucket.configured_rate:
+            bucket.rate = min(bucket.configured_rate, bucket.rate + bucket.configured_rate * RECOVERY_RATE_FRACTION)
+
+
+def _get_throttle_response(error: BaseException) -> Optional[Any]:
+    """Returns the HTTP response if `error` (or an error it was raised from) is a 429, else None."""
+    # The SDK re-raises HTTP errors with the response text only, so walk the cause chain for the response
+    current_error: Optional[BaseException] = error
+    while current_error is not None:
+        response = getattr(current_error, "response", None)
+        if getattr(response, "status_code", None) == 429:
+            return response
+        current_error = current_error.__cause__ or current_error.__context__
+    return None
+
+
+def _is_throttled(error: BaseException) -> bool:
+    if _get_throttle_response(error) is not None:
+        return True
+    message = str(error).lower()
+    return "rate limit" in message or "too many requests" in message
+
+
+def _backoff_seconds(error: BaseException, attempt: int, policy: RetryPolicy) -> float:
+    """Retry-After when the provider sends it, else capped exponential backoff with full jitter."""
+    response = _get_throttle_response(error)
+    retry_after = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return random.uniform(0, min(policy.backoff_max_seconds, policy.backoff_base_seconds * 2**attempt))
+
+
+def get_retry_policy() -> RetryPolicy:
+    """The retry policy for prompt calls made from the current context."""
+    return _retry_policy.get()
+
+
+@contextmanager
+def batch_retries() -> Iterator[None]:
+    """Uses the eval/batch retry policy for prompt calls made inside the block (and the threads/tasks it starts)."""
+    token = _retry_policy.set(BATCH_RETRY_POLICY)
+    try:
+        yield
+    finally:
+        _retry_policy.reset(token)
+
+
+def with_batch_retries(task: Callable[..., Any]) -> Callable[..., Any]:
+    """Wraps an eval or batch task so its prompt calls use the eval/batch retry policy."""
+
+    @functools.wraps(task)
+    def run_with_batch_retries(*args: Any, **kwargs: Any) -> Any:
+        with batch_retries():
+            return task(*args, **kwargs)
+
+    return run_with_batch_retries
+
+
+def _retry_backoff(
+    error: BaseException, bucket: Optional[_TokenBucket], attempt: int, policy: RetryPolicy
+) -> Optional[float]:
+    """
+    Handles a failed upstream call: the seconds to back off before retrying, or None when the error must be re-raised
+    (not throttling, retries used up, or a wait too long for the policy).
+    """
+    if not _is_throttled(error):
+        return None
+    with _row_lock:
+        _row_stats["throttled_calls"] += 1
+    if bucket is not None:
+        _adapt_rate(bucket, throttled=True)
+    if attempt >= policy.max_retries():
+        return None
+    backoff_seconds = _backoff_seconds(error, attempt, policy)
+    if policy.max_wait_seconds is not None and backoff_seconds > policy.max_wait_seconds:
+        return None
+    with _row_lock:
+        _row_stats["retries"] += 1
+    return backoff_seconds
+
+
+def call_with_rate_limit(slug: str, call: Callable[[], Any]) -> Any:
+    """
+    Runs `call()` (an upstream prompt invoke) within the slug's rate limit, retrying when the provider throttles.
+
+    Retries follow the caller's `RetryPolicy` (interactive unless inside `batch_retries()`).
+
+    Raises:
+        The last error once the policy's retries are used up (or the wait it would need is too long for the policy),
+        or any non-throttling error immediately.
+    """
+    bucket = _get_bucket(slug)
+    policy = get_retry_policy()
+    attempt = 0
+    while True:
+        if bucket is not None:
+            _acquire_token(bucket)
+        try:
+            result = call()
+        except Exception as error:
+            backoff_seconds = _retry_backoff(error, bucket, attempt, policy)
+            if backoff_seconds is None:
+                raise
+            time.sleep(backoff_seconds)
+            attempt += 1
+            continue
+
+        if bucket is not None:
+            _adapt_rate(bucket, throttled=False)
+        return result
+
+
+async def acall_with_rate_limit(slug: str, call: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Async `call_with_rate_limit` for `braintrust.invoke_async` calls: waits for tokens and backs off on the event loop.
+    """
+    bucket = _get_bucket(slug)
+    policy = get_retry_policy()
+    attempt = 0
+    while True:
+        if bucket is not None:
+            await _aacquire_token(bucket)
+        try:
+            result = await call()
+        except Exception as error:
+            backoff_seconds = _retry_backoff(error, bucket, attempt, policy)
+            if backoff_seconds is None:
+                raise
+            await asyncio.sleep(backoff_seconds)
+            attempt += 1
+            continue
+
+        if bucket is not None:
+            _adapt_rate(bucket, throttled=False)
+        return result
+
+
+def _get_row_slots() -> threading.BoundedSemaphore:
+    global _row_slots
+    if _row_slots is None:
+        with _row_lock:
+            if _row_slots is None:
+                _row_slots = threading.BoundedSemaphore(get_max_in_flight_rows())
+    return _row_slots
+
+
+def get_row_stats() -> Dict[str, Any]:
+    """Returns the row counters, achieved rows/sec since the first row started, and the current per-slug rates."""
+    with _row_lock:
+        snapshot: Dict[str, Any] = dict(_row_stats)
+        rows_started_at = _rows_started_at
+    elapsed_seconds = time.monotonic() - rows_started_at if rows_started_at is not None else 0.0
+    snapshot["elapsed_seconds"] = elapsed_seconds
+    snapshot["rows_per_second"] = snapshot["rows_completed"] / elapsed_seconds if elapsed_seconds else 0.0
+    with _bucket_lock:
+        snapshot["prompt_rates"] = {slug: bucket.rate for slug, bucket in _buckets.items() if bucket is not None}
+    return snapshot
+
+
+def format_row_stats(stats: Optional[Dict[str, Any]] = None) -> str:
+    """One-line progress summary."""
+    stats = stats or get_row_stats()
+    rates = ", ".join(f"{slug}={rate:.2f}/s" for slug, rate in stats["prompt_rates"].items())
+    return (
+        f"rows: {stats['rows_completed']} done, {stats['rows_failed']} failed, {stats['rows_in_flight']} in flight | "
+        f"{stats['rows_per_second']:.2f} rows/s | throttled {stats['throttled_calls']}, retries {stats['retries']}"
+        + (f" | rates {rates}" if rates else "")
+    )
+
+
+def _maybe_report_progress() -> None:
+    """Prints the progress line at most once per EVAL_PROGRESS_INTERVAL_SECONDS."""
+    global _last_progress_at
+    interval_seconds = float(os.environ.get(PROGRESS_INTERVAL_ENV_VAR, DEFAULT_PROGRESS_INTERVAL_SECONDS))
+    now = time.monotonic()
+    with _row_lock:
+        if interval_seconds <= 0 or now - _last_progress_at < interval_seconds:
+            return
+        _last_progress_at = now
+    print(format_row_stats(), flush=True)
+
+
+def scheduled_task(task: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Wraps an Eval task so rows respect EVAL_MAX_IN_FLIGHT_ROWS, use the eval/batch retry policy and are counted towards
+    the rows/sec report.
+    """
+
+    @functools.wraps(task)
+    def run_row(*args: Any, **kwargs: Any) -> Any:
+        global _rows_started_at
+        with _get_row_slots(), batch_retries():
+            with _row_lock:
+                if _rows_started_at is None:
+                    _rows_started_at = time.monotonic()
+                _row_stats["rows_in_flight"] += 1
+            succeeded = False
+            try:
+                result = task(*args, **kwargs)
+                succeeded = True
+                return result
+            finally:
+                with _row_lock:
+                    _row_stats["rows_in_flight"] -= 1
+                    _row_stats["rows_completed" if succeeded else "rows_failed"] += 1
+                _maybe_report_progress()
+
+    return run_row
+
+
+def reset_row_stats() -> None:
+    """Zeroes the counters and forgets the adapted rates (limits are re-read from the environment)."""
+    global _rows_started_at, _last_progress_at, _row_slots
+    with _row_lock:
+        for counter_name in _row_stats:
+            _row_stats[counter_name] = 0
+        _rows_started_at = None
+        _last_progress_at = 0.0
+        _row_slots = None
+    with _bucket_lock:
+        _buckets.clear()
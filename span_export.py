@@ -0,0 +1,306 @@
+import atexit
+import contextlib
+import contextvars
+import functools
+import hashlib
+import inspect
+import os
+import queue
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# <ai_context>
+# Sampled, low-overhead tracing for the hot-path helpers (value_extractor, rag_data, generate_random_context,
+# run_and_print_stream).
+# `sampled_traced(type=..., name=..., metadata=...)` replaces `@braintrust.traced`:
+# - Head-based sampling: each span is kept with the rate configured for its type (TRACE_SAMPLE_RATES, e.g.
+#   "function=0.1,task=1"; others use TRACE_SAMPLE_RATE_DEFAULT, default 1). When the outermost sampled_traced call of a
+#   request is not sampled, nothing below it is traced either (a ContextVar carries the decision into nested calls and
+#   pool threads). A skipped inner span just leaves its children attached to the nearest recorded ancestor.
+# - The span itself (name, timing, nesting, errors) is recorded inline, but inputs and outputs are not serialized on the
+#   request thread: they are put on a bounded queue (TRACE_EXPORT_QUEUE_SIZE) with a non-blocking put. A background
+#   thread drains it in batches (TRACE_EXPORT_BATCH_SIZE), shrinks large strings (over TRACE_MAX_FIELD_CHARS) by
+#   truncating them or, with TRACE_LARGE_FIELD_MODE=hash, replacing them by length + sha256, and logs them on the span.
+#   When the queue is full the payload is dropped (the span stays) and counted.
+# `sampled_span(...)` is the same decision as a context manager, for work that is not one function call (a streamed
+# server response): it yields the span, or None when not sampled, and exports its input the same way.
+# The SDK is imported on the first sampled span. `get_span_export_stats()` returns sampled/skipped/exported/dropped
+# counters; `flush_span_export()` waits for the queue to drain (also run at exit).
+# </ai_context>
+
+SAMPLE_RATES_ENV_VAR = "TRACE_SAMPLE_RATES"
+DEFAULT_SAMPLE_RATE_ENV_VAR = "TRACE_SAMPLE_RATE_DEFAULT"
+MAX_FIELD_CHARS_ENV_VAR = "TRACE_MAX_FIELD_CHARS"
+LARGE_FIELD_MODE_ENV_VAR = "TRACE_LARGE_FIELD_MODE"
+QUEUE_SIZE_ENV_VAR = "TRACE_EXPORT_QUEUE_SIZE"
+BATCH_SIZE_ENV_VAR = "TRACE_EXPORT_BATCH_SIZE"
+
+DEFAULT_SAMPLE_RATE = 1.0
+DEFAULT_MAX_FIELD_CHARS = 2048
+DEFAULT_LARGE_FIELD_MODE = "truncate"
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 100
+# How long the exporter waits for more payloads before logging a partial batch
+EXPORT_BATCH_WAIT_SECONDS = 0.2
+# Characters of the sha256 hex digest kept in shrunk fields
+HASH_PREFIX_CHARS = 16
+
+# Sampling decision of the enclosing sampled_traced call: None outside any, else whether it was recorded
+_trace_sampled: contextvars.ContextVar[Optional[bool]] = contextvars.ContextVar("trace_sampled", default=None)
+
+# (span, input, output, has_output) payloads waiting to be logged
+_export_queue: Optional["queue.Queue[Tuple[Any, Dict[str, Any], Any, bool]]"] = None
+_exporter_thread: Optional[threading.Thread] = None
+_exporter_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {
+    "spans_sampled": 0,
+    "spans_skipped": 0,
+    "payloads_exported": 0,
+    "payloads_dropped": 0,
+    "export_errors": 0,
+    "fields_shrunk": 0,
+}
+
+
+def _increment(counter_name: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _stats[counter_name] += amount
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_sample_rates(sample_rates_text: str) -> Dict[str, float]:
+    """Parses TRACE_SAMPLE_RATES ("type=rate,...") into span type -> rate (memoized per distinct value)."""
+    sample_rates: Dict[str, float] = {}
+    for entry in sample_rates_text.split(","):
+        if "=" not in entry:
+            continue
+        span_type, rate_text = entry.split("=", 1)
+        sample_rates[span_type.strip()] = min(1.0, max(0.0, float(rate_text)))
+    return sample_rates
+
+
+def get_sample_rate(span_type: str) -> float:
+    """Returns the sampling rate for a span type."""
+    sample_rates = _parse_sample_rates(os.environ.get(SAMPLE_RATES_ENV_VAR, ""))
+    if span_type in sample_rates:
+        return sample_rates[span_type]
+    return float(os.environ.get(DEFAULT_SAMPLE_RATE_ENV_VAR, DEFAULT_SAMPLE_RATE))
+
+
+def shrink_payload(value: Any, max_chars: Optional[int] = None, mode: Optional[str] = None) -> Any:
+    """
+    Returns `value` with every string longer than `max_chars` truncated (mode "truncate") or replaced by its length
+    and sha256 prefix (mode "hash"). Dicts, lists and tuples are walked; other values are returned unchanged.
+    """
+    if max_chars is None:
+        max_chars = int(os.environ.get(MAX_FIELD_CHARS_ENV_VAR, DEFAULT_MAX_FIELD_CHARS))
+    if mode is None:
+        mode = os.environ.get(LARGE_FIELD_MODE_ENV_VAR, DEFAULT_LARGE_FIELD_MODE)
+
+    if isinstance(value, str):
+        if len(value) <= max_chars:
+            return value
+        _increment("fields_shrunk")
+        digest = hashlib.sha256(value.encode("utf-8")).hexdigest()[:HASH_PREFIX_CHARS]
+        if mode == "hash":
+            return f"[{len(value)} chars, sha256:{digest}]"
+        return f"{value[:max_chars]}... [truncated from {len(value)} chars, sha256:{digest}]"
+    if isinstance(value, dict):
+        return {key: shrink_payload(item, max_chars, mode) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [shrink_payload(item, max_chars, mode) for item in value]
+    return value
+
+
+def _export_batch(batch: List[Tuple[Any, Dict[str, Any], Any, bool]]) -> None:
+    for span, span_input, span_output, has_output in batch:
+        try:
+            if has_output:
+                span.log(input=shrink_payload(span_input), output=shrink_payload(span_output))
+            else:
+                span.log(input=shrink_payload(span_input))
+            _increment("payloads_exported")
+        except Exception:
+            _increment("export_errors")
+
+
+def _run_exporter(export_queue: "queue.Queue[Tuple[Any, Dict[str, Any], Any, bool]]") -> None:
+    """Background loop: waits for a payload, gathers up to a batch, logs it, marks the items done."""
+    batch_size = int(os.environ.get(BATCH_SIZE_ENV_VAR, DEFAULT_BATCH_SIZE))
+    while True:
+        batch = [export_queue.get()]
+        batch_deadline = time.monotonic() + EXPORT_BATCH_WAIT_SECONDS
+        while len(batch) < batch_size:
+            remaining_seconds = batch_deadline - time.monotonic()
+            if remaining_seconds <= 0:
+                break
+            try:
+                batch.append(export_queue.get(timeout=remaining_seconds))
+            except queue.Empty:
+                break
+        _export_batch(batch)
+        for _ in batch:
+            export_queue.task_done()
+
+
+def _get_export_queue() -> "queue.Queue[Tuple[Any, Dict[str, Any], Any, bool]]":
+    """Returns the export queue, starting the exporter thread on first use."""
+    global _export_queue, _exporter_thread
+    if _export_queue is None:
+        with _exporter_lock:
+            if _export_queue is None:
+                export_queue: "queue.Queue[Tuple[Any, Dict[str, Any], Any, bool]]" = queue.Queue(
+                    maxsize=int(os.environ.get(QUEUE_SIZE_ENV_VAR, DEFAULT_QUEUE_SIZE))
+                )
+                _exporter_thread = threading.Thread(
+                    target=_run_exporter, args=(export_queue,), name="span-export", daemon=True
+                )
+                _exporter_thread.start()
+                # Registered after the SDK's own exit flush (the SDK is imported before the first payload), so this
+                # runs first and the payloads are still uploaded
+                atexit.register(flush_span_export)
+                _export_queue = export_queue
+    return _export_queue
+
+
+def _enqueue_payload(span: Any, span_input: Dict[str, Any], span_output: Any, has_output: bool) -> None:
+    """Hands a span's input/output to the exporter without blocking; drops it if the queue is full."""
+    try:
+        _get_export_queue().put_nowait((span, span_input, span_output, has_output))
+    except queue.Full:
+        _increment("payloads_dropped")
+
+
+def flush_span_export(timeout: float = 10.0) -> bool:
+    """
+    Waits until every queued payload has been logged on its span (the SDK then uploads them).
+
+    Returns:
+        True if the queue drained within `timeout` seconds.
+    """
+    export_queue = _export_queue
+    if export_queue is None:
+        return True
+    deadline = time.monotonic() + timeout
+    # Queue.join has no timeout, so poll the unfinished count
+    while export_queue.unfinished_tasks:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def sampled_traced(
+    type: str = "function", name: Optional[str] = None, metadata: Optional[Dict[str, Any]] = None
+) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    Traces a function like `@braintrust.traced(type=..., name=..., metadata=...)`, with per-type head sampling and
+    inputs/outputs logged asynchronously (see the module notes).
+    """
+
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        span_name = name or fn.__name__
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def call_sampled(*args: Any, **kwargs: Any) -> Any:
+            parent_sampled = _trace_sampled.get()
+            # Inside a trace that was not sampled: run untraced
+            if parent_sampled is False:
+                return fn(*args, **kwargs)
+            if random.random() >= get_sample_rate(type):
+                _increment("spans_skipped")
+                # The outermost call decides for the whole request; a skipped inner span does not
+                if parent_sampled is None:
+                    token = _trace_sampled.set(False)
+                    try:
+                        return fn(*args, **kwargs)
+                    finally:
+                        _trace_sampled.reset(token)
+                return fn(*args, **kwargs)
+
+            from braintrust import start_span
+
+            _increment("spans_sampled")
+            bound_arguments = signature.bind(*args, **kwargs)
+            span_input = dict(bound_arguments.arguments)
+            token = _trace_sampled.set(True)
+            try:
+                # The span records timing, nesting and any exception; the payload is logged later by the exporter
+                with start_span(name=span_name, type=type, metadata=metadata) as span:
+                    try:
+                        result = fn(*args, **kwargs)
+                    except BaseException:
+                        _enqueue_payload(span, span_input, None, has_output=False)
+                        raise
+            finally:
+                _trace_sampled.reset(token)
+            _enqueue_payload(span, span_input, result, has_output=True)
+            return result
+
+        return call_sampled
+
+    return decorator
+
+
+@contextlib.contextmanager
+def sampled_span(
+    type: str = "task",
+    name: str = "span",
+    metadata: Optional[Dict[str, Any]] = None,
+    span_input: Optional[Dict[str, Any]] = None,
+) -> Iterator[Optional[Any]]:
+    """
+    Opens a span with the same sampling as one `sampled_traced` call, for work that is not a single function (e.g. a
+    streamed response). Yields the started span, or None when it is not sampled; `span_input` is logged by the exporter.
+    The caller logs the output (e.g. with `stream_fanout.span_output_sink`).
+    """
+    parent_sampled = _trace_sampled.get()
+    if parent_sampled is False:
+        yield None
+        return
+    if random.random() >= get_sample_rate(type):
+        _increment("spans_skipped")
+        # As in `sampled_traced`, only the outermost span decides for the whole request
+        if parent_sampled is not None:
+            yield None
+            return
+        token = _trace_sampled.set(False)
+        try:
+            yield None
+        finally:
+            _trace_sampled.reset(token)
+        return
+
+    from braintrust import start_span
+
+    _increment("spans_sampled")
+    token = _trace_sampled.set(True)
+    try:
+        with start_span(name=name, type=type, metadata=metadata) as span:
+            try:
+                yield span
+            finally:
+                if span_input is not None:
+                    _enqueue_payload(span, span_input, None, has_output=False)
+    finally:
+        _trace_sampled.reset(token)
+
+
+def get_span_export_stats() -> Dict[str, Any]:
+    """Returns the sampling/export counters and the current queue depth."""
+    with _stats_lock:
+        snapshot: Dict[str, Any] = dict(_stats)
+    snapshot["queue_depth"] = _export_queue.qsize() if _export_queue is not None else 0
+    return snapshot
+
+
+def reset_span_export_stats() -> None:
+    """Zeroes the counters (queued payloads are still exported)."""
+    with _stats_lock:
+        for counter_name in _stats:
+            _stats[counter_name] = 0
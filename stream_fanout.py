@@ -0,0 +1,383 @@
+import argparse
+import asyncio
+import queue
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, TextIO
+
+# <ai_context>
+# Stream multiplexer for suggested-response chunks: one pass over the generator delivers every chunk to several sinks
+# (stdout, a trace span, an HTTP/SSE client, a cache file) without re-iterating and without string accumulation.
+# `fan_out(chunks, sinks)`: each sink with a `write` callable gets its own bounded queue (`max_pending_chunks`) and
+# thread, so a slow sink only slows the producer once its own queue is full (backpressure per sink) and never delays the
+# others until then. The sink thread coalesces whatever is queued into one `write` + `flush`, so a sink that falls behind
+# does fewer, larger writes instead of one syscall per token. A sink that raises is detached and its error reported;
+# the others keep going.
+# Sinks with `on_complete` receive the full text once, at the end; the chunks are kept in a list and joined once (linear
+# time), and only when some sink (or the caller, `keep_text=True`) asks for the full text.
+# `afan_out(chunks, sinks)` is the same for an async stream (e.g. `agenerate_suggested_response`), consumed on the event
+# loop: sinks with an async `awrite` (the SSE sink of suggestion_server.py) get a bounded asyncio queue and a task
+# instead of a thread, with the same coalescing and error handling, while `write` sinks keep their threads (a full queue
+# is waited on off the loop). If the caller is cancelled (e.g. the HTTP client went away), async sinks are cancelled
+# instead of drained.
+# Ready-made sinks: `stdout_sink()`, `file_sink(path)`, `span_output_sink(span)`. `python stream_fanout.py` compares
+# against the `+=` accumulation it replaces.
+# </ai_context>
+
+DEFAULT_MAX_PENDING_CHUNKS = 256
+
+# Queued after the last chunk to tell a sink thread the stream is over
+_END_OF_STREAM = object()
+
+
+@dataclass(frozen=True)
+class StreamSink:
+    """
+    A consumer of the stream. Give it `write` (or, with `afan_out`, `awrite`) for chunks as they arrive, `on_complete`
+    for the full text, or both.
+    """
+
+    name: str
+    # Called with one or more chunks joined together (coalesced while the sink was busy)
+    write: Optional[Callable[[str], Any]] = None
+    # Async `write`, awaited on the event loop; only `afan_out` serves it
+    awrite: Optional[Callable[[str], Awaitable[Any]]] = None
+    # Called after each coalesced write (e.g. flushing stdout or a socket)
+    flush: Optional[Callable[[], Any]] = None
+    # Called once with the full text after the stream ends; asking for it turns on the assembly buffer
+    on_complete: Optional[Callable[[str], Any]] = None
+    # Chunks queued for this sink before the producer waits for it
+    max_pending_chunks: int = DEFAULT_MAX_PENDING_CHUNKS
+
+
+@dataclass(frozen=True)
+class SinkStats:
+    """What one sink received: chunks, coalesced writes, its deepest backlog, time the producer waited on it, error."""
+
+    chunks: int
+    writes: int
+    max_queue_depth: int
+    blocked_seconds: float
+    error: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class FanOutResult:
+    """The full text (None unless requested), the chunk count and per-sink stats by sink name."""
+
+    text: Optional[str]
+    chunk_count: int
+    sink_stats: Dict[str, SinkStats]
+
+
+@dataclass
+class _SinkState:
+    """Mutable bookkeeping for one sink during a fan-out."""
+
+    sink: StreamSink
+    chunk_queue: "Optional[queue.Queue[Any]]" = None
+    thread: Optional[threading.Thread] = None
+    # Async sinks (`awrite`) get an asyncio queue and a task instead
+    async_queue: "Optional[asyncio.Queue[Any]]" = None
+    task: "Optional[asyncio.Task[None]]" = None
+    chunks: int = 0
+    writes: int = 0
+    max_queue_depth: int = 0
+    blocked_seconds: float = 0.0
+    error: Optional[str] = None
+
+    def to_stats(self) -> SinkStats:
+        return SinkStats(
+            chunks=self.chunks,
+            writes=self.writes,
+            max_queue_depth=self.max_queue_depth,
+            blocked_seconds=self.blocked_seconds,
+            error=self.error,
+        )
+
+
+def _drain_sink(state: _SinkState) -> None:
+    """Sink thread: waits for chunks, writes everything queued so far in one call, stops at end of stream."""
+    chunk_queue = state.chunk_queue
+    stream_ended = False
+    while not stream_ended:
+        pending_chunks = [chunk_queue.get()]
+        # Coalesce: take whatever else is already queued without waiting
+        while True:
+            try:
+                pending_chunks.append(chunk_queue.get_nowait())
+            except queue.Empty:
+                break
+        if pending_chunks[-1] is _END_OF_STREAM:
+            pending_chunks.pop()
+            stream_ended = True
+        if not pending_chunks or state.error is not None:
+            continue
+        try:
+            state.sink.write("".join(pending_chunks))
+            if state.sink.flush is not None:
+                state.sink.flush()
+            state.writes += 1
+        except Exception as error:
+            # Detach the sink; the producer stops queueing for it and keeps serving the others
+            state.error = f"{type(error).__name__}: {error}"
+
+
+def _deliver(state: _SinkState, chunk: Any) -> None:
+    """Queues a chunk (or the end marker) for a sink, waiting while its queue is full."""
+    chunk_queue = state.chunk_queue
+    try:
+        chunk_queue.put_nowait(chunk)
+    except queue.Full:
+        started_at = time.perf_counter()
+        # Wake up now and then so a sink that failed while full cannot stall the producer forever. The end marker is
+        # always delivered: a failed sink's thread keeps draining its queue until it sees it
+        while state.error is None or chunk is _END_OF_STREAM:
+            try:
+                chunk_queue.put(chunk, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        state.blocked_seconds += time.perf_counter() - started_at
+    state.max_queue_depth = max(state.max_queue_depth, chunk_queue.qsize())
+
+
+async def _adrain_sink(state: _SinkState) -> None:
+    """Async sink task: `_drain_sink` for an `awrite` sink, on the event loop."""
+    chunk_queue = state.async_queue
+    stream_ended = False
+    while not stream_ended:
+        pending_chunks = [await chunk_queue.get()]
+        while True:
+            try:
+                pending_chunks.append(chunk_queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        if pending_chunks[-1] is _END_OF_STREAM:
+            pending_chunks.pop()
+            stream_ended = True
+        if not pending_chunks or state.error is not None:
+            continue
+        try:
+            await state.sink.awrite("".join(pending_chunks))
+            if state.sink.flush is not None:
+                state.sink.flush()
+            state.writes += 1
+        except Exception as error:
+            state.error = f"{type(error).__name__}: {error}"
+
+
+async def _adeliver(state: _SinkState, chunk: Any) -> None:
+    """`_deliver` from the event loop: waits on a full async queue without blocking the loop, or off the loop for a thread."""
+    if state.async_queue is None:
+        try:
+            state.chunk_queue.put_nowait(chunk)
+            state.max_queue_depth = max(state.max_queue_depth, state.chunk_queue.qsize())
+        except queue.Full:
+            await asyncio.to_thread(_deliver, state, chunk)
+        return
+
+    chunk_queue = state.async_queue
+    if chunk_queue.full():
+        started_at = time.perf_counter()
+        # A failed sink's task keeps draining its queue, so this cannot stall for good
+        await chunk_queue.put(chunk)
+        state.blocked_seconds += time.perf_counter() - started_at
+    else:
+        chunk_queue.put_nowait(chunk)
+    state.max_queue_depth = max(state.max_queue_depth, chunk_queue.qsize())
+
+
+def _create_states(sinks: Sequence[StreamSink]) -> List[_SinkState]:
+    if len({sink.name for sink in sinks}) != len(sinks):
+        raise ValueError("Stream sinks must have unique names")
+    return [_SinkState(sink=sink) for sink in sinks]
+
+
+def _start_sink_threads(states: Sequence[_SinkState]) -> List[_SinkState]:
+    """Starts a queue and thread per `write` sink and returns their states."""
+    thread_states = [state for state in states if state.sink.write is not None]
+    for state in thread_states:
+        state.chunk_queue = queue.Queue(maxsize=state.sink.max_pending_chunks)
+        state.thread = threading.Thread(target=_drain_sink, args=(state,), name=f"sink-{state.sink.name}", daemon=True)
+        state.thread.start()
+    return thread_states
+
+
+def _complete(states: Sequence[_SinkState], assembly_parts: Optional[List[str]], chunk_count: int) -> FanOutResult:
+    """Joins the text once, hands it to the `on_complete` sinks and collects the stats."""
+    text = "".join(assembly_parts) if assembly_parts is not None else None
+    for state in states:
+        if state.sink.on_complete is None or state.error is not None:
+            continue
+        try:
+            state.sink.on_complete(text)
+        except Exception as error:
+            state.error = f"{type(error).__name__}: {error}"
+    return FanOutResult(
+        text=text, chunk_count=chunk_count, sink_stats={state.sink.name: state.to_stats() for state in states}
+    )
+
+
+def fan_out(chunks: Iterable[str], sinks: Sequence[StreamSink], keep_text: bool = False) -> FanOutResult:
+    """
+    Consumes `chunks` once and delivers every chunk to every sink.
+
+    Args:
+        chunks: The text stream, e.g. `generate_suggested_response(...)`.
+        sinks: Where to deliver it. Names must be unique.
+        keep_text: Return the full text even when no sink has `on_complete` (e.g. to return it from a traced function).
+
+    Returns:
+        The full text (if a sink asked for it), the chunk count and per-sink stats. A failing sink is reported in its
+        stats rather than raised; an error from the stream itself is raised after the sinks are shut down.
+
+    Raises:
+        ValueError: If two sinks share a name, or a sink is async (`awrite`; use `afan_out`).
+    """
+    states = _create_states(sinks)
+    if any(state.sink.awrite is not None for state in states):
+        raise ValueError("Async sinks (awrite) need afan_out")
+    streaming_states = _start_sink_threads(states)
+
+    # Chunks joined once at the end, only if someone wants the whole text
+    wants_text = keep_text or any(sink.on_complete is not None for sink in sinks)
+    assembly_parts: Optional[List[str]] = [] if wants_text else None
+    chunk_count = 0
+    try:
+        for chunk in chunks:
+            chunk_count += 1
+            if assembly_parts is not None:
+                assembly_parts.append(chunk)
+            for state in streaming_states:
+                if state.error is None:
+                    state.chunks += 1
+                    _deliver(state, chunk)
+    finally:
+        # Always end the sink threads, even when the stream fails part-way
+        for state in streaming_states:
+            _deliver(state, _END_OF_STREAM)
+        for state in streaming_states:
+            state.thread.join()
+
+    return _complete(states, assembly_parts, chunk_count)
+
+
+async def afan_out(chunks: AsyncIterable[str], sinks: Sequence[StreamSink], keep_text: bool = False) -> FanOutResult:
+    """
+    `fan_out` for an async stream, consumed on the running event loop. Sinks with `awrite` are served by tasks on the
+    loop, sinks with `write` by their own threads.
+
+    If the caller is cancelled, the async sinks are cancelled rather than drained (their consumer may be gone); the
+    thread sinks are still ended.
+
+    Returns:
+        As `fan_out`.
+
+    Raises:
+        ValueError: If two sinks share a name.
+    """
+    states = _create_states(sinks)
+    thread_states = _start_sink_threads(states)
+    async_states = [state for state in states if state.sink.awrite is not None]
+    for state in async_states:
+        state.async_queue = asyncio.Queue(maxsize=state.sink.max_pending_chunks)
+        state.task = asyncio.create_task(_adrain_sink(state), name=f"sink-{state.sink.name}")
+    streaming_states = thread_states + async_states
+
+    wants_text = keep_text or any(sink.on_complete is not None for sink in sinks)
+    assembly_parts: Optional[List[str]] = [] if wants_text else None
+    chunk_count = 0
+    cancelled = False
+    try:
+        async for chunk in chunks:
+            chunk_count += 1
+            if assembly_parts is not None:
+                assembly_parts.append(chunk)
+            for state in streaming_states:
+                if state.error is None:
+                    state.chunks += 1
+                    await _adeliver(state, chunk)
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    finally:
+        for state in thread_states:
+            await _adeliver(state, _END_OF_STREAM)
+        for state in async_states:
+            if cancelled:
+                state.task.cancel()
+            else:
+                await _adeliver(state, _END_OF_STREAM)
+        await asyncio.gather(*(state.task for state in async_states), return_exceptions=cancelled)
+        for state in thread_states:
+            await asyncio.to_thread(state.thread.join)
+
+    return _complete(states, assembly_parts, chunk_count)
+
+
+def stdout_sink(stream: Optional[TextIO] = None, name: str = "stdout") -> StreamSink:
+    """Prints chunks as they arrive (sys.stdout by default), flushing after each coalesced write."""
+    output = stream or sys.stdout
+    return StreamSink(name=name, write=output.write, flush=output.flush)
+
+
+def file_sink(path: str, name: str = "file") -> StreamSink:
+    """Appends chunks to a UTF-8 text file as they arrive (e.g. a response cache); the file is closed at the end."""
+    file_path = Path(path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    output = file_path.open("a", encoding="utf-8")
+    return StreamSink(name=name, write=output.write, flush=output.flush, on_complete=lambda _text: output.close())
+
+
+def span_output_sink(span: Any, name: str = "trace") -> StreamSink:
+    """Logs the full text as the output of a Braintrust span once the stream ends."""
+    return StreamSink(name=name, on_complete=lambda text: span.log(output=text))
+
+
+# Micro-benchmark: fan-out to two sinks vs the `+=` accumulation loop it replaces
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare stream fan-out against per-chunk string accumulation.")
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--chunk-chars", type=int, default=4)
+    args = parser.parse_args()
+
+    class _NullOutput:
+        """Stand-in for stdout that discards the text but counts write calls."""
+
+        def __init__(self) -> None:
+            self.write_calls = 0
+
+        def write(self, text: str) -> None:
+            self.write_calls += 1
+
+        def flush(self) -> None:
+            return
+
+    for chunk_count in args.chunks:
+        stream_chunks = ["x" * args.chunk_chars] * chunk_count
+
+        accumulating_output = _NullOutput()
+        started_at = time.perf_counter()
+        full_response = ""
+        for chunk_data in stream_chunks:
+            accumulating_output.write(chunk_data)
+            accumulating_output.flush()
+            # Keeps a second reference, as a caller that also hands the text on would
+            previous_response = full_response
+            full_response += chunk_data
+        accumulate_seconds = time.perf_counter() - started_at
+
+        fan_out_output = _NullOutput()
+        started_at = time.perf_counter()
+        result = fan_out(iter(stream_chunks), [stdout_sink(fan_out_output), StreamSink(name="log", on_complete=len)])
+        fan_out_seconds = time.perf_counter() - started_at
+        assert result.text == full_response
+
+        print(
+            f"{chunk_count:>7} chunks: += {accumulate_seconds * 1000:8.2f} ms ({accumulating_output.write_calls} writes), "
+            f"fan-out {fan_out_seconds * 1000:8.2f} ms ({fan_out_output.write_calls} coalesced writes)"
+        )
@@ -0,0 +1,389 @@
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from braintrust.logger import Dataset
+
+from pipeline_concurrency import run_blocking
+
+# <ai_context>
+# Streaming reader for Braintrust datasets, so large evals start on the first page instead of after a full download.
+# `Dataset.fetch()` in the SDK downloads every page before yielding the first row. `open_dataset_stream(dataset)` instead
+# sends the SDK's own per-page request (`datasets.post_dataset_id_fetch`, with the dataset's pinned or environment
+# version and the SDK's record normaliser) one page at a time on a background thread, handing pages over through a
+# bounded queue (DATASET_STREAM_PREFETCH_PAGES pages of DATASET_STREAM_PAGE_SIZE rows), so memory stays bounded whatever
+# the dataset size and the next pages download while rows are being processed.
+# Datasets with BTQL filters (`_internal_btql`, e.g. `braintrust eval --filter`) are read through `Dataset.fetch()` itself
+# so filters and limits match the SDK; the queue still bounds what the consumer holds, but the download is not paged.
+# `DatasetStream.rows` is a lazy iterator (the fetch thread starts on first use and stops if the iterator is closed).
+# `get_stream_stats` reports fetch throughput (rows/s, bytes/s) and stalls on both sides of the queue: consumer stalls
+# (rows wanted, page not fetched yet) mean fetching is the bottleneck; producer stalls mean the queue is full.
+# `dataset_for_eval(dataset)` is what the eval scripts pass to `Eval(data=...)`: the Dataset itself by default (keeps the
+# experiment linked to the dataset), or, with EVAL_STREAM_DATASET=1, an async row stream that also stops pulling rows
+# while more than EVAL_MAX_OUTSTANDING_ROWS rows are queued in the eval but not finished (counted by row_scheduler.py).
+# </ai_context>
+
+PAGE_SIZE_ENV_VAR = "DATASET_STREAM_PAGE_SIZE"
+PREFETCH_PAGES_ENV_VAR = "DATASET_STREAM_PREFETCH_PAGES"
+STREAM_ENABLED_ENV_VAR = "EVAL_STREAM_DATASET"
+MAX_OUTSTANDING_ROWS_ENV_VAR = "EVAL_MAX_OUTSTANDING_ROWS"
+
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_PREFETCH_PAGES = 4
+DEFAULT_MAX_OUTSTANDING_ROWS = 256
+# Same guard as the SDK's own fetch loop (MAX_BTQL_ITERATIONS)
+MAX_PAGES = 10_000
+# How often a blocked producer re-checks whether the stream was closed
+_PUT_POLL_SECONDS = 0.1
+# How often the eval row stream re-checks the outstanding row count
+_BACKPRESSURE_POLL_SECONDS = 0.05
+
+# End-of-stream marker on the page queue
+_END_OF_STREAM = object()
+
+
+@dataclass(frozen=True)
+class DatasetStream:
+    """A lazily started dataset stream: iterate `rows`; `stats` is updated by the fetch thread (see `get_stream_stats`)."""
+
+    rows: Iterator[Dict[str, Any]]
+    stats: Dict[str, float] = field(default_factory=dict)
+    stats_lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+def _get_page_size() -> int:
+    return int(os.environ.get(PAGE_SIZE_ENV_VAR, DEFAULT_PAGE_SIZE))
+
+
+def _get_prefetch_pages() -> int:
+    return int(os.environ.get(PREFETCH_PAGES_ENV_VAR, DEFAULT_PREFETCH_PAGES))
+
+
+@dataclass(frozen=True)
+class DatasetFetchOptions:
+    """What the SDK's per-page fetch (`Dataset._refetch` in braintrust 0.46) sends and applies, read once per stream."""
+
+    api_client: Any
+    dataset_id: str
+    pinned_version: Optional[str]
+    normalise_record: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]]
+
+
+def get_dataset_fetch_options(dataset: Dataset) -> Optional[DatasetFetchOptions]:
+    """
+    Resolves the dataset's login state, pinned version and record normaliser the way `init_dataset` datasets fetch.
+
+    `_get_state` also pins the version of an `environment=` dataset. Returns None when the dataset has BTQL filters
+    (`_internal_btql`, e.g. `braintrust eval --filter`) or the SDK no longer exposes these attributes: the rows then come
+    from `Dataset.fetch()` itself, so filters, limits and pinning behave exactly as in the SDK.
+    """
+    if getattr(dataset, "_internal_btql", None) or not hasattr(dataset, "_get_state"):
+        return None
+    state = dataset._get_state()
+    if not hasattr(dataset, "_pinned_version") or not hasattr(dataset, "_mutate_record"):
+        return None
+    return DatasetFetchOptions(
+        api_client=state.api_client(),
+        dataset_id=dataset.id,
+        pinned_version=dataset._pinned_version,
+        normalise_record=dataset._mutate_record,
+    )
+
+
+def fetch_dataset_page(
+    fetch_options: DatasetFetchOptions, cursor: Optional[str], page_size: int
+) -> Tuple[List[Dict[str, Any]], Optional[str], int]:
+    """
+    Fetches one page of dataset records with the request `Dataset.fetch()` makes per page (`post_dataset_id_fetch`).
+
+    Returns:
+        (records, next_cursor or None at the end, approximate response size in bytes).
+    """
+    body: Dict[str, Any] = {"limit": page_size}
+    if cursor is not None:
+        body["cursor"] = cursor
+    if fetch_options.pinned_version is not None:
+        body["version"] = fetch_options.pinned_version
+    response = fetch_options.api_client.datasets.post_dataset_id_fetch(fetch_options.dataset_id, body=body)
+    events = response.get("events")
+    if not isinstance(events, list):
+        raise ValueError(f"Expected a list in the response, got {type(events)}")
+    # The client hands back parsed JSON, so the size is the re-encoded page
+    response_bytes = len(json.dumps(events, default=str))
+    if fetch_options.normalise_record is not None:
+        events = [fetch_options.normalise_record(event) for event in events]
+    return events, response.get("cursor") or None, response_bytes
+
+
+def _sdk_fetch_pages(
+    dataset: Dataset, page_size: int
+) -> Callable[[Optional[str]], Tuple[List[Dict[str, Any]], Optional[str], int]]:
+    """
+    Page fetcher over `Dataset.fetch()`, for datasets the SDK has to fetch itself.
+
+    The SDK downloads every page before the first row, so this only bounds what the queue holds, not the download.
+    """
+    records = None
+
+    def fetch_page(cursor: Optional[str]) -> Tuple[List[Dict[str, Any]], Optional[str], int]:
+        nonlocal records
+        if records is None:
+            records = iter(dataset.fetch(batch_size=page_size))
+        page = list(islice(records, page_size))
+        # Any non-None cursor means "more may follow"; a short page is the last one
+        return page, ("more" if len(page) == page_size else None), 0
+
+    return fetch_page
+
+
+def _dataset_page_fetcher(
+    dataset: Dataset, page_size: int
+) -> Callable[[Optional[str]], Tuple[List[Dict[str, Any]], Optional[str], int]]:
+    """Picks the page fetcher on first use (resolving the options logs in, so it runs on the fetch thread)."""
+    page_fetcher = None
+
+    def fetch_page(cursor: Optional[str]) -> Tuple[List[Dict[str, Any]], Optional[str], int]:
+        nonlocal page_fetcher
+        if page_fetcher is None:
+            fetch_options = get_dataset_fetch_options(dataset)
+            if fetch_options is None:
+                page_fetcher = _sdk_fetch_pages(dataset, page_size)
+            else:
+                page_fetcher = lambda page_cursor: fetch_dataset_page(fetch_options, page_cursor, page_size)
+        return page_fetcher(cursor)
+
+    return fetch_page
+
+
+def _add_stats(stream_stats: Dict[str, float], stats_lock: threading.Lock, **increments: float) -> None:
+    with stats_lock:
+        for stat_name, increment in increments.items():
+            stream_stats[stat_name] += increment
+
+
+def _put_until_stopped(page_queue: "queue.Queue[Any]", item: Any, stop_event: threading.Event) -> bool:
+    """Blocks while the queue is full, polling so a closed stream never leaves the fetch thread stuck. False if stopped."""
+    while not stop_event.is_set():
+        try:
+            page_queue.put(item, timeout=_PUT_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _fetch_pages(
+    fetch_page: Callable[[Optional[str]], Tuple[List[Dict[str, Any]], Optional[str], int]],
+    page_queue: "queue.Queue[Any]",
+    stop_event: threading.Event,
+    stream_stats: Dict[str, float],
+    stats_lock: threading.Lock,
+) -> None:
+    """Fetch thread: pages through the dataset into the bounded queue until the end, an error, or `stop_event`."""
+    cursor: Optional[str] = None
+    try:
+        for _ in range(MAX_PAGES):
+            fetch_started_at = time.perf_counter()
+            records, cursor, response_bytes = fetch_page(cursor)
+            _add_stats(
+                stream_stats,
+                stats_lock,
+                pages=1,
+                rows_fetched=len(records),
+                bytes_fetched=response_bytes,
+                fetch_seconds=time.perf_counter() - fetch_started_at,
+            )
+
+            # Blocks while the queue is full (the consumer is slower)
+            put_started_at = time.perf_counter()
+            if not _put_until_stopped(page_queue, records, stop_event):
+                return
+            put_seconds = time.perf_counter() - put_started_at
+            if put_seconds > _PUT_POLL_SECONDS:
+                _add_stats(stream_stats, stats_lock, producer_stalls=1, producer_stall_seconds=put_seconds)
+
+            if cursor is None:
+                break
+        else:
+            raise RuntimeError(f"Dataset has more than {MAX_PAGES} pages")
+        _put_until_stopped(page_queue, _END_OF_STREAM, stop_event)
+    except BaseException as error:
+        # Hand the error to the consumer, which re-raises it
+        _put_until_stopped(page_queue, error, stop_event)
+
+
+def _iterate_rows(
+    fetch_page: Callable[[Optional[str]], Tuple[List[Dict[str, Any]], Optional[str], int]],
+    prefetch_pages: int,
+    stream_stats: Dict[str, float],
+    stats_lock: threading.Lock,
+) -> Iterator[Dict[str, Any]]:
+    """Consumer side: starts the fetch thread on first use and yields rows page by page."""
+    page_queue: "queue.Queue[Any]" = queue.Queue(maxsize=prefetch_pages)
+    stop_event = threading.Event()
+    with stats_lock:
+        stream_stats["started_at"] = time.monotonic()
+    fetch_thread = threading.Thread(
+        target=_fetch_pages,
+        args=(fetch_page, page_queue, stop_event, stream_stats, stats_lock),
+        name="dataset-prefetch",
+        daemon=True,
+    )
+    fetch_thread.start()
+
+    try:
+        while True:
+            get_started_at = time.perf_counter()
+            try:
+                page = page_queue.get_nowait()
+            except queue.Empty:
+                # The next page is not there yet: fetching is the bottleneck right now
+                page = page_queue.get()
+                _add_stats(
+                    stream_stats, stats_lock, consumer_stalls=1, consumer_stall_seconds=time.perf_counter() - get_started_at
+                )
+
+            if page is _END_OF_STREAM:
+                return
+            if isinstance(page, BaseException):
+                raise page
+            for row in page:
+                yield row
+            _add_stats(stream_stats, stats_lock, rows_yielded=len(page))
+    finally:
+        # Closed early (or finished): stop the fetch thread and release anything it is blocked on
+        stop_event.set()
+        while not page_queue.empty():
+            page_queue.get_nowait()
+
+
+def open_dataset_stream(
+    dataset: Dataset,
+    page_size: Optional[int] = None,
+    prefetch_pages: Optional[int] = None,
+    fetch_page: Optional[Callable[[Optional[str]], Tuple[List[Dict[str, Any]], Optional[str], int]]] = None,
+) -> DatasetStream:
+    """
+    Opens a streaming, prefetching reader over a Braintrust dataset.
+
+    Args:
+        dataset: Dataset from `init_dataset` (nothing is fetched until the rows are iterated).
+        page_size: Rows per fetched page. Defaults to DATASET_STREAM_PAGE_SIZE.
+        prefetch_pages: Pages fetched ahead of the consumer. Defaults to DATASET_STREAM_PREFETCH_PAGES.
+        fetch_page: Replaces the page fetch (`cursor -> (records, next_cursor, bytes)`), e.g. for offline runs.
+
+    Returns:
+        A `DatasetStream` whose `rows` holds at most `prefetch_pages` + 1 pages in memory.
+    """
+    resolved_page_size = page_size or _get_page_size()
+    page_fetcher = fetch_page or _dataset_page_fetcher(dataset, resolved_page_size)
+    stream_stats: Dict[str, float] = {
+        "started_at": 0.0,
+        "pages": 0,
+        "rows_fetched": 0,
+        "rows_yielded": 0,
+        "bytes_fetched": 0,
+        "fetch_seconds": 0.0,
+        "consumer_stalls": 0,
+        "consumer_stall_seconds": 0.0,
+        "producer_stalls": 0,
+        "producer_stall_seconds": 0.0,
+    }
+    stats_lock = threading.Lock()
+    rows = _iterate_rows(page_fetcher, prefetch_pages or _get_prefetch_pages(), stream_stats, stats_lock)
+    return DatasetStream(rows=rows, stats=stream_stats, stats_lock=stats_lock)
+
+
+def get_stream_stats(stream: DatasetStream) -> Dict[str, float]:
+    """Returns a snapshot of a stream's counters plus fetch throughput (while fetching) and wall-clock rows/s."""
+    with stream.stats_lock:
+        snapshot = dict(stream.stats)
+    elapsed_seconds = time.monotonic() - snapshot["started_at"] if snapshot["started_at"] else 0.0
+    snapshot["elapsed_seconds"] = elapsed_seconds
+    snapshot["fetch_rows_per_second"] = (
+        snapshot["rows_fetched"] / snapshot["fetch_seconds"] if snapshot["fetch_seconds"] else 0.0
+    )
+    snapshot["fetch_bytes_per_second"] = (
+        snapshot["bytes_fetched"] / snapshot["fetch_seconds"] if snapshot["fetch_seconds"] else 0.0
+    )
+    snapshot["rows_per_second"] = snapshot["rows_yielded"] / elapsed_seconds if elapsed_seconds else 0.0
+    return snapshot
+
+
+async def aiterate_eval_rows(
+    stream: DatasetStream,
+    max_outstanding_rows: Optional[int] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Async row stream for `Eval(data=...)`, which turns every row into a task as soon as it is yielded.
+
+    Rows are read off the event loop, and yielding pauses while more than `max_outstanding_rows` rows have been handed
+    to the eval but not finished, so queued eval tasks stay bounded too (finished rows are counted by `scheduled_task`).
+    """
+    # Imported here: row_scheduler only matters for the eval integration
+    from row_scheduler import get_row_stats
+
+    outstanding_limit = max_outstanding_rows or int(
+        os.environ.get(MAX_OUTSTANDING_ROWS_ENV_VAR, DEFAULT_MAX_OUTSTANDING_ROWS)
+    )
+    row_stats = get_row_stats()
+    finished_before = row_stats["rows_completed"] + row_stats["rows_failed"]
+    rows_handed_out = 0
+
+    rows = stream.rows
+    end_of_rows = object()
+    while True:
+        row = await run_blocking(next, rows, end_of_rows)
+        if row is end_of_rows:
+            return
+        # Backpressure: wait for the eval to finish rows before handing out more
+        while True:
+            row_stats = get_row_stats()
+            rows_finished = row_stats["rows_completed"] + row_stats["rows_failed"] - finished_before
+            if rows_handed_out - rows_finished < outstanding_limit:
+                break
+            await asyncio.sleep(_BACKPRESSURE_POLL_SECONDS)
+        rows_handed_out += 1
+        yield row
+
+
+def dataset_for_eval(dataset: Dataset) -> Any:
+    """
+    Returns what to pass as `Eval(data=...)`: the dataset itself, or a streaming row source when EVAL_STREAM_DATASET=1.
+
+    The streaming source does not link the experiment to the dataset in the Braintrust UI, hence opt-in.
+    """
+    if os.environ.get(STREAM_ENABLED_ENV_VAR, "").lower() not in ("1", "true", "yes", "on"):
+        return dataset
+    return lambda: aiterate_eval_rows(open_dataset_stream(dataset))
+
+
+# Stream a dataset without running anything, to measure fetch throughput and stalls
+if __name__ == "__main__":
+    import argparse
+
+    from braintrust import init_dataset
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Stream a Braintrust dataset and report fetch throughput.")
+    parser.add_argument("--project", required=True)
+    parser.add_argument("--dataset", required=True)
+    parser.add_argument("--page-size", type=int, default=None)
+    parser.add_argument("--prefetch-pages", type=int, default=None)
+    args = parser.parse_args()
+
+    stream = open_dataset_stream(
+        init_dataset(project=args.project, name=args.dataset),
+        page_size=args.page_size,
+        prefetch_pages=args.prefetch_pages,
+    )
+    for _ in stream.rows:
+        pass
+    print(json.dumps(get_stream_stats(stream), indent=2))
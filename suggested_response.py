@@ -1,10 +1,14 @@
-import braintrust
-from dotenv import load_dotenv
-from braintrust import traced, init_logger
+import time
+from typing import AsyncIterator, Dict, Optional
 # Import helper functions
-from suggested_helper_functions import value_extractor, rag_data
-
-load_dotenv()
+from suggested_helper_functions import value_extractor, rag_data, warm_up_helpers
+from invoke_cache import acached_invoke, cached_invoke
+from language_detector import select_language_locally
+from lazy_tracing import ensure_logger, warm_up
+from pipeline_metrics import record_chunk, record_stage_timings
+from pipeline_concurrency import get_executor, get_pipeline_semaphore
+from prompt_dag import Stage, arun_dag, build_dag, run_dag
+from prompt_input import build_prompt_input
 
 # <ai_context>
 # This file defines the main function `generate_suggested_response` which orchestrates calls to Braintrust prompts
@@ -12,99 +16,386 @@ load_dotenv()
 # It imports helper functions `value_extractor` and `rag_data` from `suggested_helper_functions.py` to provide necessary context.
 # Updated to be a generator function that yields streamed response chunks.
 # Refactored `run_and_print_stream` to accept individual arguments for cleaner trace logging.
+# The chain is declared as `SUGGESTED_RESPONSE_DAG` (prompt_dag.py): value_extractor -> {open-issues-handler -> rag_data,
+# language selection} -> generator. The open-issues and language-selection branches are independent, so by default they
+# run concurrently on the shared pool from `pipeline_concurrency.py`; the generator prompt starts as soon as both finish
+# and its stream is handed back unconsumed. Per-stage timings are logged on the caller's span.
+# Pass `execution_mode="serial"` or set SUGGESTED_RESPONSE_EXECUTION_MODE=serial to force the old sequential behaviour.
+# `agenerate_suggested_response` is the async counterpart: the prompt stages have async variants that await
+# `braintrust.invoke_async` (through `acached_invoke`) on the event loop, only the local stages (value_extractor,
+# rag_data) use the bounded blocking pool; the generator stream is read with `async for` and in-flight pipelines are
+# capped per event loop (ASYNC_PIPELINE_MAX_CONCURRENCY).
+# The language-selection stage first tries the local script-based detector (language_detector.py) on the guest's latest
+# message and only calls the prompt when the detector is not confident (LANGUAGE_FAST_PATH=0 always calls the prompt).
+# Brand/unit guidelines come from the per-unit config store via `value_extractor(unit_id)`, and `rag_data` searches that
+# unit's own quick replies and knowledge base.
+# Prompt inputs are built with `build_prompt_input` (prompt_input.py): the per-unit fields listed in *_STATIC_FIELDS are
+# JSON-encoded once per unit and only the per-request fields are encoded again for cache keys and size metrics.
+# All prompt calls go through `cached_invoke` (invoke_cache.py), an opt-in content-addressed cache (BRAINTRUST_INVOKE_CACHE=1).
+# Cold start: importing this module does not load the Braintrust SDK, read .env or create the logger; that happens on the
+# first suggestion (`ensure_logger` from lazy_tracing.py). Workers can call `warm_up_worker()` at startup to do it, log
+# in and build the local indexes before the first request. `python bench_startup.py --module suggested_response
+# --first-suggestion` reports import time per module and time to the first suggested-response chunk.
+# Per-stage and per-prompt latency histograms, time to first chunk and chunk gaps are recorded in pipeline_metrics.py
+# (Prometheus text via `write_metrics_file()` or `start_metrics_server()`).
+# The helpers and the example's stream span are traced with `sampled_traced` (span_export.py): sampled per span type,
+# with large inputs/outputs truncated and logged by a background exporter instead of the request thread.
+# The example consumes the stream through `fan_out` (stream_fanout.py): chunks go to stdout as they arrive and the
+# full text is joined once for the trace output, instead of `+=` per chunk.
 # </ai_context>
 
-logger = init_logger(project="suggested-response")
-
 project_name = "suggested-response"
 
-def generate_suggested_response(
-    salutation: str,
-    last_name: str,
+# Prompts the chain calls, resolved ahead of time by `warm_up_worker`
+PROMPT_SLUGS = (
+    "open-issues-handler-8ae1",
+    "language-selection-handler-1bb5",
+    "suggested-response-generator-f95c",
+)
+
+# Input fields that only change with the unit (from `value_extractor`), per prompt; the rest are set per request
+OPEN_ISSUES_STATIC_FIELDS = ("brand_customer_term", "unit_name", "unit_term")
+LANGUAGE_SELECTION_STATIC_FIELDS = ("brand_customer_term", "unit_name")
+GENERATOR_STATIC_FIELDS = (
+    "brand_communication_guidelines",
+    "brand_customer_term",
+    "brand_response_guidelines",
+    "unit_communication_guidelines",
+    "unit_name",
+    "unit_response_guidelines",
+    "unit_specific_information",
+    "unit_term",
+)
+
+def warm_up_worker(unit_id: Optional[str] = None) -> Dict[str, float]:
+    """
+    Optional startup hook: initializes the logger, logs in to Braintrust, resolves the prompt versions (when the invoke
+    cache is on), builds the helper indexes and starts the stage pool, so the first request does not pay for them.
+
+    Returns:
+        Step name -> seconds it took.
+    """
+    return warm_up(
+        project_name,
+        PROMPT_SLUGS,
+        local_setup={"helpers": lambda: warm_up_helpers(unit_id), "stage_pool": get_executor},
+    )
+
+def _run_value_extractor_stage(unit_id: Optional[str]) -> dict:
+    """Looks up the unit/brand values every prompt stage needs (a cheap cached lookup)."""
+    # Resolved at call time so the helper can be swapped (e.g. wrapped for timing by the benchmark)
+    return value_extractor(unit_id)
+
+def _open_issues_input(
+    extracted_values: dict,
     conversation: str,
     current_date_time: str,
     unit_open_issues_max_limit: str,
 ):
-    """
-    Generates a suggested response based on conversation context and predefined guidelines, yielding chunks as they arrive.
-
-    Args:
-        salutation: The salutation for the guest (e.g., "Mr.", "Ms.").
-        last_name: The last name of the guest.
-        conversation: The conversation history.
-        current_date_time: The current date and time.
-        unit_open_issues_max_limit: The time limit for open issues.
+    """Input of the open issues prompt."""
+    return build_prompt_input(
+        "open-issues-handler-8ae1",
+        extracted_values,
+        OPEN_ISSUES_STATIC_FIELDS,
+        {
+            "conversation": conversation,
+            "current_date_time": current_date_time,
+            "unit_open_issues_max_limit": unit_open_issues_max_limit,
+        },
+    )
 
-    Yields:
-        str: Chunks of the generated suggested response text.
+def _run_open_issues_stage(
+    extracted_values: dict,
+    conversation: str,
+    current_date_time: str,
+    unit_open_issues_max_limit: str,
+):
     """
+    Runs the open issues prompt.
 
-    extracted_values = value_extractor()
-
+    Returns:
+        The open issues summary (a string).
+    """
     # Prompt that generates a response based on the input of type string.
-    open_issues_response = braintrust.invoke(
+    return cached_invoke(
         project_name=project_name,
         slug="open-issues-handler-8ae1",
-        input={
-            "brand_customer_term": extracted_values["brand_customer_term"],
-            "conversation": conversation,
-            "current_date_time": current_date_time,
-            "unit_name": extracted_values["unit_name"],
-            "unit_open_issues_max_limit": unit_open_issues_max_limit,
-            "unit_term": extracted_values["unit_term"],
-        }
+        input=_open_issues_input(extracted_values, conversation, current_date_time, unit_open_issues_max_limit),
     )
 
-    rag_data_output = rag_data(open_issues_response) # Pass the response, though it's not used yet
+async def _arun_open_issues_stage(
+    extracted_values: dict,
+    conversation: str,
+    current_date_time: str,
+    unit_open_issues_max_limit: str,
+):
+    """Async `_run_open_issues_stage`."""
+    return await acached_invoke(
+        project_name=project_name,
+        slug="open-issues-handler-8ae1",
+        input=_open_issues_input(extracted_values, conversation, current_date_time, unit_open_issues_max_limit),
+    )
+
+def _run_rag_data_stage(open_issues_response, unit_id: Optional[str]) -> dict:
+    """Retrieves the unit's quick replies and knowledge base entries relevant to the open issues."""
+    return rag_data(open_issues_response, unit_id)
+
+def _language_selection_input(extracted_values: dict, conversation: str):
+    """Input of the language selection prompt."""
+    return build_prompt_input(
+        "language-selection-handler-1bb5",
+        extracted_values,
+        LANGUAGE_SELECTION_STATIC_FIELDS,
+        {"conversation": conversation},
+    )
 
+def _run_language_selection_stage(extracted_values: dict, conversation: str):
     """
-    # Prompt that generates a response based on the input that is a json object like below.
+    Runs the language selection prompt, which returns a json object like below.
 
     {
       "reason": "Guest's most recent message is in English.",
       "language": "English"
     }
+
+    When the script of the guest's latest message makes the language obvious, the local detector answers in the same
+    shape and the prompt is skipped.
     """
-    language_selection_response = braintrust.invoke(
+    local_response = select_language_locally(conversation, extracted_values["brand_customer_term"])
+    if local_response is not None:
+        return local_response
+
+    return cached_invoke(
         project_name=project_name,
         slug="language-selection-handler-1bb5",
-        input={
-            "brand_customer_term": extracted_values["brand_customer_term"],
-            "conversation": conversation,
-            "unit_name": extracted_values["unit_name"],
-        }
+        input=_language_selection_input(extracted_values, conversation),
     )
 
-    # Prompt that generates a suggested response based on the input of type string.
-    generated_response = braintrust.invoke(
+async def _arun_language_selection_stage(extracted_values: dict, conversation: str):
+    """Async `_run_language_selection_stage` (the local detector is cheap, so it runs on the event loop)."""
+    local_response = select_language_locally(conversation, extracted_values["brand_customer_term"])
+    if local_response is not None:
+        return local_response
+
+    return await acached_invoke(
         project_name=project_name,
-        slug="suggested-response-generator-f95c",
-        input={
-            "brand_communication_guidelines": extracted_values["brand_communication_guidelines"],
-            "brand_customer_term": extracted_values["brand_customer_term"],
-            "brand_response_guidelines": extracted_values["brand_response_guidelines"],
+        slug="language-selection-handler-1bb5",
+        input=_language_selection_input(extracted_values, conversation),
+    )
+
+def _generator_input(
+    salutation: str,
+    last_name: str,
+    conversation: str,
+    current_date_time: str,
+    extracted_values: dict,
+    open_issues_response,
+    rag_data_output: dict,
+    language_selection_response: dict,
+):
+    """
+    Input of the generator prompt. The unit's guidelines and terms are encoded once per unit (prompt_input.py); only the
+    fields below change per request.
+    """
+    return build_prompt_input(
+        "suggested-response-generator-f95c",
+        extracted_values,
+        GENERATOR_STATIC_FIELDS,
+        {
             "conversation": conversation,
-            "current_date_time": current_date_time, # Use function input
+            "current_date_time": current_date_time,
             "knowledge_base": rag_data_output["knowledge_base"],
             "language": language_selection_response['language'], # Assuming language is in the language field
-            "last_name": last_name, # Use function input
-            "open_issues": open_issues_response, # The output is just a string. 
+            "last_name": last_name,
+            "open_issues": open_issues_response, # The output is just a string.
             "quick_replies": rag_data_output["quick_replies"],
-            "salutation": salutation, # Use function input
-            "unit_communication_guidelines": extracted_values["unit_communication_guidelines"],
-            "unit_name": extracted_values["unit_name"],
-            "unit_response_guidelines": extracted_values["unit_response_guidelines"],
-            "unit_specific_information": extracted_values["unit_specific_information"],
-            "unit_term": extracted_values["unit_term"]
+            "salutation": salutation,
         },
+    )
+
+def _invoke_generator_stage(**stage_inputs):
+    """
+    Starts the streamed generator prompt once the earlier stages have resolved.
+
+    Args:
+        **stage_inputs: The `_generator_input` arguments (the stage's inputs).
+
+    Returns:
+        The streaming response from `cached_invoke`; iterate it for chunks.
+    """
+    # Prompt that generates a suggested response based on the input of type string.
+    return cached_invoke(
+        project_name=project_name,
+        slug="suggested-response-generator-f95c",
+        input=_generator_input(**stage_inputs),
         stream=True
     )
 
+async def _ainvoke_generator_stage(**stage_inputs):
+    """Async `_invoke_generator_stage`; iterate the returned stream with `async for`."""
+    return await acached_invoke(
+        project_name=project_name,
+        slug="suggested-response-generator-f95c",
+        input=_generator_input(**stage_inputs),
+        stream=True
+    )
+
+# The suggested-response chain. Stage inputs name either run inputs or earlier stage outputs.
+SUGGESTED_RESPONSE_DAG = build_dag([
+    Stage(
+        name="value_extractor",
+        fn=_run_value_extractor_stage,
+        inputs=("unit_id",),
+        outputs=("extracted_values",),
+        inline=True,
+    ),
+    Stage(
+        name="open_issues",
+        fn=_run_open_issues_stage,
+        inputs=("extracted_values", "conversation", "current_date_time", "unit_open_issues_max_limit"),
+        outputs=("open_issues_response",),
+        afn=_arun_open_issues_stage,
+    ),
+    Stage(
+        name="rag_data",
+        fn=_run_rag_data_stage,
+        inputs=("open_issues_response", "unit_id"),
+        outputs=("rag_data_output",),
+    ),
+    Stage(
+        name="language_selection",
+        fn=_run_language_selection_stage,
+        inputs=("extracted_values", "conversation"),
+        outputs=("language_selection_response",),
+        afn=_arun_language_selection_stage,
+    ),
+    Stage(
+        name="generator",
+        fn=_invoke_generator_stage,
+        inputs=(
+            "salutation",
+            "last_name",
+            "conversation",
+            "current_date_time",
+            "extracted_values",
+            "open_issues_response",
+            "rag_data_output",
+            "language_selection_response",
+        ),
+        outputs=("generated_response",),
+        streams=True,
+        afn=_ainvoke_generator_stage,
+    ),
+])
+
+def generate_suggested_response(
+    salutation: str,
+    last_name: str,
+    conversation: str,
+    current_date_time: str,
+    unit_open_issues_max_limit: str,
+    execution_mode: Optional[str] = None,
+    unit_id: Optional[str] = None,
+):
+    """
+    Generates a suggested response based on conversation context and predefined guidelines, yielding chunks as they arrive.
+
+    Args:
+        salutation: The salutation for the guest (e.g., "Mr.", "Ms.").
+        last_name: The last name of the guest.
+        conversation: The conversation history.
+        current_date_time: The current date and time.
+        unit_open_issues_max_limit: The time limit for open issues.
+        execution_mode: "concurrent" or "serial". Defaults to SUGGESTED_RESPONSE_EXECUTION_MODE, then "concurrent".
+        unit_id: The unit whose guidelines and retrieval sources to use (see config/units). Defaults to DEFAULT_UNIT_ID.
+
+    Yields:
+        str: Chunks of the generated suggested response text.
+    """
+
+    # Time to first chunk is measured from here (pipeline_metrics.py)
+    started_at = time.perf_counter()
+    # Set up Braintrust logging on the first suggestion (no-op afterwards)
+    ensure_logger(project_name)
+
+    # Run the chain up to the opened generator stream; independent stages overlap unless execution_mode is "serial"
+    dag_result = run_dag(
+        SUGGESTED_RESPONSE_DAG,
+        {
+            "salutation": salutation,
+            "last_name": last_name,
+            "conversation": conversation,
+            "current_date_time": current_date_time,
+            "unit_open_issues_max_limit": unit_open_issues_max_limit,
+            "unit_id": unit_id,
+        },
+        execution_mode=execution_mode,
+    )
+
+    record_stage_timings(dag_result.timings)
+
     # Yield each chunk's data as it arrives
-    for chunk in generated_response:
+    last_chunk_at = None
+    for chunk in dag_result.values["generated_response"]:
         if chunk.data:
+            last_chunk_at = record_chunk(started_at, last_chunk_at)
             yield chunk.data # Yield the text data from the chunk
 
+async def agenerate_suggested_response(
+    salutation: str,
+    last_name: str,
+    conversation: str,
+    current_date_time: str,
+    unit_open_issues_max_limit: str,
+    unit_id: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Async counterpart of `generate_suggested_response`, yielding chunks as an async iterator.
+
+    The prompt stages await `braintrust.invoke_async` and the generator stream is read with `async for`; only the local
+    stages run on the bounded blocking pool from `pipeline_concurrency`. The event loop itself never blocks, and the
+    number of in-flight pipelines per loop is capped by ASYNC_PIPELINE_MAX_CONCURRENCY; extra pipelines wait without
+    holding a thread.
+    The SDK runs its async calls on the loop's default executor; the app owning the loop should call
+    `pipeline_concurrency.configure_loop()` once at startup to size it for concurrent prompt calls.
+
+    Args:
+        salutation: The salutation for the guest (e.g., "Mr.", "Ms.").
+        last_name: The last name of the guest.
+        conversation: The conversation history.
+        current_date_time: The current date and time.
+        unit_open_issues_max_limit: The time limit for open issues.
+        unit_id: The unit whose guidelines and retrieval sources to use (see config/units). Defaults to DEFAULT_UNIT_ID.
+
+    Yields:
+        str: Chunks of the generated suggested response text.
+    """
+    started_at = time.perf_counter()
+    ensure_logger(project_name)
+
+    # Hold a slot for the whole pipeline, including streaming, so the bound covers every in-flight suggestion
+    async with get_pipeline_semaphore():
+        dag_result = await arun_dag(
+            SUGGESTED_RESPONSE_DAG,
+            {
+                "salutation": salutation,
+                "last_name": last_name,
+                "conversation": conversation,
+                "current_date_time": current_date_time,
+                "unit_open_issues_max_limit": unit_open_issues_max_limit,
+                "unit_id": unit_id,
+            },
+        )
+
+        record_stage_timings(dag_result.timings)
+
+        # The SDK stream reads each chunk off the event loop
+        last_chunk_at = None
+        async for chunk in dag_result.values["generated_response"]:
+            if chunk.data:
+                last_chunk_at = record_chunk(started_at, last_chunk_at)
+                yield chunk.data
+
 # Example usage with dummy data
 if __name__ == "__main__":
     dummy_data = {
@@ -132,8 +423,14 @@ if __name__ == "__main__":
         "unit_open_issues_max_limit": "4 hours"
     }
 
+    from span_export import flush_span_export, sampled_traced
+    from stream_fanout import fan_out, stdout_sink
+
+    # The stream span below is the root of the trace, so the logger has to exist before it starts
+    ensure_logger(project_name)
+
     # Wrap the generator consumption in a traced function
-    @traced(type="task", name="suggested response stream", metadata={"description": "Generate a suggested response based on conversation context and predefined guidelines."})
+    @sampled_traced(type="task", name="suggested response stream", metadata={"description": "Generate a suggested response based on conversation context and predefined guidelines."})
     def run_and_print_stream(
         salutation: str,
         last_name: str,
@@ -150,16 +447,12 @@ if __name__ == "__main__":
             unit_open_issues_max_limit=unit_open_issues_max_limit
         )
 
-        # Print the streamed output chunk by chunk as yielded by the generator
+        # Print the streamed output as it arrives; the full text is assembled once, at the end, for the trace output
         print("Streaming suggested response:")
-        full_response_for_log = ""
-        for chunk_data in suggested_response_generator: # Iterate over the generator
-            print(chunk_data, end="", flush=True) # Print each chunk without newline, flush immediately
-            full_response_for_log += chunk_data
+        fan_out_result = fan_out(suggested_response_generator, [stdout_sink()], keep_text=True)
         print() # Print a final newline
         # Return the full response so it's logged in the trace output
-        # return {"final_streamed_output": full_response_for_log}
-        return full_response_for_log
+        return fan_out_result.text
 
     # Execute the traced function
     run_and_print_stream(
@@ -168,4 +461,6 @@ if __name__ == "__main__":
         conversation=dummy_data["conversation"],
         current_date_time=dummy_data["current_date_time"],
         unit_open_issues_max_limit=dummy_data["unit_open_issues_max_limit"]
-    )
\ No newline at end of file
+    )
+    # Log the queued span payloads before the SDK's exit flush
+    flush_span_export()
@@ -0,0 +1,248 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+import suggested_response
+from lazy_tracing import disable_logging
+from pipeline_concurrency import configure_loop, run_blocking, shutdown_executors
+from pipeline_metrics import render_prometheus
+from span_export import flush_span_export, sampled_span
+from stream_fanout import FanOutResult, StreamSink, afan_out, span_output_sink
+
+# <ai_context>
+# Long-running HTTP service around `agenerate_suggested_response`, so suggestions stop paying process start, .env loading
+# and logger/SDK setup per request.
+# POST /v1/suggestions streams the suggestion as Server-Sent Events: `data: {"text": ...}` events, then an
+# `event: done` event (chunk count) or an `event: error` event (the status is already 200 once streaming has started).
+# The stream goes through `afan_out` (stream_fanout.py) to per-request sinks: the SSE sink, which queues events for the
+# response (chunks that arrive while the client is slow are coalesced into one event; a full queue holds up the
+# pipeline), and, when the request is sampled (`sampled_span`, type "task"), a trace sink logging the full text as the
+# output of the request's span, under which the pipeline's own spans nest.
+# GET /healthz reports in-flight suggestions; GET /metrics serves pipeline_metrics.py in the Prometheus text format.
+# Lifespan: startup sizes the loop's default executor for the SDK's async calls (`configure_loop`), runs `warm_up_worker` for each unit in SUGGESTION_SERVER_WARM_UNITS (logger + login, so the SDK's
+# pooled HTTPS connection is open, prompt versions, unit config, quick-reply and knowledge base indexes), which then stay
+# hot for the life of the process. Shutdown (uvicorn first stops accepting and lets open streams finish, up to
+# SUGGESTION_SERVER_SHUTDOWN_GRACE_SECONDS) flushes queued span payloads and the Braintrust logger, then stops the pools.
+# End-to-end testing without Braintrust: `--stub-backend` answers prompts from the synthetic backend of
+# bench_suggested_response.py, or set PROMPT_CASSETTE to replay a recorded cassette (prompt_cassette.py). Either one
+# also turns Braintrust logging off (lazy_tracing.disable_logging), so startup skips the logger and login warm-up steps
+# and nothing is sent. tests/test_suggestion_server.py drives the app this way with FastAPI's TestClient.
+# Usage: python suggestion_server.py --port 8000 [--stub-backend]
+# </ai_context>
+
+HOST_ENV_VAR = "SUGGESTION_SERVER_HOST"
+PORT_ENV_VAR = "SUGGESTION_SERVER_PORT"
+WARM_UNITS_ENV_VAR = "SUGGESTION_SERVER_WARM_UNITS"
+SHUTDOWN_GRACE_ENV_VAR = "SUGGESTION_SERVER_SHUTDOWN_GRACE_SECONDS"
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+DEFAULT_SHUTDOWN_GRACE_SECONDS = 30.0
+# SSE events queued for a client before the pipeline waits for it
+SSE_MAX_PENDING_EVENTS = 64
+
+# Queued after the last SSE event of a suggestion
+_END_OF_EVENTS = object()
+
+# Suggestions currently streaming; only touched from the event loop thread
+_in_flight_suggestions = 0
+
+
+class SuggestionRequest(BaseModel):
+    """Body of POST /v1/suggestions: the `generate_suggested_response` arguments."""
+
+    salutation: str
+    last_name: str
+    conversation: str
+    current_date_time: str
+    unit_open_issues_max_limit: str
+    unit_id: Optional[str] = None
+
+
+def _format_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Formats one SSE event; the payload is JSON so newlines in chunks cannot break the framing."""
+    event_line = f"event: {event}\n" if event else ""
+    return f"{event_line}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _sse_sink(events: "asyncio.Queue[Any]") -> StreamSink:
+    """Turns (coalesced) chunks into SSE events on the response's queue."""
+
+    async def write_event(text: str) -> None:
+        await events.put(_format_event({"text": text}))
+
+    return StreamSink(name="sse", awrite=write_event)
+
+
+async def _fan_out_suggestion(
+    request: SuggestionRequest, sinks: List[StreamSink], events: "asyncio.Queue[Any]"
+) -> FanOutResult:
+    """Runs the pipeline into the sinks, then marks the end of the SSE events (also after a pipeline error)."""
+    try:
+        result = await afan_out(suggested_response.agenerate_suggested_response(**request.model_dump()), sinks)
+    except asyncio.CancelledError:
+        # The client is gone; nobody reads the events any more
+        raise
+    except Exception:
+        await events.put(_END_OF_EVENTS)
+        raise
+    await events.put(_END_OF_EVENTS)
+    return result
+
+
+async def _stream_suggestion(request: SuggestionRequest) -> AsyncIterator[str]:
+    """Streams one suggestion as SSE events."""
+    global _in_flight_suggestions
+    _in_flight_suggestions += 1
+    event_count = 0
+    try:
+        with sampled_span(type="task", name="suggestion request", span_input=request.model_dump()) as span:
+            events: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=SSE_MAX_PENDING_EVENTS)
+            sinks = [_sse_sink(events)]
+            if span is not None:
+                sinks.append(span_output_sink(span))
+            # A task of its own, so the pipeline keeps producing while the response waits on the client; it inherits
+            # the request span as its parent
+            fan_out_task = asyncio.create_task(_fan_out_suggestion(request, sinks, events))
+            try:
+                while True:
+                    event = await events.get()
+                    if event is _END_OF_EVENTS:
+                        break
+                    event_count += 1
+                    yield event
+                result = await fan_out_task
+            finally:
+                # Stops the pipeline if the client disconnected mid-stream
+                fan_out_task.cancel()
+        yield _format_event({"chunks": result.chunk_count}, event="done")
+    except Exception as error:
+        # Headers are already sent, so the failure is reported in-band
+        print(f"Suggestion failed after {event_count} events: {error!r}", file=sys.stderr)
+        yield _format_event({"error": f"{type(error).__name__}: {error}"}, event="error")
+    finally:
+        _in_flight_suggestions -= 1
+
+
+def _get_warm_units() -> List[Optional[str]]:
+    """Units to warm up at startup: SUGGESTION_SERVER_WARM_UNITS (comma-separated), else just the default unit."""
+    unit_ids = [unit_id.strip() for unit_id in os.environ.get(WARM_UNITS_ENV_VAR, "").split(",") if unit_id.strip()]
+    return unit_ids or [None]
+
+
+def _shut_down_pipeline() -> None:
+    """Flushes traces and stops the pools; each step is best effort so one failure does not skip the rest."""
+    flush_span_export()
+    try:
+        import braintrust
+
+        braintrust.flush()
+    except Exception as error:
+        print(f"Braintrust flush failed: {error}", file=sys.stderr)
+    shutdown_executors(wait=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Warms the worker before the first request and flushes/stops it after the last one."""
+    from prompt_cassette import CASSETTE_MODE_ENV_VAR, install_from_env
+
+    # The server owns the loop: size its default executor for the SDK's async prompt calls
+    configure_loop()
+    # Replay a recorded prompt backend when PROMPT_CASSETTE is set
+    cassette = install_from_env()
+    # A replayed backend is offline; recording still calls (and may log to) Braintrust
+    if cassette is not None and os.environ.get(CASSETTE_MODE_ENV_VAR, "replay") == "replay":
+        disable_logging()
+    for unit_id in _get_warm_units():
+        step_seconds = await run_blocking(suggested_response.warm_up_worker, unit_id)
+        print(
+            f"Warmed up unit {unit_id or 'default'}: "
+            + ", ".join(f"{step} {seconds * 1000:.0f} ms" for step, seconds in step_seconds.items()),
+            file=sys.stderr,
+        )
+    try:
+        yield
+    finally:
+        # Runs after uvicorn has closed the remaining connections; the pools are idle by now
+        await asyncio.get_running_loop().run_in_executor(None, _shut_down_pipeline)
+        if cassette is not None:
+            cassette.__exit__(None, None, None)
+
+
+app = FastAPI(title="Suggested response server", lifespan=lifespan)
+
+
+@app.post("/v1/suggestions")
+async def create_suggestion(request: SuggestionRequest) -> StreamingResponse:
+    """Streams a suggested response as Server-Sent Events."""
+    return StreamingResponse(
+        _stream_suggestion(request),
+        media_type="text/event-stream",
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/healthz")
+async def healthz() -> Dict[str, Any]:
+    """Liveness plus the number of suggestions currently streaming."""
+    return {"status": "ok", "in_flight": _in_flight_suggestions}
+
+
+@app.get("/metrics")
+async def metrics() -> PlainTextResponse:
+    """Pipeline metrics in the Prometheus text format."""
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+def install_stub_backend(invoke_latency_s: float, chunk_interval_s: float, chunk_count: int) -> None:
+    """
+    Replaces `braintrust.invoke` / `braintrust.invoke_async` with the synthetic backend of bench_suggested_response.py
+    and turns Braintrust logging off, so nothing (not even the startup warm-up) touches the network.
+    """
+    import braintrust
+
+    from bench_suggested_response import make_synthetic_invoke
+    from prompt_cassette import make_async_invoke
+
+    disable_logging()
+
+    braintrust.invoke = make_synthetic_invoke(
+        invoke_latency_s=invoke_latency_s,
+        first_chunk_latency_s=invoke_latency_s,
+        chunk_interval_s=chunk_interval_s,
+        chunk_count=chunk_count,
+    )
+    braintrust.invoke_async = make_async_invoke(braintrust.invoke)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve suggested responses over HTTP with SSE streaming.")
+    parser.add_argument("--host", default=os.environ.get(HOST_ENV_VAR, DEFAULT_HOST))
+    parser.add_argument("--port", type=int, default=int(os.environ.get(PORT_ENV_VAR, DEFAULT_PORT)))
+    parser.add_argument(
+        "--shutdown-grace",
+        type=float,
+        default=float(os.environ.get(SHUTDOWN_GRACE_ENV_VAR, DEFAULT_SHUTDOWN_GRACE_SECONDS)),
+        help="Seconds open streams get to finish on shutdown",
+    )
+    parser.add_argument("--stub-backend", action="store_true", help="Answer prompts from a local synthetic backend")
+    parser.add_argument("--stub-latency", type=float, default=0.2, help="Stub: seconds per prompt call / to first chunk")
+    parser.add_argument("--stub-chunk-interval", type=float, default=0.02, help="Stub: seconds between streamed chunks")
+    parser.add_argument("--stub-chunks", type=int, default=20, help="Stub: chunks per streamed response")
+    args = parser.parse_args()
+
+    if args.stub_backend:
+        install_stub_backend(args.stub_latency, args.stub_chunk_interval, args.stub_chunks)
+    uvicorn.run(app, host=args.host, port=args.port, timeout_graceful_shutdown=args.shutdown_grace)
@@ -0,0 +1,42 @@
+import os
+
+import braintrust
+import pytest
+
+import batch_suggestions
+import suggested_response
+from prompt_cassette import CASSETTE_MODE_ENV_VAR, CASSETTE_PATH_ENV_VAR, load_cassette, merge_worker_cassettes
+
+# <ai_context>
+# Recording a cassette from a process pool: each worker must record into its own part file (saved by `close_worker`,
+# which the worker registers to run at exit), and the parts must merge into the cassette without losing recordings.
+# </ai_context>
+
+
+@pytest.fixture
+def recording_worker(tmp_path, monkeypatch):
+    """A worker set up for PROMPT_CASSETTE_MODE=record against a fake prompt backend."""
+    cassette_path = str(tmp_path / "suggested.json")
+    monkeypatch.setenv(CASSETTE_PATH_ENV_VAR, cassette_path)
+    monkeypatch.setenv(CASSETTE_MODE_ENV_VAR, "record")
+    monkeypatch.setattr(braintrust, "invoke", lambda **invoke_kwargs: {"slug": invoke_kwargs["slug"]})
+    monkeypatch.setattr(braintrust, "invoke_async", braintrust.invoke_async)
+    monkeypatch.setattr(suggested_response, "warm_up_worker", lambda unit_id=None: {})
+    yield cassette_path
+    batch_suggestions.close_worker()
+
+
+def test_process_workers_record_into_parts_that_merge(recording_worker):
+    cassette_path = recording_worker
+    batch_suggestions.init_worker(process_worker=True)
+    braintrust.invoke(project_name="suggested-response", slug="open-issues-handler-8ae1", input={}, stream=False)
+    # What the worker's exit handler runs
+    batch_suggestions.close_worker()
+
+    part_path = f"{cassette_path}.worker-{os.getpid()}"
+    assert os.path.exists(part_path)
+    assert not os.path.exists(cassette_path)
+
+    assert merge_worker_cassettes(cassette_path) == 1
+    assert [interaction["slug"] for interaction in load_cassette(cassette_path)] == ["open-issues-handler-8ae1"]
+    assert not os.path.exists(part_path)
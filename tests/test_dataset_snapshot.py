@@ -0,0 +1,49 @@
+from pathlib import Path
+
+from braintrust import Eval, EvalCase
+
+from dataset_snapshot import iterate_eval_cases, open_snapshot, write_snapshot
+
+# <ai_context>
+# Snapshot rows fed to a real `Eval` (no logs sent): every row must run, and each case must carry the dataset origin.
+# </ai_context>
+
+DATASET_ID = "00000000-0000-0000-0000-00000000da7a"
+ROWS = [
+    {"id": f"row-{index}", "_xact_id": f"100000000000000{index}", "input": {"n": index}, "expected": index * 2}
+    for index in range(3)
+]
+
+
+def _write_small_snapshot(tmp_path: Path) -> Path:
+    snapshot_path = tmp_path / "snapshot.snap"
+    write_snapshot(iter(ROWS), snapshot_path, {"project": "p", "dataset": "d", "dataset_id": DATASET_ID})
+    return snapshot_path
+
+
+def test_eval_cases_carry_dataset_origin(tmp_path: Path) -> None:
+    cases = list(iterate_eval_cases(open_snapshot(_write_small_snapshot(tmp_path))))
+
+    assert all(isinstance(case, EvalCase) for case in cases)
+    assert [case.input for case in cases] == [row["input"] for row in ROWS]
+    assert cases[0].origin == {
+        "object_type": "dataset",
+        "object_id": DATASET_ID,
+        "id": "row-0",
+        "_xact_id": "1000000000000000",
+    }
+
+
+def test_eval_runs_every_snapshot_row(tmp_path: Path) -> None:
+    snapshot_path = _write_small_snapshot(tmp_path)
+
+    result = Eval(
+        "dataset-snapshot-test",
+        data=lambda: iterate_eval_cases(open_snapshot(snapshot_path)),
+        task=lambda input: input["n"] * 2,
+        scores=[lambda input, output, expected: float(output == expected)],
+        no_send_logs=True,
+    )
+
+    assert [eval_result.error for eval_result in result.results] == [None] * len(ROWS)
+    assert sorted(eval_result.output for eval_result in result.results) == [0, 2, 4]
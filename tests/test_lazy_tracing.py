@@ -0,0 +1,20 @@
+import dotenv
+
+import lazy_tracing
+from lazy_tracing import ensure_logger
+
+# <ai_context>
+# .env holds the API keys the prompt and tool calls need, so it must be loaded on the first pipeline call even when
+# Braintrust logging is off (BRAINTRUST_LOGGING=0), and only once.
+# </ai_context>
+
+
+def test_env_is_loaded_once_with_logging_disabled(monkeypatch):
+    load_calls = []
+    monkeypatch.setattr(dotenv, "load_dotenv", lambda *args, **kwargs: load_calls.append(args))
+    monkeypatch.setattr(lazy_tracing, "_env_loaded", False)
+    monkeypatch.setenv(lazy_tracing.LOGGING_ENV_VAR, "0")
+
+    assert ensure_logger("suggested-response") is None
+    assert ensure_logger("suggested-response") is None
+    assert len(load_calls) == 1
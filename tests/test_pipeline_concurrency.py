@@ -0,0 +1,33 @@
+import asyncio
+import threading
+
+from pipeline_concurrency import configure_loop, get_pipeline_semaphore
+
+# <ai_context>
+# Getting the pipeline semaphore must leave the caller's loop alone; only the explicit `configure_loop` replaces the
+# loop's default executor (where the SDK's async calls run), and only once per loop.
+# </ai_context>
+
+
+async def _default_executor_thread_name() -> str:
+    return await asyncio.to_thread(lambda: threading.current_thread().name)
+
+
+def test_semaphore_does_not_replace_the_default_executor():
+    async def main() -> str:
+        get_pipeline_semaphore()
+        return await _default_executor_thread_name()
+
+    assert not asyncio.run(main()).startswith("pipeline-sdk")
+
+
+def test_configure_loop_sets_the_default_executor_once():
+    async def main() -> str:
+        configure_loop()
+        first_executor_thread = await _default_executor_thread_name()
+        # A second call keeps the executor (and its threads) configured by the first
+        configure_loop()
+        assert await _default_executor_thread_name() == first_executor_thread
+        return first_executor_thread
+
+    assert asyncio.run(main()).startswith("pipeline-sdk")
@@ -0,0 +1,60 @@
+import pytest
+
+import row_scheduler
+from row_scheduler import batch_retries, call_with_rate_limit, reset_row_stats
+
+# <ai_context>
+# Throttling retries: a live (default) call gets the small interactive budget, eval/batch work the patient one.
+# </ai_context>
+
+
+class _Throttled(Exception):
+    """Stands in for a provider 429."""
+
+    def __init__(self, retry_after: str = "") -> None:
+        super().__init__("Too Many Requests")
+        self.response = type("Response", (), {"status_code": 429, "headers": {"Retry-After": retry_after}})()
+
+
+@pytest.fixture(autouse=True)
+def _no_sleep(monkeypatch):
+    monkeypatch.setattr(row_scheduler.time, "sleep", lambda seconds: None)
+    reset_row_stats()
+    yield
+    reset_row_stats()
+
+
+def _always_throttled(calls):
+    def call():
+        calls.append(1)
+        raise _Throttled()
+
+    return call
+
+
+def test_interactive_calls_retry_once():
+    calls = []
+    with pytest.raises(_Throttled):
+        call_with_rate_limit("slug", _always_throttled(calls))
+    assert len(calls) == 1 + row_scheduler.DEFAULT_INTERACTIVE_MAX_RETRIES
+
+
+def test_interactive_calls_do_not_wait_out_long_retry_after():
+    calls = []
+
+    def call():
+        calls.append(1)
+        raise _Throttled(retry_after="20")
+
+    with pytest.raises(_Throttled):
+        call_with_rate_limit("slug", call)
+    assert len(calls) == 1
+
+
+def test_batch_calls_use_the_eval_budget():
+    calls = []
+    with batch_retries(), pytest.raises(_Throttled):
+        call_with_rate_limit("slug", _always_throttled(calls))
+    assert len(calls) == 1 + row_scheduler.DEFAULT_MAX_RETRIES
+    # The policy only applies inside the block
+    assert row_scheduler.get_retry_policy() is row_scheduler.INTERACTIVE_RETRY_POLICY
@@ -0,0 +1,66 @@
+import asyncio
+import threading
+
+import pytest
+
+from stream_fanout import StreamSink, afan_out, fan_out
+
+# <ai_context>
+# `afan_out`: async (`awrite`) and thread (`write`) sinks both receive every chunk of an async stream, in order, and the
+# full text reaches `on_complete`; cancelling the caller does not hang on an async sink whose consumer is gone.
+# </ai_context>
+
+CHUNKS = [f"chunk{index} " for index in range(50)]
+
+
+async def _stream(chunks):
+    for chunk in chunks:
+        await asyncio.sleep(0)
+        yield chunk
+
+
+def test_async_and_thread_sinks_receive_the_whole_stream():
+    async_writes = []
+    thread_writes = []
+    completed = []
+
+    async def awrite(text):
+        async_writes.append(text)
+
+    sinks = [
+        StreamSink(name="async", awrite=awrite),
+        StreamSink(name="thread", write=thread_writes.append, on_complete=completed.append),
+    ]
+    result = asyncio.run(afan_out(_stream(CHUNKS), sinks))
+
+    assert "".join(async_writes) == "".join(thread_writes) == "".join(CHUNKS)
+    assert completed == ["".join(CHUNKS)]
+    assert result.chunk_count == len(CHUNKS)
+    assert result.sink_stats["async"].chunks == result.sink_stats["thread"].chunks == len(CHUNKS)
+
+
+def test_cancelling_does_not_wait_for_a_blocked_async_sink():
+    async def main():
+        # The client behind this sink went away: its writes never finish
+        consumer_gone = asyncio.Event()
+
+        async def blocked_write(text):
+            await consumer_gone.wait()
+
+        sinks = [StreamSink(name="blocked", awrite=blocked_write, max_pending_chunks=1)]
+        task = asyncio.create_task(afan_out(_stream(CHUNKS), sinks))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(task, timeout=1.0)
+
+    asyncio.run(main())
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith("sink-")]
+
+
+def test_sync_fan_out_rejects_async_sinks():
+    async def awrite(text):
+        return None
+
+    with pytest.raises(ValueError):
+        fan_out(iter(CHUNKS), [StreamSink(name="async", awrite=awrite)])
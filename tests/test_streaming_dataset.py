@@ -0,0 +1,75 @@
+from typing import Any, Dict, List
+
+from braintrust.logger import Dataset, ObjectMetadata, ProjectDatasetMetadata
+from braintrust.util import LazyValue
+
+from streaming_dataset import open_dataset_stream
+
+# <ai_context>
+# Streams an offline `Dataset` (fake API client, no login): pages must use the SDK's fetch request with the pinned
+# version and come out normalised like `Dataset.fetch()`; filtered datasets must go through `Dataset.fetch()` itself.
+# </ai_context>
+
+DATASET_ID = "00000000-0000-0000-0000-00000000da7a"
+EVENTS = [{"id": f"row-{index}", "input": {"n": index}, "expected": index * 2} for index in range(5)]
+
+
+class _FakeDatasetsApi:
+    def __init__(self) -> None:
+        self.requests: List[Dict[str, Any]] = []
+
+    def post_dataset_id_fetch(self, dataset_id: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        assert dataset_id == DATASET_ID
+        self.requests.append(body)
+        start = int(body.get("cursor", 0))
+        end = start + body["limit"]
+        return {"events": EVENTS[start:end], "cursor": str(end) if end < len(EVENTS) else None}
+
+
+class _FakeState:
+    def __init__(self) -> None:
+        self.datasets = _FakeDatasetsApi()
+
+    def api_client(self) -> "_FakeState":
+        return self
+
+
+def _offline_dataset(**dataset_kwargs: Any) -> Dataset:
+    metadata = ProjectDatasetMetadata(
+        project=ObjectMetadata(id="p", name="project", full_info={}),
+        dataset=ObjectMetadata(id=DATASET_ID, name="dataset", full_info={}),
+    )
+    return Dataset(LazyValue(lambda: metadata, use_mutex=True), state=_FakeState(), **dataset_kwargs)
+
+
+def test_stream_pages_through_sdk_fetch_with_pinned_version() -> None:
+    dataset = _offline_dataset(version=123, legacy=True)
+
+    rows = list(open_dataset_stream(dataset, page_size=2, prefetch_pages=1).rows)
+
+    assert [row["id"] for row in rows] == [event["id"] for event in EVENTS]
+    # Normalised like `Dataset.fetch()`: a legacy dataset renames expected to output
+    assert rows[1]["output"] == 2 and "expected" not in rows[1]
+    assert dataset.state.datasets.requests == [
+        {"limit": 2, "version": "123"},
+        {"limit": 2, "cursor": "2", "version": "123"},
+        {"limit": 2, "cursor": "4", "version": "123"},
+    ]
+
+
+def test_filtered_dataset_reads_through_sdk_fetch() -> None:
+    dataset = _offline_dataset(_internal_btql={"filter": {"op": "literal", "value": True}})
+    filtered_rows = [{"id": "row-1", "input": {"n": 1}, "expected": 2}]
+    fetch_calls = []
+
+    def fake_fetch(batch_size: int = None):
+        fetch_calls.append(batch_size)
+        return iter(filtered_rows)
+
+    dataset.fetch = fake_fetch
+
+    rows = list(open_dataset_stream(dataset, page_size=2).rows)
+
+    assert rows == filtered_rows
+    assert fetch_calls == [2]
+    assert dataset.state.datasets.requests == []
@@ -0,0 +1,64 @@
+import json
+import shutil
+
+import pytest
+
+import unit_config
+from knowledge_vector_index import build_or_update_index
+from suggested_helper_functions import rag_data
+
+# <ai_context>
+# Multi-tenant retrieval: with two units in a temporary config dir, `rag_data` must search only the requested unit's
+# quick replies and knowledge base index, and a unit without a knowledge base gets "none" rather than another unit's.
+# An unrelated query gets "none" too, instead of low-scoring hash-collision matches.
+# </ai_context>
+
+SPA_QUICK_REPLIES = (
+    "english_guest_questions:\\n1. When does the spa open? 2. Can I book a massage? \\n\\n"
+    "english_reply:\\nThe Lotus Spa opens at 10 am {{salutation}} {{last_name}}.\\n\\n"
+)
+POOL_QUICK_REPLIES = (
+    "english_guest_questions:\\n1. When does the pool open? \\n\\n"
+    "english_reply:\\nThe rooftop pool opens at 7 am.\\n\\n"
+)
+
+
+@pytest.fixture()
+def two_units(tmp_path, monkeypatch):
+    shutil.copytree(unit_config.DEFAULT_CONFIG_DIR / "brands", tmp_path / "brands")
+    (tmp_path / "units").mkdir()
+    base_unit = json.loads((unit_config.DEFAULT_CONFIG_DIR / "units" / "glowing-hotel.json").read_text(encoding="utf-8"))
+
+    index_dir = tmp_path / "pool-hotel-index"
+    build_or_update_index({"pool": "The rooftop pool is open from 7 am to 7 pm."}, str(index_dir))
+    units = {
+        "pool-hotel": {"quick_replies": POOL_QUICK_REPLIES, "knowledge_base_index_dir": str(index_dir)},
+        "spa-hotel": {"quick_replies": SPA_QUICK_REPLIES},
+    }
+    for unit_id, sources in units.items():
+        unit = {**base_unit, "unit_id": unit_id, "unit_name": unit_id}
+        unit.pop("knowledge_base_index_dir")
+        unit.update(sources)
+        (tmp_path / "units" / f"{unit_id}.json").write_text(json.dumps(unit), encoding="utf-8")
+
+    monkeypatch.setenv(unit_config.CONFIG_DIR_ENV_VAR, str(tmp_path))
+    unit_config.clear_unit_config_cache()
+    yield
+    unit_config.clear_unit_config_cache()
+
+
+def test_rag_data_searches_only_the_requested_unit(two_units):
+    pool_hotel = rag_data("Guest asks when the pool opens", "pool-hotel")
+    assert "rooftop pool opens at 7 am" in pool_hotel["quick_replies"]
+    assert "Lotus Spa" not in pool_hotel["quick_replies"]
+    assert "rooftop pool is open" in pool_hotel["knowledge_base"]
+
+    spa_hotel = rag_data("Guest asks when the spa opens", "spa-hotel")
+    assert "Lotus Spa" in spa_hotel["quick_replies"]
+    assert "rooftop" not in spa_hotel["quick_replies"]
+    # No index configured for this unit: nothing from pool-hotel's
+    assert spa_hotel["knowledge_base"] == "none"
+
+
+def test_unrelated_query_gets_no_knowledge_base_entries(two_units):
+    assert rag_data("Guest asks whether pets are allowed", "pool-hotel")["knowledge_base"] == "none"
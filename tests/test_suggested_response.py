@@ -0,0 +1,55 @@
+import asyncio
+
+import braintrust
+import pytest
+from braintrust.functions.stream import BraintrustStream, BraintrustTextChunk
+
+import lazy_tracing
+import suggested_response
+
+# <ai_context>
+# The async pipeline calls every prompt through `braintrust.invoke_async` (never the blocking `braintrust.invoke`) and
+# reads the generator stream with `async for`.
+# </ai_context>
+
+SPANISH_CONVERSATION = "[2025-01-04 11:30:00] Guest: ¿A qué hora abre la piscina? \\n"
+
+
+@pytest.fixture
+def async_invoke_calls(monkeypatch):
+    """Routes prompts to an async stand-in and fails any blocking invoke; returns the slugs called."""
+    calls = []
+
+    def blocking_invoke(**invoke_kwargs):
+        raise AssertionError(f"blocking invoke called for {invoke_kwargs.get('slug')}")
+
+    async def fake_invoke_async(project_name=None, slug=None, input=None, stream=False, **invoke_kwargs):
+        calls.append(slug)
+        await asyncio.sleep(0)
+        if stream:
+            return BraintrustStream([BraintrustTextChunk(data="Hola, "), BraintrustTextChunk(data="Sra. Chan")])
+        if slug == "language-selection-handler-1bb5":
+            return {"reason": "The guest writes in Spanish.", "language": "Spanish"}
+        return "The guest asks when the pool opens."
+
+    monkeypatch.setattr(braintrust, "invoke", blocking_invoke)
+    monkeypatch.setattr(braintrust, "invoke_async", fake_invoke_async)
+    monkeypatch.setattr(lazy_tracing, "_logging_disabled", True)
+    return calls
+
+
+def test_async_pipeline_uses_invoke_async(async_invoke_calls):
+    async def collect():
+        return [
+            chunk
+            async for chunk in suggested_response.agenerate_suggested_response(
+                salutation="Ms.",
+                last_name="Chan",
+                conversation=SPANISH_CONVERSATION,
+                current_date_time="2025-01-04 11:30:10",
+                unit_open_issues_max_limit="4 hours",
+            )
+        ]
+
+    assert "".join(asyncio.run(collect())) == "Hola, Sra. Chan"
+    assert sorted(async_invoke_calls) == sorted(suggested_response.PROMPT_SLUGS)
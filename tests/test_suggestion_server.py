@@ -0,0 +1,91 @@
+import json
+
+import braintrust
+import pytest
+from fastapi.testclient import TestClient
+
+import lazy_tracing
+import suggestion_server
+
+# <ai_context>
+# End-to-end: the FastAPI app (lifespan included) with the synthetic stub backend. A suggestion must stream as SSE, and
+# neither startup nor the request may create a Braintrust logger or log in. A sampled request logs the full text on its
+# own span through the fan-out's trace sink.
+# </ai_context>
+
+STUB_CHUNKS = 5
+EXPECTED_TEXT = "".join(f"token{index} " for index in range(STUB_CHUNKS))
+SUGGESTION_REQUEST = {
+    "salutation": "Ms.",
+    "last_name": "Chan",
+    "conversation": "[2025-01-06 17:59:14] Guest: when the pool open? \\n",
+    "current_date_time": "2025-01-06 17:59:26",
+    "unit_open_issues_max_limit": "4 hours",
+}
+
+
+@pytest.fixture
+def braintrust_calls(monkeypatch):
+    """Records logger and login calls; the stub settings are restored after the test."""
+    calls = []
+    monkeypatch.setattr(braintrust, "invoke", braintrust.invoke)
+    monkeypatch.setattr(braintrust, "invoke_async", braintrust.invoke_async)
+    monkeypatch.setattr(braintrust, "login", lambda *args, **kwargs: calls.append("login"))
+    monkeypatch.setattr(braintrust, "init_logger", lambda *args, **kwargs: calls.append("init_logger"))
+    monkeypatch.setattr(lazy_tracing, "_logging_disabled", False)
+    monkeypatch.delenv("PROMPT_CASSETTE", raising=False)
+    return calls
+
+
+def _parse_events(body: str):
+    events = []
+    for raw_event in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in raw_event.splitlines())
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+
+def test_stub_backend_streams_a_suggestion_offline(braintrust_calls):
+    suggestion_server.install_stub_backend(invoke_latency_s=0.0, chunk_interval_s=0.0, chunk_count=STUB_CHUNKS)
+
+    with TestClient(suggestion_server.app) as client:
+        assert client.get("/healthz").json() == {"status": "ok", "in_flight": 0}
+        response = client.post("/v1/suggestions", json=SUGGESTION_REQUEST)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _parse_events(response.text)
+    # Chunks may be coalesced into fewer events when the client falls behind
+    assert {event for event, _ in events[:-1]} == {"message"}
+    assert "".join(data["text"] for _, data in events[:-1]) == EXPECTED_TEXT
+    assert events[-1] == ("done", {"chunks": STUB_CHUNKS})
+    assert braintrust_calls == []
+
+
+class _RecordingSpan:
+    """Stands in for a Braintrust span; records what is logged on it."""
+
+    def __init__(self, logged):
+        self.logged = logged
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def log(self, **fields):
+        self.logged.append(fields)
+
+
+def test_sampled_request_logs_the_full_text_on_its_span(braintrust_calls, monkeypatch):
+    logged = []
+    monkeypatch.setattr(braintrust, "start_span", lambda **span_kwargs: _RecordingSpan(logged))
+    monkeypatch.setenv("TRACE_SAMPLE_RATES", "task=1")
+    suggestion_server.install_stub_backend(invoke_latency_s=0.0, chunk_interval_s=0.0, chunk_count=STUB_CHUNKS)
+
+    with TestClient(suggestion_server.app) as client:
+        response = client.post("/v1/suggestions", json=SUGGESTION_REQUEST)
+
+    assert _parse_events(response.text)[-1] == ("done", {"chunks": STUB_CHUNKS})
+    assert {"output": EXPECTED_TEXT} in logged
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+import weather_client
+from weather_client import afetch_weather_batch, fetch_weather_batch
+
+# <ai_context>
+# Weather batches from inside a running event loop (as in suggestion_server): the sync batch must not start its own
+# loop, the async one is awaited directly; both keep input order and turn failures into error dicts.
+# </ai_context>
+
+LOCATIONS = [{"city": "Paris", "country_code": "fr"}, {"city": "Nowhere", "country_code": "xx"}]
+
+
+@pytest.fixture(autouse=True)
+def _fake_fetch(monkeypatch):
+    def fake_fetch_weather(city, country_code, units="metric", lang="en"):
+        if city == "Nowhere":
+            raise RuntimeError("unknown city")
+        return {"city_name": city, "units": units}
+
+    monkeypatch.setattr(weather_client, "fetch_weather", fake_fetch_weather)
+
+
+def _check(results):
+    assert results[0] == {"city_name": "Paris", "units": "metric"}
+    assert results[1]["error"] == "Exception occurred: unknown city"
+    assert results[1]["city"] == "Nowhere"
+
+
+def test_sync_batch_works_inside_a_running_loop():
+    async def handler():
+        return fetch_weather_batch(LOCATIONS)
+
+    _check(asyncio.run(handler()))
+
+
+def test_async_batch():
+    _check(asyncio.run(afetch_weather_batch(LOCATIONS, max_concurrency=1)))
+
+
+def test_empty_batch():
+    assert fetch_weather_batch([]) == []
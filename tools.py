@@ -1,34 +1,41 @@
 from typing import Literal
  
-# Import the Braintrust SDK for creating/managing projects and tools
-import braintrust
 # Import Pydantic for data validation and schema generation
 from pydantic import BaseModel, RootModel, Field
+import importlib
 import os
-import requests
+import sys
 import logging
-from typing import Dict, List, Optional, Union
+import threading
+from typing import Any, Dict, List, Optional, Union
+
+# <ai_context>
+# Tools pushed to Braintrust with `braintrust push tools.py`: "Calculator method", "Batch Calculator" and "Current Weather".
+# `batch_calculator` evaluates a list of operations (with "$n" references to earlier results) via batch_calculator.py.
+# `get_current_weather` (and the batch tool `get_weather_batch`) delegate to weather_client.py (shared keep-alive session, TTL cache, single-flight fetches),
+# so repeated questions about the same city within WEATHER_CACHE_TTL_SECONDS do not call OpenWeatherMap again.
+# Importing this module has no side effects: the Braintrust SDK and the handlers' heavy dependencies (NumPy, requests)
+# are imported on first use, and logging is only configured when run as a script. The tools are declared to Braintrust
+# by `register_tools()` (idempotent), which runs automatically during `braintrust push tools.py` and otherwise only
+# when called. `python bench_startup.py --module tools` measures the import time.
+# </ai_context>
 
 """
 This script is used to create tools in Braintrust.
 Currently implemented tools:
 - Calculator: A simple calculator that can add, subtract, multiply, and divide numbers
+- Batch Calculator: Many calculator operations in one call, optionally chained
 - Current Weather: Get current weather data for a specified city
+- Current Weather (batch): Get current weather data for several cities concurrently
 use this command to push the tools to Braintrust:
 braintrust push tools.py
 """
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Logging is configured in the __main__ block below, so importing this module leaves the host's logging alone
 logger = logging.getLogger('weather_tool')
- 
-# Get or create a Braintrust project named "workflow-glowing"
-# Note: To use an existing project instead of creating a new one,
-# replace this with: project = braintrust.projects.get(name="workflow-glowing")
-project = braintrust.projects.create(name="workflow-glowing")
+
+# Project the tools are registered in (see `register_tools`)
+PROJECT_NAME = "workflow-glowing"
  
  
 # Define the input schema for our calculator tool using Pydantic
@@ -65,24 +72,40 @@ def calculator(op, a, b):
             return a * b
         case "divide":
             return a / b
- 
- 
-# Register the calculator function as a tool in Braintrust
-# This makes it available for LLMs to call when this tool is attached to a prompt
-project.tools.create(
-    # The function that will be executed when the tool is called
-    handler=calculator,
-    # A user-friendly name for the tool (shown in the UI)
-    name="Calculator method",
-    # A unique identifier for the tool (must be unique within the project)
-    slug="calculator",
-    # A description of what the tool does (used by the LLM to understand when to call it)
-    description="A simple calculator that can add, subtract, multiply, and divide.",
-    # The input schema - defines what parameters the LLM must provide
-    parameters=CalculatorInput,  # You can also provide raw JSON schema here if you prefer
-    # The output schema - defines what the tool will return
-    returns=CalculatorOutput,
-)
+
+
+"""
+Batch version of the calculator, for flows with many numbers (bill splitting, unit conversion across line items).
+The operations are evaluated with NumPy in one call (see batch_calculator.py); an operand can be "$n" to use the
+result of operation n, so multi-step calculations also fit in one call.
+"""
+
+# One operation of a batch; operands are numbers or references to earlier results
+class BatchCalculatorOperation(BaseModel):
+    op: Literal["add", "subtract", "multiply", "divide"]
+    a: Union[float, str] = Field(..., description="A number, or \"$n\" for the result of operation n (0-based, earlier in the list)")
+    b: Union[float, str] = Field(..., description="A number, or \"$n\" for the result of operation n (0-based, earlier in the list)")
+
+# Define the input schema for the batch calculator
+class BatchCalculatorInput(BaseModel):
+    operations: List[BatchCalculatorOperation] = Field(..., description="The operations to evaluate, in order")
+
+# An operation that could not be evaluated (e.g. division by zero); the other results are still returned
+class CalculatorError(BaseModel):
+    error: str = Field(..., description="Why the operation failed")
+
+# One result per operation, in the same order
+class BatchCalculatorOutput(RootModel[List[Union[float, CalculatorError]]]):
+    pass
+
+# The function that evaluates the whole batch at once
+def batch_calculator(operations):
+    # The handler may receive plain dicts or BatchCalculatorOperation models
+    # Imported on first use: NumPy is only needed once the tool is actually called
+    from batch_calculator import evaluate_batch
+
+    operation_dicts = [operation.model_dump() if isinstance(operation, BaseModel) else operation for operation in operations]
+    return evaluate_batch(operation_dicts)
 
 """
 Here is a another tool to call the weather API to call the current weather in a city.
@@ -119,76 +142,156 @@ class WeatherData(BaseModel):
     units: str = Field(..., description="Units used for measurements")
 
 # Function to fetch current weather data
+# The HTTP call, connection pooling, TTL cache and request coalescing live in weather_client.py
 def get_current_weather(city, country_code, units="metric", lang="en"):
-    # Get API key from environment variable
-    api_key = os.environ.get("OPENWEATHER_API_KEY")
-    if not api_key:
-        logger.error("API key not found in environment variables")
-        return {"error": "API key not found in environment variables"}
-    
+    from weather_client import fetch_weather
+
     logger.info(f"Weather data requested with params: city={city}, country_code={country_code}, units={units}")
-    
-    # Build the API URL and params
-    base_url = "https://api.openweathermap.org/data/2.5/weather"
-    
-    # Construct the location query parameter
-    location_query = f"{city},{country_code}"
-    logger.info(f"Using city name: {location_query}")
-    
-    params = {
-        "q": location_query,
-        "appid": api_key,
-        "units": units,
-        "lang": lang
-    }
-    
-    try:
-        # Make the API request
-        logger.info(f"Making API request to: {base_url} with params: {params}")
-        response = requests.get(base_url, params=params)
-        
-        # Check if request was successful
-        if response.status_code == 200:
-            # Process response
-            data = response.json()
-            logger.info(f"Got successful response from API with data for: {data.get('name', 'unknown location')}")
-            
-            # Format the response
-            weather_data = {
-                "temperature": data["main"]["temp"],
-                "feels_like": data["main"]["feels_like"],
-                "description": data["weather"][0]["description"],
-                "humidity": data["main"]["humidity"],
-                "wind_speed": data["wind"]["speed"],
-                "country": data["sys"]["country"],
-                "city_name": data["name"],
-                "weather_main": data["weather"][0]["main"],
-                "pressure": data["main"]["pressure"],
-                "units": units
-            }
-            
-            logger.info(f"Returning formatted weather data for {weather_data['city_name']}")
-            return weather_data
-        else:
-            logger.error(f"API error: {response.status_code} - {response.text}")
-            return {"error": f"API error: {response.status_code}", "message": response.text}
-    
-    except Exception as e:
-        logger.exception(f"Exception occurred while fetching weather data: {str(e)}")
-        return {"error": f"Exception occurred: {str(e)}"}
-
-# Register the weather tool in Braintrust
-project.tools.create(
-    handler=get_current_weather,
-    name="Current Weather",
-    slug="current-weather",
-    description="Retrieve current weather data for a specified city. Provides temperature, feels like, humidity, wind speed, and weather description. Requires both city name and country code (ISO 3166, e.g., 'us', 'gb', 'fr').",
-    parameters=WeatherInput,
-    returns=WeatherData,
-)
+
+    weather_data = fetch_weather(city, country_code, units=units, lang=lang)
+    if "error" in weather_data:
+        logger.error(f"Weather lookup failed: {weather_data['error']} {weather_data.get('message', '')}".rstrip())
+        return weather_data
+
+    logger.info(f"Returning formatted weather data for {weather_data['city_name']}")
+    return weather_data
+
+"""
+Batch version of the weather tool, for agents that need several locations at once (e.g. planning an itinerary).
+All locations are fetched concurrently, so the call takes about as long as a single lookup.
+"""
+
+# Define input schema for the batch weather tool
+class WeatherBatchInput(BaseModel):
+    locations: List[WeatherInput] = Field(..., description="The locations to get weather data for")
+
+# A location that could not be looked up; the rest of the batch is still returned
+class WeatherError(BaseModel):
+    error: str = Field(..., description="What went wrong")
+    message: Optional[str] = Field(None, description="Error details from the weather API, if any")
+    city: str = Field(..., description="City name of the failed location")
+    country_code: str = Field(..., description="Country code of the failed location")
+
+# One result per requested location, in the same order
+class WeatherBatchOutput(RootModel[List[Union[WeatherData, WeatherError]]]):
+    pass
+
+# Function to fetch the weather for many locations concurrently
+def get_weather_batch(locations):
+    from weather_client import fetch_weather_batch
+
+    logger.info(f"Batch weather data requested for {len(locations)} locations")
+    # The handler may receive plain dicts or WeatherInput models
+    location_dicts = [location.model_dump() if isinstance(location, BaseModel) else location for location in locations]
+    results = fetch_weather_batch(location_dicts)
+
+    failed_count = sum(1 for result in results if "error" in result)
+    if failed_count:
+        logger.error(f"Batch weather lookup: {failed_count} of {len(results)} locations failed")
+    return results
+
+"""
+Registration: declare the tools above to Braintrust.
+"""
+
+# slug -> tool handle, filled once by `register_tools`
+_registered_tools: Dict[str, Any] = {}
+_registration_lock = threading.Lock()
+
+
+def _is_braintrust_push() -> bool:
+    """True while `braintrust push` is importing this module (it loads files with the SDK's lazy-load flag set)."""
+    # Only look at the SDK if it is already loaded: `braintrust push` imports it before this module
+    framework = sys.modules.get("braintrust.framework")
+    return framework is not None and framework._is_lazy_load()
+
+
+def register_tools() -> Dict[str, Any]:
+    """
+    Declares the tools in the Braintrust project (once per process; later calls return the same handles).
+
+    Returns:
+        slug -> tool handle, usable when attaching the tools to a prompt.
+    """
+    with _registration_lock:
+        if _registered_tools:
+            return _registered_tools
+
+        # Import the Braintrust SDK for creating/managing projects and tools
+        import braintrust
+        # Import the handlers' dependencies now, so `braintrust push` bundles them with this file
+        for module_name in ("batch_calculator", "weather_client"):
+            importlib.import_module(module_name)
+
+        # Get or create a Braintrust project named "workflow-glowing"
+        # Note: To use an existing project instead of creating a new one,
+        # replace this with: project = braintrust.projects.get(name="workflow-glowing")
+        project = braintrust.projects.create(name=PROJECT_NAME)
+        tools: Dict[str, Any] = {}
+
+        # Register the calculator function as a tool in Braintrust
+        # This makes it available for LLMs to call when this tool is attached to a prompt
+        tools["calculator"] = project.tools.create(
+            # The function that will be executed when the tool is called
+            handler=calculator,
+            # A user-friendly name for the tool (shown in the UI)
+            name="Calculator method",
+            # A unique identifier for the tool (must be unique within the project)
+            slug="calculator",
+            # A description of what the tool does (used by the LLM to understand when to call it)
+            description="A simple calculator that can add, subtract, multiply, and divide.",
+            # The input schema - defines what parameters the LLM must provide
+            parameters=CalculatorInput,  # You can also provide raw JSON schema here if you prefer
+            # The output schema - defines what the tool will return
+            returns=CalculatorOutput,
+        )
+
+        # Register the batch calculator as a tool in Braintrust
+        tools["batch-calculator"] = project.tools.create(
+            handler=batch_calculator,
+            name="Batch Calculator",
+            slug="batch-calculator",
+            description="Evaluate many add, subtract, multiply and divide operations in one call. Each operand is a number or \"$n\" to reuse the result of operation n (0-based, earlier in the list), e.g. [{\"op\": \"divide\", \"a\": 240, \"b\": 3}, {\"op\": \"multiply\", \"a\": \"$0\", \"b\": 1.15}]. Returns one result per operation; failed operations (e.g. division by zero) return an error instead.",
+            parameters=BatchCalculatorInput,
+            returns=BatchCalculatorOutput,
+        )
+
+        # Register the weather tool in Braintrust
+        tools["current-weather"] = project.tools.create(
+            handler=get_current_weather,
+            name="Current Weather",
+            slug="current-weather",
+            description="Retrieve current weather data for a specified city. Provides temperature, feels like, humidity, wind speed, and weather description. Requires both city name and country code (ISO 3166, e.g., 'us', 'gb', 'fr').",
+            parameters=WeatherInput,
+            returns=WeatherData,
+        )
+
+        # Register the batch weather tool in Braintrust
+        tools["current-weather-batch"] = project.tools.create(
+            handler=get_weather_batch,
+            name="Current Weather (batch)",
+            slug="current-weather-batch",
+            description="Retrieve current weather data for several cities in one call. Takes a list of locations (city name and country code, ISO 3166, e.g., 'us', 'gb', 'fr') and returns one result per location in the same order: the weather data, or an error for that location.",
+            parameters=WeatherBatchInput,
+            returns=WeatherBatchOutput,
+        )
+
+        _registered_tools.update(tools)
+        return _registered_tools
+
+
+# `braintrust push tools.py` collects the tools declared while it imports this file
+if _is_braintrust_push():
+    register_tools()
 
 # Test code - Only runs when script is executed directly
 if __name__ == "__main__":
+    # Set up logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
     # Test each operation to verify that the calculator works
     test_cases = [
         {"op": "add", "a": 5, "b": 3},
@@ -204,6 +307,16 @@ if __name__ == "__main__":
         result = calculator(**case)
         print(f"{case['op']}({case['a']}, {case['b']}) = {result}")
     
+    # Test the batch calculator: split a bill three ways, add a tip, and one division by zero
+    print("\nTesting batch calculator function:")
+    print("---------------------------")
+    batch_results = batch_calculator([
+        {"op": "divide", "a": 240, "b": 3},
+        {"op": "multiply", "a": "$0", "b": 1.15},
+        {"op": "divide", "a": 10, "b": 0},
+    ])
+    for result in batch_results:
+        print(result)
     print("\nAll tests completed!")
     print("Note: This only tests the function locally.")
     print("To test the deployed tool in Braintrust, push it with 'braintrust push tools.py'")
@@ -227,6 +340,19 @@ if __name__ == "__main__":
         print(f"Current weather in {weather.get('city_name', 'London')}, {weather.get('country', 'GB')}:")
         print(f"Temperature: {weather.get('temperature')}°C")
         print(f"Description: {weather.get('description')}")
+
+        # Test the batch tool with both cities and an unknown one
+        print("\nTest 3: Batch lookup (France, UK and an unknown city)")
+        results = get_weather_batch([
+            {"city": "Paris", "country_code": "fr"},
+            {"city": "London", "country_code": "gb"},
+            {"city": "Nowhere-on-earth", "country_code": "zz"},
+        ])
+        for result in results:
+            if "error" in result:
+                print(f"{result['city']}: {result['error']}")
+            else:
+                print(f"{result['city_name']}: {result['temperature']}°C, {result['description']}")
     else:
         print("\nSkipping weather API test - OPENWEATHER_API_KEY not found in environment")
 
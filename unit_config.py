@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional
+
+# <ai_context>
+# Multi-tenant configuration store for brand and unit guidelines, used by `value_extractor`.
+# Bundles are JSON files: `config/brands/<brand_id>.json` (brand_* fields) and `config/units/<unit_id>.json`
+# (unit_* fields plus the `brand_id` it inherits from; a unit may also override brand fields). Besides the prompt fields, a
+# bundle may name the unit's retrieval sources for `rag_data`: `quick_replies` (the quick-reply corpus) and
+# `knowledge_base_index_dir` (its knowledge base vector index).
+# Each unit's merged bundle is cached as an immutable MappingProxyType. Brand bundles are loaded once per brand and the
+# merged unit bundles reference the same string objects, so units of one brand share the guideline text in memory.
+# Hot-path lookups are a dict hit; file mtimes are re-checked at most every UNIT_CONFIG_RELOAD_CHECK_SECONDS and a bundle
+# is only re-read when its unit or brand file changed.
+# </ai_context>
+
+CONFIG_DIR_ENV_VAR = "UNIT_CONFIG_DIR"
+DEFAULT_UNIT_ID_ENV_VAR = "DEFAULT_UNIT_ID"
+RELOAD_CHECK_ENV_VAR = "UNIT_CONFIG_RELOAD_CHECK_SECONDS"
+
+# Bundles ship next to this module, so lookups do not depend on the working directory
+DEFAULT_CONFIG_DIR = Path(__file__).resolve().parent / "config"
+DEFAULT_UNIT_ID = "glowing-hotel"
+DEFAULT_RELOAD_CHECK_SECONDS = 2.0
+
+# Fields every merged bundle must provide (these are the prompt inputs read from `value_extractor`)
+REQUIRED_FIELDS = (
+    "brand_communication_guidelines",
+    "brand_customer_term",
+    "brand_response_guidelines",
+    "unit_communication_guidelines",
+    "unit_name",
+    "unit_response_guidelines",
+    "unit_specific_information",
+    "unit_term",
+)
+
+
+class UnitConfigError(KeyError):
+    """Raised when a unit or brand bundle is missing or incomplete."""
+
+
+@dataclass(frozen=True)
+class _CachedBundle:
+    """A loaded bundle plus what is needed to decide whether it is stale."""
+
+    bundle: Mapping[str, str]
+    # (path, mtime) of every file the bundle was built from
+    source_mtimes: tuple
+    checked_at: float
+
+
+# brand_id -> cached brand bundle; unit_id -> cached merged bundle
+_brand_cache: Dict[str, _CachedBundle] = {}
+_unit_cache: Dict[str, _CachedBundle] = {}
+# Reloads are rare, so a single lock is enough (lookups on the hot path never take it)
+_reload_lock = threading.Lock()
+
+
+def _get_config_dir() -> Path:
+    return Path(os.environ.get(CONFIG_DIR_ENV_VAR) or DEFAULT_CONFIG_DIR)
+
+
+def _get_reload_check_seconds() -> float:
+    return float(os.environ.get(RELOAD_CHECK_ENV_VAR, DEFAULT_RELOAD_CHECK_SECONDS))
+
+
+def _stat_mtime(path: Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        raise UnitConfigError(f"Config file not found: {path}") from None
+
+
+def _is_fresh(cached: _CachedBundle) -> bool:
+    """True if none of the bundle's source files changed since it was loaded."""
+    return all(_stat_mtime(path) == mtime for path, mtime in cached.source_mtimes)
+
+
+def _read_json(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except ValueError as error:
+        raise UnitConfigError(f"Invalid JSON in {path}: {error}") from error
+
+
+def _load_brand(brand_id: str, now: float) -> _CachedBundle:
+    """Returns the brand bundle, re-reading the file only if it changed. Must be called with `_reload_lock` held."""
+    cached = _brand_cache.get(brand_id)
+    if cached is not None and _is_fresh(cached):
+        return cached
+    brand_path = _get_config_dir() / "brands" / f"{brand_id}.json"
+    brand_mtime = _stat_mtime(brand_path)
+    brand_fields = {key: value for key, value in _read_json(brand_path).items() if key != "brand_id"}
+    cached = _CachedBundle(
+        bundle=MappingProxyType(brand_fields), source_mtimes=((brand_path, brand_mtime),), checked_at=now
+    )
+    _brand_cache[brand_id] = cached
+    return cached
+
+
+def _load_unit(unit_id: str, now: float) -> _CachedBundle:
+    """Builds the merged brand + unit bundle. Must be called with `_reload_lock` held."""
+    unit_path = _get_config_dir() / "units" / f"{unit_id}.json"
+    unit_mtime = _stat_mtime(unit_path)
+    unit_fields = _read_json(unit_path)
+    brand_id = unit_fields.pop("brand_id", None)
+    unit_fields.pop("unit_id", None)
+    if not brand_id:
+        raise UnitConfigError(f"Unit '{unit_id}' does not declare a brand_id")
+
+    brand = _load_brand(brand_id, now)
+    # Merge by reference: the brand's string objects are shared by every unit of that brand
+    merged_fields = {**brand.bundle, **unit_fields}
+    missing_fields = [field for field in REQUIRED_FIELDS if field not in merged_fields]
+    if missing_fields:
+        raise UnitConfigError(f"Unit '{unit_id}' (brand '{brand_id}') is missing fields: {', '.join(missing_fields)}")
+
+    return _CachedBundle(
+        bundle=MappingProxyType(merged_fields),
+        source_mtimes=((unit_path, unit_mtime),) + brand.source_mtimes,
+        checked_at=now,
+    )
+
+
+def get_unit_config(unit_id: Optional[str] = None) -> Mapping[str, str]:
+    """
+    Returns the immutable merged guideline bundle for a unit.
+
+    Args:
+        unit_id: Unit identifier (file stem under config/units). Defaults to DEFAULT_UNIT_ID.
+
+    Returns:
+        A read-only mapping with every field in REQUIRED_FIELDS.
+
+    Raises:
+        UnitConfigError: If the unit or its brand is missing or incomplete.
+    """
+    resolved_unit_id = unit_id or os.environ.get(DEFAULT_UNIT_ID_ENV_VAR, DEFAULT_UNIT_ID)
+    now = time.monotonic()
+
+    # Hot path: cached and checked recently
+    cached = _unit_cache.get(resolved_unit_id)
+    if cached is not None and now - cached.checked_at < _get_reload_check_seconds():
+        return cached.bundle
+
+    with _reload_lock:
+        cached = _unit_cache.get(resolved_unit_id)
+        if cached is not None and _is_fresh(cached):
+            # Unchanged on disk: keep the bundle, just restart the check interval
+            cached = _CachedBundle(bundle=cached.bundle, source_mtimes=cached.source_mtimes, checked_at=now)
+        else:
+            cached = _load_unit(resolved_unit_id, now)
+        _unit_cache[resolved_unit_id] = cached
+    return cached.bundle
+
+
+def clear_unit_config_cache() -> None:
+    """Drops every cached bundle (next lookups re-read the files)."""
+    with _reload_lock:
+        _brand_cache.clear()
+        _unit_cache.clear()
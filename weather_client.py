@@ -0,0 +1,370 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pipeline_concurrency import run_blocking
+
+# <ai_context>
+# HTTP client behind the "Current Weather" tool (tools.py).
+# One shared `requests.Session` with a pooled HTTPAdapter keeps connections to OpenWeatherMap alive, so only the first
+# call per connection pays the TCP/TLS setup.
+# Successful responses are cached in memory for WEATHER_CACHE_TTL_SECONDS (LRU-bounded), keyed on the normalized
+# (city, country_code, units, lang). Identical requests arriving while a fetch is in flight wait on that fetch
+# (single flight) instead of calling the API again. Errors are returned to every waiter but never cached.
+# OPENWEATHER_BASE_URL points the client at another server (e.g. the local stub started by `python weather_client.py`).
+# `afetch_weather_batch` (async, for code on an event loop) / `fetch_weather_batch` (sync, on its own short-lived thread
+# pool, never an event loop, so it also works where a loop is already running) look up many locations at once: every
+# location is fetched concurrently (at most WEATHER_BATCH_MAX_CONCURRENCY at a time, by default the HTTP pool size), so
+# a batch takes about one round trip.
+# Results keep the input order; a failed location yields an error dict in its slot instead of failing the batch.
+# `get_weather_stats()` reports the hit rate, coalesced requests and upstream latency (mean/p50/p95/max).
+# </ai_context>
+
+API_KEY_ENV_VAR = "OPENWEATHER_API_KEY"
+BASE_URL_ENV_VAR = "OPENWEATHER_BASE_URL"
+CACHE_TTL_ENV_VAR = "WEATHER_CACHE_TTL_SECONDS"
+CACHE_MAX_ENTRIES_ENV_VAR = "WEATHER_CACHE_MAX_ENTRIES"
+POOL_SIZE_ENV_VAR = "WEATHER_POOL_SIZE"
+TIMEOUT_ENV_VAR = "WEATHER_TIMEOUT_SECONDS"
+BATCH_MAX_CONCURRENCY_ENV_VAR = "WEATHER_BATCH_MAX_CONCURRENCY"
+
+DEFAULT_BASE_URL = "https://api.openweathermap.org/data/2.5/weather"
+# OpenWeatherMap refreshes current conditions roughly every 10 minutes
+DEFAULT_CACHE_TTL_SECONDS = 600
+DEFAULT_CACHE_MAX_ENTRIES = 1024
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT_SECONDS = 10.0
+# Number of recent upstream latencies kept for the percentiles
+LATENCY_WINDOW = 512
+
+WeatherKey = Tuple[str, str, str, str]
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+# key -> (stored_at, weather data), oldest first
+_weather_cache: "OrderedDict[WeatherKey, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+# key -> future of the fetch currently running for it
+_in_flight: Dict[WeatherKey, Future] = {}
+_cache_lock = threading.Lock()
+
+# Counters, guarded by `_cache_lock`
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "coalesced": 0,
+    "expired": 0,
+    "evictions": 0,
+    "upstream_calls": 0,
+    "upstream_errors": 0,
+}
+_upstream_latencies: "deque[float]" = deque(maxlen=LATENCY_WINDOW)
+
+
+def _get_session() -> requests.Session:
+    """Returns the shared keep-alive session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                pool_size = int(os.environ.get(POOL_SIZE_ENV_VAR, DEFAULT_POOL_SIZE))
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def make_weather_key(city: str, country_code: str, units: str, lang: str) -> WeatherKey:
+    """Normalizes the request so "Paris"/"paris " and "FR"/"fr" share a cache entry."""
+    return (city.strip().lower(), country_code.strip().lower(), (units or "metric").lower(), (lang or "en").lower())
+
+
+def format_weather(data: Dict[str, Any], units: str) -> Dict[str, Any]:
+    """Maps an OpenWeatherMap response to the tool's `WeatherData` shape."""
+    return {
+        "temperature": data["main"]["temp"],
+        "feels_like": data["main"]["feels_like"],
+        "description": data["weather"][0]["description"],
+        "humidity": data["main"]["humidity"],
+        "wind_speed": data["wind"]["speed"],
+        "country": data["sys"]["country"],
+        "city_name": data["name"],
+        "weather_main": data["weather"][0]["main"],
+        "pressure": data["main"]["pressure"],
+        "units": units,
+    }
+
+
+def _fetch_upstream(key: WeatherKey, api_key: str) -> Dict[str, Any]:
+    """Calls the weather API once; returns the formatted data or an error dict."""
+    city, country_code, units, lang = key
+    params = {"q": f"{city},{country_code}", "appid": api_key, "units": units, "lang": lang}
+    started_at = time.perf_counter()
+    try:
+        response = _get_session().get(
+            os.environ.get(BASE_URL_ENV_VAR, DEFAULT_BASE_URL),
+            params=params,
+            timeout=float(os.environ.get(TIMEOUT_ENV_VAR, DEFAULT_TIMEOUT_SECONDS)),
+        )
+        if response.status_code == 200:
+            result = format_weather(response.json(), units)
+        else:
+            result = {"error": f"API error: {response.status_code}", "message": response.text}
+    except Exception as e:
+        # Connection errors include the request URL; keep the API key out of what the model sees
+        result = {"error": f"Exception occurred: {str(e).replace(api_key, '***')}"}
+
+    latency_seconds = time.perf_counter() - started_at
+    with _cache_lock:
+        _stats["upstream_calls"] += 1
+        _upstream_latencies.append(latency_seconds)
+        if "error" in result:
+            _stats["upstream_errors"] += 1
+    return result
+
+
+def _lookup(key: WeatherKey) -> Optional[Dict[str, Any]]:
+    """Returns a fresh cached entry (caller holds `_cache_lock`)."""
+    entry = _weather_cache.get(key)
+    if entry is None:
+        return None
+    stored_at, weather_data = entry
+    if time.monotonic() - stored_at > float(os.environ.get(CACHE_TTL_ENV_VAR, DEFAULT_CACHE_TTL_SECONDS)):
+        del _weather_cache[key]
+        _stats["expired"] += 1
+        return None
+    _weather_cache.move_to_end(key)
+    return weather_data
+
+
+def _store(key: WeatherKey, weather_data: Dict[str, Any]) -> None:
+    """Caches a successful result, evicting the least recently used entries (caller holds `_cache_lock`)."""
+    _weather_cache[key] = (time.monotonic(), weather_data)
+    _weather_cache.move_to_end(key)
+    max_entries = int(os.environ.get(CACHE_MAX_ENTRIES_ENV_VAR, DEFAULT_CACHE_MAX_ENTRIES))
+    while len(_weather_cache) > max_entries:
+        _weather_cache.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+def fetch_weather(city: str, country_code: str, units: str = "metric", lang: str = "en") -> Dict[str, Any]:
+    """
+    Returns the current weather for a city, from the cache, a fetch already in flight, or one new API call.
+
+    Returns:
+        The formatted weather data (a copy, safe to modify), or {"error": ..., ...} like the API tool always returned.
+    """
+    api_key = os.environ.get(API_KEY_ENV_VAR)
+    if not api_key:
+        return {"error": "API key not found in environment variables"}
+
+    key = make_weather_key(city, country_code, units, lang)
+    with _cache_lock:
+        cached = _lookup(key)
+        if cached is not None:
+            _stats["hits"] += 1
+            return dict(cached)
+        in_flight = _in_flight.get(key)
+        if in_flight is not None:
+            _stats["coalesced"] += 1
+        else:
+            _stats["misses"] += 1
+            _in_flight[key] = Future()
+
+    # Another thread is already fetching this key; share its result
+    if in_flight is not None:
+        return dict(in_flight.result())
+
+    result = {"error": "Weather fetch was interrupted"}
+    try:
+        result = _fetch_upstream(key, api_key)
+    finally:
+        with _cache_lock:
+            in_flight = _in_flight.pop(key)
+            if "error" not in result:
+                _store(key, result)
+        # Waiters are released even if this thread was interrupted
+        in_flight.set_result(result)
+    return dict(result)
+
+
+def _get_batch_max_concurrency(max_concurrency: Optional[int]) -> int:
+    """WEATHER_BATCH_MAX_CONCURRENCY, else the HTTP pool size, so no request waits for a pooled connection."""
+    if max_concurrency is not None:
+        return max_concurrency
+    return int(os.environ.get(BATCH_MAX_CONCURRENCY_ENV_VAR) or os.environ.get(POOL_SIZE_ENV_VAR, DEFAULT_POOL_SIZE))
+
+
+def _fetch_location(location: Mapping[str, Any]) -> Dict[str, Any]:
+    """One batch slot: the weather for a location, or an error dict naming it."""
+    try:
+        # Same path as single lookups, so batches share the cache and in-flight fetches with them
+        result = fetch_weather(
+            location["city"],
+            location["country_code"],
+            units=location.get("units") or "metric",
+            lang=location.get("lang") or "en",
+        )
+    except Exception as e:
+        result = {"error": f"Exception occurred: {str(e)}"}
+    if "error" in result:
+        return {**result, "city": location.get("city"), "country_code": location.get("country_code")}
+    return result
+
+
+async def afetch_weather_batch(
+    locations: Sequence[Mapping[str, Any]], max_concurrency: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Fetches the weather for many locations concurrently, from a running event loop (e.g. suggestion_server).
+
+    Args:
+        locations: `WeatherInput`-shaped dicts ({"city", "country_code", optional "units", "lang"}).
+        max_concurrency: Cap on fetches in flight. Defaults to WEATHER_BATCH_MAX_CONCURRENCY, else the HTTP pool size,
+            so no request waits for a pooled connection.
+
+    Returns:
+        One result per location, in input order: the weather data, or an error dict naming the location.
+    """
+    semaphore = asyncio.Semaphore(_get_batch_max_concurrency(max_concurrency))
+
+    async def fetch_location(location: Mapping[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            return await run_blocking(_fetch_location, location)
+
+    return list(await asyncio.gather(*(fetch_location(location) for location in locations)))
+
+
+def fetch_weather_batch(
+    locations: Sequence[Mapping[str, Any]], max_concurrency: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Synchronous `afetch_weather_batch` (e.g. for tool handlers): fetches on its own threads, no event loop involved,
+    so it is safe to call from any thread, including one running a loop.
+    """
+    if not locations:
+        return []
+    worker_count = min(_get_batch_max_concurrency(max_concurrency), len(locations))
+    with ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix="weather-batch") as executor:
+        return list(executor.map(_fetch_location, locations))
+
+
+def get_weather_stats() -> Dict[str, Any]:
+    """Returns the counters plus cache hit rate and upstream latency (seconds) over the last LATENCY_WINDOW calls."""
+    with _cache_lock:
+        snapshot: Dict[str, Any] = dict(_stats)
+        snapshot["cache_entries"] = len(_weather_cache)
+        latencies = sorted(_upstream_latencies)
+    requests_served = snapshot["hits"] + snapshot["misses"] + snapshot["coalesced"]
+    # Coalesced requests were served without their own upstream call, so they count towards the hit rate
+    snapshot["hit_rate"] = (snapshot["hits"] + snapshot["coalesced"]) / requests_served if requests_served else 0.0
+    snapshot["upstream_latency"] = (
+        {
+            "mean": sum(latencies) / len(latencies),
+            "p50": latencies[len(latencies) // 2],
+            "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "max": latencies[-1],
+        }
+        if latencies
+        else {}
+    )
+    return snapshot
+
+
+def clear_weather_cache() -> None:
+    """Empties the cache and resets the counters (in-flight fetches are left to finish)."""
+    with _cache_lock:
+        _weather_cache.clear()
+        _upstream_latencies.clear()
+        for counter_name in _stats:
+            _stats[counter_name] = 0
+
+
+# Demo against a local stub server: concurrent requests for a few cities, then the cache and latency stats
+if __name__ == "__main__":
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    stub_counts = {"connections": 0, "requests": 0}
+
+    class StubWeatherHandler(BaseHTTPRequestHandler):
+        # HTTP/1.1 so the client can keep connections alive
+        protocol_version = "HTTP/1.1"
+        # Headers and body are separate writes; without this, Nagle + delayed ACK adds ~40 ms per response
+        disable_nagle_algorithm = True
+
+        def setup(self) -> None:
+            super().setup()
+            stub_counts["connections"] += 1
+
+        def do_GET(self) -> None:
+            stub_counts["requests"] += 1
+            # Simulated API latency
+            time.sleep(0.05)
+            city = parse_qs(urlparse(self.path).query)["q"][0].split(",")[0]
+            body = json.dumps({
+                "main": {"temp": 21.5, "feels_like": 21.0, "humidity": 60, "pressure": 1012},
+                "weather": [{"main": "Clouds", "description": "few clouds"}],
+                "wind": {"speed": 3.4},
+                "sys": {"country": "XX"},
+                "name": city.title(),
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    stub_server = ThreadingHTTPServer(("127.0.0.1", 0), StubWeatherHandler)
+    threading.Thread(target=stub_server.serve_forever, daemon=True).start()
+    os.environ[BASE_URL_ENV_VAR] = f"http://127.0.0.1:{stub_server.server_address[1]}/data/2.5/weather"
+    os.environ.setdefault(API_KEY_ENV_VAR, "stub-key")
+
+    cities = [("Paris", "fr"), ("London", "gb"), ("Tokyo", "jp"), ("Hong Kong", "hk")]
+    calls = [cities[call_index % len(cities)] for call_index in range(200)]
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        list(executor.map(lambda city: fetch_weather(*city), calls))
+    # Expire the cache so the second round goes upstream again over the already-open connections
+    os.environ[CACHE_TTL_ENV_VAR] = "0"
+    for city in cities:
+        fetch_weather(*city)
+    elapsed_seconds = time.perf_counter() - started_at
+
+    stats = get_weather_stats()
+    print(f"{len(calls) + len(cities)} calls in {elapsed_seconds:.2f}s")
+    print(f"Stub server: {stub_counts['requests']} requests over {stub_counts['connections']} connections")
+    print(
+        f"Hits {stats['hits']}, coalesced {stats['coalesced']}, misses {stats['misses']}, "
+        f"hit rate {stats['hit_rate']:.1%}"
+    )
+    print("Upstream latency (ms): " + ", ".join(f"{name} {value * 1000:.1f}" for name, value in stats["upstream_latency"].items()))
+
+    # Batch vs one-by-one for distinct, uncached locations
+    batch = [{"city": f"City {location_index}", "country_code": "xx"} for location_index in range(10)]
+    started_at = time.perf_counter()
+    for location in batch:
+        fetch_weather(location["city"], location["country_code"])
+    serial_seconds = time.perf_counter() - started_at
+    started_at = time.perf_counter()
+    batch_results = fetch_weather_batch(batch)
+    batch_seconds = time.perf_counter() - started_at
+    print(
+        f"{len(batch)} locations: one by one {serial_seconds * 1000:.0f} ms, batch {batch_seconds * 1000:.0f} ms "
+        f"({sum('error' in result for result in batch_results)} errors)"
+    )
+    stub_server.shutdown()